@@ -0,0 +1,125 @@
+"""
+Acquisition benchmark
+=====================
+
+Measures the acquisition hot paths of the Operators without hardware:
+- throughput of the monitor loop of the Analog Discovery 2 Operator (with a SimulatedDfwController connected to a
+  simulated battery cell) for several sizes of the monitor buffer (plot_points), with and without streaming the samples
+  to disk, and of the BlinkOperator (with the BlinkController)
+- wall time of do_scan() of both Operators, and of the fast (device timed) scan of the Analog Discovery 2
+
+The monitor loops run unpaced (time_step 0), so the throughput is the maximum number of points per second. The
+throughput should not depend on plot_points, the monitor buffer is a ring buffer.
+
+Run (requires the packages of requirements.txt, see common.py):
+    python benchmarks/acquisition.py [--quick]
+
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from common import measure, print_results, result
+
+PLOT_POINTS = (100, 1000, 10000, 100000)
+
+
+def create_operator():
+    """Analog Discovery 2 Operator with a simulated device and cell."""
+    from Battery_Testing_Software.labphew.controller.digilent.waveforms import SimulatedDfwController
+    from Battery_Testing_Software.labphew.controller.digilent.battery_simulator import BatteryTestBench
+    from Battery_Testing_Software.labphew.model.analog_discovery_2_model import Operator
+    operator = Operator(SimulatedDfwController(simulator=BatteryTestBench()), properties={})
+    operator.load_config()
+    return operator
+
+
+def create_blink_operator():
+    """BlinkOperator with the (fake) BlinkController."""
+    from labphew.controller.blink_controller import BlinkController
+    from labphew.model.blink_model import BlinkOperator
+    operator = BlinkOperator(BlinkController(), properties={})
+    operator.load_config()
+    return operator
+
+
+def monitor_throughput(operator, duration):
+    """
+    Run the monitor loop of an Operator (in a thread, like a gui does) for a while.
+
+    :param operator: the Operator, with time_step 0 in its monitor properties
+    :type operator: OperatorBase
+    :param duration: time to run (s)
+    :type duration: float
+    :return: points per second and the 99th percentile of the time spent per point (s, None if not measured)
+    :rtype: float, float or None
+    """
+    operator.instrumentation.reset()
+    operator._allow_monitor = True
+    thread = threading.Thread(target=operator._monitor_loop, daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    time.sleep(duration)
+    operator._stop = True
+    thread.join()
+    elapsed = time.perf_counter() - start
+    operator._allow_monitor = False
+    stats = operator.stats()
+    step = stats['latency'].get('monitor_step')
+    return stats['counters'].get('monitor_samples', 0) / elapsed, step['p99'] if step else None
+
+
+def benchmark(quick=False):
+    """
+    :param quick: shorter runs and fewer buffer sizes (default False)
+    :type quick: bool
+    :return: results by name (see common.py)
+    :rtype: dict
+    """
+    duration = 0.5 if quick else 2.0
+    results = {}
+
+    operator = create_operator()
+    operator.properties['monitor']['time_step'] = 0
+    for plot_points in PLOT_POINTS[:2] if quick else PLOT_POINTS:
+        operator.properties['monitor']['plot_points'] = plot_points
+        rate, p99 = monitor_throughput(operator, duration)
+        results[f'monitor_ad2_{plot_points}_points'] = result(rate, 'points/s')
+        results[f'monitor_ad2_{plot_points}_points_step_p99'] = result(p99 * 1e6, 'us', 'lower')
+    with tempfile.TemporaryDirectory() as folder:
+        operator.properties['monitor']['plot_points'] = 1000
+        operator.start_recorder(os.path.join(folder, 'monitor.h5'))
+        rate, p99 = monitor_throughput(operator, duration)
+        operator.stop_recorder()
+    results['monitor_ad2_recording'] = result(rate, 'points/s')
+
+    blink = create_blink_operator()
+    blink.properties['monitor']['time_step'] = 0
+    results['monitor_blink'] = result(monitor_throughput(blink, duration)[0], 'points/s')
+
+    repeat = 3 if quick else 5
+    operator.properties['scan'].update(start=0, stop=5, step=0.005, stabilize_time=0, fast=False)  # 1001 points
+    results['do_scan_ad2_1001_points'] = result(measure(operator.do_scan, repeat)[0], 's', 'lower')
+    operator.properties['scan'].update(fast=True, step_time=1e-5, samples_per_step=20)
+    results['do_scan_ad2_fast_1001_points'] = result(measure(operator.do_scan, repeat)[0], 's', 'lower')
+
+    blink.properties['scan'].update(number_of_points=1000, time_between_points=0)
+    with contextlib.redirect_stdout(io.StringIO()):  # do_scan of the BlinkOperator prints its settings
+        results['do_scan_blink_1000_points'] = result(measure(blink.do_scan, repeat)[0], 's', 'lower')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the monitor loops and scans of the Operators')
+    parser.add_argument('--quick', action='store_true', help='shorter runs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    print_results(benchmark(args.quick))
+
+
+if __name__ == '__main__':
+    main()
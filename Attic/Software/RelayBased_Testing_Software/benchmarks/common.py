@@ -0,0 +1,147 @@
+"""
+Benchmark helpers
+=================
+
+Shared by the benchmark modules in this folder. Every module has a benchmark(quick=False) function that returns a
+dictionary of results by name, each result a dictionary with:
+- value: the measured number
+- unit: e.g. 'samples/s', 's' or 'MB/s'
+- better: 'higher' or 'lower', used by compare() to decide if a change is a regression
+
+run_benchmarks.py runs them all, saves the results with save_results() and compares them to a baseline.
+
+Importing this module makes labphew importable both ways the package uses: as labphew (the folder that contains it is
+added to sys.path) and as Battery_Testing_Software.labphew (see labphew.register_package_alias). The benchmarks can
+therefore run from a checkout without installing it, but they do need the requirements of labphew (see
+requirements.txt, e.g. h5py, netCDF4 and zarr). They use simulated devices, so dwf is not needed.
+
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))  # folder that contains the labphew package
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+import labphew
+labphew.register_package_alias()
+
+
+def result(value, unit, better='higher'):
+    """
+    :param value: the measured number
+    :type value: float
+    :param unit: unit of the value
+    :type unit: str
+    :param better: 'higher' or 'lower' (default 'higher')
+    :type better: str
+    :return: a result (see module docstring)
+    :rtype: dict
+    """
+    return {'value': float(value), 'unit': unit, 'better': better}
+
+
+def measure(function, repeat=5):
+    """
+    Call a function repeat times.
+
+    :param function: function without arguments
+    :type function: callable
+    :param repeat: number of calls (default 5)
+    :type repeat: int
+    :return: median and minimum duration of a call (s)
+    :rtype: float, float
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), min(times)
+
+
+def environment():
+    """
+    :return: description of the machine and software the benchmarks ran on, and the git commit of the repository
+    :rtype: dict
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    versions = {}
+    for module in ('numpy', 'xarray', 'netCDF4', 'zarr', 'h5py'):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'platform': platform.platform(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'versions': versions}
+
+
+def save_results(results, folder):
+    """
+    Save results (with the environment) to a json file named after the time and commit.
+
+    :param results: results by name
+    :type results: dict
+    :param folder: folder to save the file in (created if it doesn't exist)
+    :type folder: str
+    :return: path of the file
+    :rtype: str
+    """
+    info = environment()
+    os.makedirs(folder, exist_ok=True)
+    filename = os.path.join(folder, time.strftime('%Y%m%d-%H%M%S') + (f"_{info['commit']}" if info['commit'] else '')
+                            + '.json')
+    with open(filename, 'w') as f:
+        json.dump({'environment': info, 'results': results}, f, indent=2)
+    return filename
+
+
+def load_results(filename):
+    """
+    :param filename: file saved by save_results()
+    :type filename: str
+    :return: results by name
+    :rtype: dict
+    """
+    with open(filename, 'r') as f:
+        return json.load(f)['results']
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compare results to a baseline.
+
+    :param results: results by name
+    :type results: dict
+    :param baseline: results by name of an earlier run
+    :type baseline: dict
+    :param tolerance: relative change in the wrong direction that counts as a regression (default 0.25)
+    :type tolerance: float
+    :return: per result in both: name, baseline value, new value, relative change and whether it is a regression
+    :rtype: list of tuple
+    """
+    rows = []
+    for name, new in results.items():
+        old = baseline.get(name)
+        if old is None or not old['value']:
+            continue
+        change = (new['value'] - old['value']) / abs(old['value'])
+        worse = -change if new['better'] == 'higher' else change
+        rows.append((name, old['value'], new['value'], change, worse > tolerance))
+    return rows
+
+
+def print_results(results):
+    """Print results as a table."""
+    width = max((len(name) for name in results), default=0)
+    for name, r in results.items():
+        print(f"{name:<{width}}  {r['value']:>12.4g} {r['unit']:<10} ({r['better']} is better)")
@@ -0,0 +1,138 @@
+"""
+Control benchmark
+=================
+
+Measures the control hot paths without gui or hardware (see labphew.model.battery_control):
+- the rate the ControlLoop thread achieves next to a running monitor loop (Analog Discovery 2 Operator with a
+  SimulatedDfwController connected to a simulated cell) at the same rate, for targets of 100 and 1000 steps per second,
+  with the 99th percentile of the time per step and the fraction of missed deadlines. Steps without a new monitor point
+  are not counted (see ControlLoop.stale).
+- the maximum rate of control steps (coulomb counting and a PID update, without waiting)
+- the throughput of evaluate_control() (simulated cells times control steps per second), used to tune controllers
+
+Run (requires the packages of requirements.txt, see common.py):
+    python benchmarks/control.py [--quick]
+
+"""
+import argparse
+import logging
+import threading
+import time
+import numpy as np
+from common import measure, print_results, result
+from acquisition import create_operator
+
+TARGET_RATES = (100, 1000)  # control steps per second to run the ControlLoop at (Hz)
+
+
+def control_loop_rate(duration, period=0.001):
+    """
+    Run a constant current charge on a simulated cell with the monitor and control loop in their own threads.
+
+    :param duration: time to run (s)
+    :type duration: float
+    :param period: time between control steps and between monitor points (s) (default 0.001)
+    :type period: float
+    :return: control steps per second, 99th percentile of the time per step (s) and fraction of missed deadlines
+    :rtype: float, float, float
+    """
+    from Battery_Testing_Software.labphew.model.battery_control import ControlLoop
+    operator = create_operator()
+    operator.properties['monitor']['time_step'] = period
+    operator._allow_monitor = True
+    monitor = threading.Thread(target=operator._monitor_loop, daemon=True)
+    monitor.start()
+    control = ControlLoop(operator, period=period)
+    control.configure('cc_charge', 80)
+    start = time.perf_counter()
+    control.start()
+    time.sleep(duration)
+    control.stop()
+    elapsed = time.perf_counter() - start
+    operator._stop = True
+    monitor.join()
+    stats = operator.stats()
+    ticks = stats['latency']['control_lateness']['count']
+    missed = stats['counters'].get('control_deadline_misses', 0)
+    return control.steps / elapsed, stats['latency']['control_step']['p99'], missed / max(ticks + missed, 1)
+
+
+def control_step_rate(steps):
+    """
+    Apply control steps as fast as possible (what the ControlLoop thread does per new sample).
+
+    :param steps: number of steps
+    :type steps: int
+    :return: steps per second
+    :rtype: float
+    """
+    from Battery_Testing_Software.labphew.model.battery_control import ControlLoop
+    operator = create_operator()
+    operator.properties['monitor']['time_step'] = 0.01
+    control = ControlLoop(operator)
+    control.configure('cc_charge', 80)
+    control.start()  # creates the controller, the steps are applied without the thread
+    control.stop()
+    samples = np.array([[0.0], [3.7], [3.72]])  # time, analog in 1 and 2 of one new sample
+
+    def run():
+        for i in range(steps):
+            samples[0, 0] = i * 0.01
+            control.count_charge(*samples)
+            control.measured_voltage = samples[1, 0]
+            control.measured_current = control.current(samples[1, 0], samples[2, 0])
+            control.step(samples[0, 0])
+
+    return steps / measure(run, 3)[0]
+
+
+def evaluate_rate(cells, duration=60.0, period=0.05):
+    """
+    :param cells: number of simulated cells
+    :type cells: int
+    :param duration: simulated time (s) (default 60.0)
+    :type duration: float
+    :param period: time between control steps (s) (default 0.05)
+    :type period: float
+    :return: cell steps per second of evaluate_control()
+    :rtype: float
+    """
+    from Battery_Testing_Software.labphew.controller.digilent.battery_simulator import BatchTestBench, CellBatch
+    from Battery_Testing_Software.labphew.model.battery_control import evaluate_control
+    rng = np.random.default_rng(0)
+
+    def run():
+        bench = BatchTestBench(CellBatch(cells, r0=rng.uniform(0.3, 1.0, cells)))
+        evaluate_control('cc_charge', 80, bench, duration=duration, period=period)
+
+    return cells * round(duration / period) / measure(run, 3)[0]
+
+
+def benchmark(quick=False):
+    """
+    :param quick: shorter runs (default False)
+    :type quick: bool
+    :return: results by name (see common.py)
+    :rtype: dict
+    """
+    results = {}
+    for target in TARGET_RATES:
+        rate, p99, missed = control_loop_rate(1.0 if quick else 5.0, 1 / target)
+        results[f'control_loop_{target}hz'] = result(rate, 'steps/s')
+        results[f'control_loop_{target}hz_step_p99'] = result(p99 * 1e6, 'us', 'lower')
+        results[f'control_loop_{target}hz_missed'] = result(missed, 'fraction', 'lower')
+    results['control_step'] = result(control_step_rate(2000 if quick else 20000), 'steps/s')
+    results['evaluate_control_1000_cells'] = result(evaluate_rate(1000, 10.0 if quick else 60.0), 'cell steps/s')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the control loop')
+    parser.add_argument('--quick', action='store_true', help='shorter runs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    print_results(benchmark(args.quick))
+
+
+if __name__ == '__main__':
+    main()
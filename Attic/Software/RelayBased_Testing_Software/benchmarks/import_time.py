@@ -0,0 +1,86 @@
+"""
+Import time benchmark
+=====================
+
+Measures how long a plain "import labphew" takes (in a fresh interpreter) and checks that it doesn't import heavy
+modules (like pint, PyQt5 or the dwf library) as a side effect. It exits with an error if the median import time
+exceeds the limit or if any of those modules were imported, so it can be used to guard against regressions.
+
+Run from the folder that contains the labphew package:
+    python benchmarks/import_time.py [--repeat 10] [--limit 0.2]
+
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from common import result
+
+# Modules that should not be imported by "import labphew"
+HEAVY_MODULES = ['pint', 'PyQt5', 'dwf', 'pkg_resources', 'numpy', 'xarray', 'yaml', 'h5py', 'matplotlib']
+
+_SNIPPET = """
+import sys, time
+t0 = time.perf_counter()
+import labphew
+t1 = time.perf_counter()
+print(t1 - t0)
+print(','.join(m for m in {heavy} if m in sys.modules))
+"""
+
+
+def measure(repeat=10):
+    """
+    Import labphew in repeat fresh interpreters.
+
+    :param repeat: number of measurements (default 10)
+    :type repeat: int
+    :return: list of import times (s) and list of heavy modules that were imported
+    :rtype: list, list
+    """
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    times, imported = [], set()
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _SNIPPET.format(heavy=HEAVY_MODULES)], env=env, cwd=root,
+                             capture_output=True, text=True, check=True).stdout.splitlines()
+        times.append(float(out[0]))
+        imported.update(m for m in out[1].split(',') if m)
+    return times, sorted(imported)
+
+
+def benchmark(quick=False):
+    """
+    :param quick: fewer measurements (default False)
+    :type quick: bool
+    :return: results by name (see common.py)
+    :rtype: dict
+    """
+    times, imported = measure(5 if quick else 20)
+    return {'import_labphew': result(statistics.median(times) * 1000, 'ms', 'lower'),
+            'import_labphew_heavy_modules': result(len(imported), 'modules', 'lower')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the time of "import labphew"')
+    parser.add_argument('--repeat', type=int, default=10, help='number of measurements (default 10)')
+    parser.add_argument('--limit', type=float, default=0.2, help='maximum median import time in s (default 0.2)')
+    args = parser.parse_args()
+
+    times, imported = measure(args.repeat)
+    median = statistics.median(times)
+    print(f'import labphew: median {median * 1000:.1f} ms, min {min(times) * 1000:.1f} ms, '
+          f'max {max(times) * 1000:.1f} ms ({args.repeat} runs)')
+    failed = False
+    if imported:
+        print('FAIL: heavy modules imported as side effect: ' + ', '.join(imported))
+        failed = True
+    if median > args.limit:
+        print(f'FAIL: median import time exceeds limit of {args.limit * 1000:.0f} ms')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
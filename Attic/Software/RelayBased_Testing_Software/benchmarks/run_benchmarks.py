@@ -0,0 +1,70 @@
+"""
+Benchmark suite
+===============
+
+Runs the benchmarks of this folder against simulated devices (no hardware needed) and saves the results, so that
+regressions in the hot paths of labphew show up as numbers:
+- acquisition.py: monitor loop throughput for several plot_points, do_scan() wall time
+- control.py: rate and step time of the ControlLoop, evaluate_control() throughput
+- storage.py: save_scan() write, read and append throughput per file format and compression
+- import_time.py: time of "import labphew"
+
+The results are saved as a json file (named after the time and the git commit) in benchmarks/results, together with a
+description of the machine. Compare them to an earlier file to find regressions, it exits with an error if any result
+got worse by more than the tolerance (results of 0 in the baseline are skipped):
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/20261018-150000_29afbd2.json
+
+Only compare results from the same machine, and keep it otherwise idle while the benchmarks run. Use --quick for a
+short smoke test (its results are not comparable to a full run) and --only to run some of the benchmarks.
+
+Run from any folder, without installing labphew, but with its requirements installed (see common.py).
+
+"""
+import argparse
+import importlib
+import logging
+import os
+import sys
+import time
+from common import compare, load_results, print_results, save_results
+
+BENCHMARKS = ('acquisition', 'control', 'storage', 'import_time')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the labphew benchmarks and save the results',
+                                     epilog='Needs the requirements of labphew (requirements.txt), not an install.')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help='benchmarks to run')
+    parser.add_argument('--quick', action='store_true', help='short runs, for a smoke test')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results'),
+                        help='folder for the results (default benchmarks/results)')
+    parser.add_argument('--compare', default=None, help='results file of an earlier run to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative change that counts as regression (default 0.25)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    results = {}
+    for name in args.only:
+        start = time.perf_counter()
+        results.update(importlib.import_module(name).benchmark(args.quick))
+        print(f'{name}: {time.perf_counter() - start:.1f}s', file=sys.stderr)
+    print_results(results)
+    print(f'Results saved to {save_results(results, args.output)}')
+
+    if args.compare is None:
+        return 0
+    regressions = 0
+    print(f'\nCompared to {args.compare}:')
+    for name, old, new, change, regression in compare(results, load_results(args.compare), args.tolerance):
+        regressions += regression
+        print(f"{name:<40} {old:>12.4g} -> {new:<12.4g} {change:+7.1%}{'  REGRESSION' if regression else ''}")
+    if regressions:
+        print(f'FAIL: {regressions} results got worse by more than {args.tolerance:.0%}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
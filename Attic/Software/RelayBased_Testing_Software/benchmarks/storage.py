@@ -0,0 +1,93 @@
+"""
+Storage benchmark
+=================
+
+Measures save_scan() of the Analog Discovery 2 Operator for the storage backends (see labphew.core.tools.writers):
+- write and read throughput (MB/s of scan data) of a large scan, per file format and compression
+- the number of scans per second that can be appended as records to one file
+
+Run (requires the packages of requirements.txt, see common.py):
+    python benchmarks/storage.py [--quick]
+
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import warnings
+import numpy as np
+from common import measure, print_results, result
+from acquisition import create_operator
+
+# (extension, compression) of the backends to measure
+BACKENDS = (('.nc', None), ('.nc', 'zlib'), ('.zarr', None), ('.zarr', 'zlib'), ('.zarr', 'blosc_lz4'))
+
+
+def read(filename):
+    """Load all data of a saved scan."""
+    import xarray as xr
+    if filename.endswith('.zarr'):
+        with xr.open_zarr(filename) as data:
+            return data.load()
+    return xr.load_dataset(filename)
+
+
+def remove(filename):
+    if os.path.isdir(filename):
+        shutil.rmtree(filename)
+    elif os.path.exists(filename):
+        os.remove(filename)
+
+
+def benchmark(quick=False):
+    """
+    :param quick: smaller scans and fewer repeats (default False)
+    :type quick: bool
+    :return: results by name (see common.py)
+    :rtype: dict
+    """
+    points = 200000 if quick else 2000000
+    repeat = 3 if quick else 5
+    records = 20 if quick else 100
+    operator = create_operator()
+    results = {}
+    with tempfile.TemporaryDirectory() as folder, warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # e.g. zarr warns about consolidated metadata for every store
+        for extension, compression in BACKENDS:
+            name = extension[1:] + '_' + (compression or 'uncompressed')
+            filename = os.path.join(folder, 'scan' + extension)
+            operator.properties['scan']['storage'] = {'compression': compression, 'append': False}
+            operator.scan_voltages = np.linspace(0, 5, points)
+            operator.measured_voltages = np.sin(operator.scan_voltages) + np.random.normal(0, 0.001, points)
+            megabytes = 2 * points * 8 / 1e6
+
+            def write():
+                remove(filename)  # writing a new file is measured, not overwriting
+                operator.save_scan(filename)
+
+            results[f'save_scan_{name}_write'] = result(megabytes / measure(write, repeat)[0], 'MB/s')
+            results[f'save_scan_{name}_read'] = result(megabytes / measure(lambda: read(filename), repeat)[0], 'MB/s')
+
+            # Append many small scans (1001 points) as records to one file
+            remove(filename)
+            operator.scan_voltages = np.linspace(0, 5, 1001)
+            operator.measured_voltages = np.sin(operator.scan_voltages)
+            operator.properties['scan']['storage']['append'] = True
+            operator.save_scan(filename)  # creates the file, only the appends are measured
+            duration = measure(lambda: [operator.save_scan(filename) for _ in range(records)], 1)[0]
+            results[f'save_scan_{name}_append'] = result(records / duration, 'scans/s')
+            remove(filename)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark saving and loading scans')
+    parser.add_argument('--quick', action='store_true', help='smaller scans')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    print_results(benchmark(args.quick))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,7 @@ import dwf
 import numpy as np
 # import pyqtgraph as pg  # used for additional plotting features
 from PyQt5 import uic
-from PyQt5.QtCore import QTimer, QRectF
+from PyQt5.QtCore import QRectF
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import QIcon, QPixmap, QPainter
 
@@ -23,11 +23,15 @@ sys.path.append('../')
 import Battery_Testing_Software.labphew
 import logging
 import os
-from time import time
-from Battery_Testing_Software.labphew.core.tools.gui_tools import set_spinbox_stepsize, ValueLabelItem
+from time import strftime
+from Battery_Testing_Software.labphew.core.tools.gui_tools import set_spinbox_stepsize, ValueLabelItem, plot_width
+from Battery_Testing_Software.labphew.core.tools.buffers import ChunkedSampleStore
+from Battery_Testing_Software.labphew.core.tools.columnar import save_npy, save_csv
+from Battery_Testing_Software.labphew.core.tools.decimation import MinMaxDecimator
 from Battery_Testing_Software.labphew.core.base.general_worker import WorkThread
 from Battery_Testing_Software.labphew.core.base.view_base import MonitorWindowBase
 from Battery_Testing_Software.labphew.model.analog_discovery_2_model import Operator
+from Battery_Testing_Software.labphew.model.battery_control import ControlLoop, test_attributes
 
 
 class MonitorWindow(MonitorWindowBase):
@@ -58,10 +62,15 @@ class MonitorWindow(MonitorWindowBase):
         # For python generated UI
         # self.set_UI()
 
-        # create thread and timer objects for monitor
-        self.monitor_timer = QTimer()
-        self.monitor_timer.timeout.connect(self.update_monitor)
+        # create thread for monitor, it pushes all new samples to update_monitor (at most once per gui_refresh_time)
         self.monitor_thread = WorkThread(self.operator._monitor_loop)
+        self.monitor_publisher = self.monitor_thread.publish(
+            self.operator, 'new_monitor_data',
+            fetch=lambda: (self.operator.monitor_buffer.count, self.operator.monitor_buffer.snapshot()),
+            frame_interval=self.operator.properties['monitor']['gui_refresh_time'] / 1000)
+        self.monitor_publisher.data_ready.connect(self.update_monitor)
+        self.monitor_thread.finished.connect(self.monitor_finished)
+        self._last_sample_time = -np.inf  # time of the last sample added to test_data
 
         # set default tab modes # TODO: either read current tabs or update tabs to these values on startup
         self.test_selection = 0  # Type of test to run: CV (0) / CC (1) / CR (2)
@@ -78,6 +87,14 @@ class MonitorWindow(MonitorWindowBase):
 
         self.max_test_time = 0
 
+        # The control loop runs in its own thread, so its rate doesn't depend on the gui refresh
+        self.control = ControlLoop(self.operator, self.shunt_resistance)
+
+        # All samples of the current test (grows in chunks, so appending doesn't slow down during long tests)
+        self.test_data = ChunkedSampleStore(('time', 'voltage', 'current'))
+        # Min/max envelope of the voltage of the entire test, plotting it takes the same time however long the test is
+        self.voltage_trace = MinMaxDecimator()
+
     def set_graph(self):
         """Initialize setting for graphs"""
         self.graphicsView.setBackground('k')
@@ -157,14 +174,14 @@ class MonitorWindow(MonitorWindowBase):
             return
         else:
             if self.max_test_time > 0:
-                self.buffer_time = np.array([])
-                self.buffer_voltage = np.array([])
-                self.buffer_current = np.array([])
+                self.test_data.clear()
+                self.voltage_trace.clear()
+                self._last_sample_time = -np.inf
+                self.test_start_time = strftime('%d-%m-%YT%H:%M:%S')
+                self.operator.start_recorder(self.recording_filename())  # stream all samples to disk during the test
                 self.logger.debug('Starting monitor')
                 self.operator._allow_monitor = True  # enable operator monitor loop to run
                 self.monitor_thread.start()  # start the operator monitor
-                self.monitor_timer.start(
-                    int(self.operator.properties['monitor']['gui_refresh_time'] * 1000))  # start the update timer
                 # Disable UI Elements
                 self.start_button.setEnabled(False)
                 self.reset_button.setEnabled(False)
@@ -176,11 +193,8 @@ class MonitorWindow(MonitorWindowBase):
                 self.target_current_spinbox.setEnabled(False)
                 self.target_resistance_spinbox.setEnabled(False)
 
-                self.end_time = time() + (float(self.max_test_time) * 60)
-                self.out_voltage = self.operator.instrument.read_analog()[0]  # Start test at measured cell voltage
-                if self.test_type == 1:  # If Charge (0) / Discharge (1) / Impedance (2) mode is selected
-                    if self.test_selection == 2:  # If CV (0) / CC (1) / CR (2) test is selected
-                        self.run_cr_discharge_test(self.target_resistance)
+                self.end_time = self.operator.now() + (float(self.max_test_time) * 60)
+                self.start_control()
             else:
                 self.logger.warning("Set Max. Test Time > 0 to run a test")
 
@@ -191,6 +205,7 @@ class MonitorWindow(MonitorWindowBase):
         - flags the operator to stop
         - uses the Workthread stop method to wait a bit for the operator to finish, or terminate thread if timeout occurs
         """
+        self.control.stop()
         # TODO: add method to clean current test instead of this below line
         self.operator.pps_out(0, 0.6)
 
@@ -204,6 +219,7 @@ class MonitorWindow(MonitorWindowBase):
             self.monitor_thread.stop(self.operator.properties['monitor']['stop_timeout'])
             self.operator._allow_monitor = False  # disable monitor again
             self.operator._busy = False  # Reset in case the monitor was not stopped gracefully, but forcefully stopped
+            self.operator.stop_recorder(self.test_summary())
 
     def reset_test_button(self):
         self.logger.debug('Resetting monitor')
@@ -243,21 +259,41 @@ class MonitorWindow(MonitorWindowBase):
         ret = QMessageBox.question(self, 'ConfirmationBox', message, QMessageBox.Yes | QMessageBox.No)
         return True if ret == QMessageBox.Yes else False
 
+    def recording_filename(self):
+        """
+        Filename for streaming the data of a test to disk: next to the loaded test file (or in the folder of this
+        example if no test was loaded), with the start time appended.
+        """
+        if hasattr(self, 'test_config') and 'config_file' in self.test_config:
+            folder = os.path.dirname(self.test_config['config_file'])
+            name = os.path.splitext(self.test_config['test_file'])[0]
+        else:
+            folder, name = os.path.dirname(__file__), 'battery_test'
+        return os.path.join(folder, name + strftime('_%Y%m%d-%H%M%S') + '.h5')
+
     def export_raw_data(self):
+        """
+        Export the samples of the test (time, voltage and current) to a binary .npy file with a json sidecar (lossless
+        and fast, can be memory-mapped, see labphew.core.tools.columnar) or to a csv file.
+        """
         self.logger.debug("Saving Raw Data...")
-        import numpy
-        try:
-            a = numpy.asarray([self.buffer_time, self.buffer_voltage, self.buffer_current])
-
-            name, file_type = QFileDialog.getSaveFileName(self, 'Save Raw Data')
-            if name:
-                filename = name if ".csv" in name else name + ".csv"
-                numpy.savetxt(filename, a.T, delimiter=",", header="Time (s), Cell Voltage (V), Current (mA)", fmt='%1.3f')
-                self.logger.debug("Test " + filename + " saved")
+        if not len(self.test_data):
+            self.logger.error("No Data Collected to Export")
+            return
+        name, file_type = QFileDialog.getSaveFileName(self, 'Save Raw Data', '', 'NumPy binary (*.npy);;CSV (*.csv)')
+        if name:
+            filename = name
+            if os.path.splitext(name)[1].lower() not in ('.npy', '.csv'):
+                filename = name + ('.csv' if 'csv' in file_type.lower() else '.npy')
+            summary = self.test_summary()
+            if filename.lower().endswith('.csv'):
+                save_csv(filename, self.test_data, (self.charge_text(), 'Time (s), Cell Voltage (V), Current (mA)'))
             else:
-                self.logger.error("Raw Data Not Saved")
-        except AttributeError:
-            self.logger.error("No Data Collected to Export")  # An attribute error will be thrown as there is no self.buffer_time yet when tests have not run
+                save_npy(filename, self.test_data, units={'time': 's', 'voltage': 'V', 'current': 'mA'}, attrs=summary)
+            self.logger.debug("Test " + filename + " saved")
+            self.operator.add_to_catalog(filename, 'test', summary)
+        else:
+            self.logger.error("Raw Data Not Saved")
 
     def export_figure(self):
         self.logger.debug("Saving Figure...")
@@ -319,66 +355,36 @@ class MonitorWindow(MonitorWindowBase):
         self.max_current_spinbox.setValue(self.test_config['test']['max_current'])
         self.flow_rate_spinbox.setValue(self.test_config['test']['flow_rate'])
         self.shunt_resistance = self.test_config['hardware']['shunt_resistance']
+        self.control.shunt_resistance = self.shunt_resistance
+        self.control.counter.capacity = self.test_config['test'].get('capacity')  # optional, for the soc estimate
+        self.control.counter.initial_soc = self.test_config['test'].get('initial_soc')
         self.operator._set_monitor_time_step(self.test_config['test']['time_step'])
         self.operator._set_monitor_plot_points(self.test_config['test']['plot_points'])
         self.logger.debug('Parameters Updated')
 
-    def run_cv_charge_test(self, voltage, increment=0.01, margin=0):
+    def start_control(self):
         """
-        Feedback based; must be repeated throughout test.
-
-        :param voltage: desired voltage
-        :param increment: fixed amount to increment voltage per control loop to get desired current
-        :param margin: margin in V about where the loop will not react; the "allowed inaccuracy" that prevents the loop
-                       from over-controlling
-        """
-        self.operator.enable_pps(True)
-        if self.operator.analog_monitor_1[-1] < voltage - margin:
-            self.out_voltage += increment
-        elif self.operator.analog_monitor_1[-1] > voltage + margin:
-            self.out_voltage -= increment
-        self.operator.pps_out(0, self.out_voltage)
-        #print(self.out_voltage)
-
-    def run_cc_charge_test(self, current, increment=0.1, margin=5):
-        """
-        Feedback based; this method must be repeated throughout test.
-
-        :param current: desired charge current
-        :param increment: fixed amount to increment voltage per control loop to get desired current
-        :param margin: current margin in mA about where the loop will not react; the "allowed inaccuracy" that prevents
-                       the loop from over-controlling
-        """
-        self.operator.enable_pps(True)
-        if self.buffer_current[-1] < current - margin:
-            self.out_voltage += increment
-        elif self.buffer_current[-1] > current + margin:
-            self.out_voltage -= increment
-        self.operator.pps_out(0, self.out_voltage)
-        #print(self.buffer_current[-1], current, self.out_voltage)
-
-    def run_cr_discharge_test(self, resistance: float):
+        Configure the control loop for the selected test and start it.
+        The control loop regulates the output in its own thread, see labphew.model.battery_control.
         """
-        Only supports resistances mapped to control pins in the below dictionary.
-        Only should be run once on start of test.
-
-        :param resistance: desired load resistance
-        """
-        resistances = {512.0: [],
-                       225.0: [8],
-                       131.0: [8, 9],
-                       65.9: [8, 9, 10],
-                       32.9: [8, 9, 10, 11],
-                       16.9: [8, 9, 10, 11, 12],
-                       8.9: [8, 9, 10, 11, 12, 13]}
-        all_pins = resistances[8.9]
-        pins = resistances[resistance]
-        print(pins)
-        for pin in all_pins:    # Turn all pins off
-            # self.operator.write_digital(0, pin)
-            pass
-        for pin in pins:        # Turn desired pins on
-            self.operator.write_digital(1, pin)
+        mode, setpoint = None, 0
+        # TODO: implement discharge function
+        if self.test_type == 0:     # If Charge (0) / Discharge (1) / Impedance (2) mode is selected
+            if self.test_selection == 0:    # If CV (0) / CC (1) / CR (2) test is selected
+                mode, setpoint = 'cv_charge', self.target_voltage
+            elif self.test_selection == 1:  # If CV (0) / CC (1) / CR (2) test is selected
+                mode, setpoint = 'cc_charge', self.target_current
+        elif self.test_type == 1:   # If Charge (0) / Discharge (1) / Impedance (2) mode is selected
+            if self.test_selection == 1:    # If CV (0) / CC (1) / CR (2) test is selected
+                self.run_cc_discharge_test(self.target_current)
+            elif self.test_selection == 2:  # If CV (0) / CC (1) / CR (2) test is selected
+                mode, setpoint = 'cr_discharge', self.target_resistance
+        elif self.test_type == 2:   # If Charge (0) / Discharge (1) / Impedance (2) mode is selected
+            self.run_impedance_test()
+        settings = self.test_config.get('control') if hasattr(self, 'test_config') else None
+        self.control.configure(mode, setpoint, settings)
+        self.control.start()    # Starts the test at measured cell voltage
+        self.out_voltage = self.control.out_voltage
 
     def run_cc_discharge_test(self, current):   # TODO: Implement CC discharge
         pass
@@ -417,65 +423,88 @@ class MonitorWindow(MonitorWindowBase):
         self.plot_points_spinbox.setValue(self.operator.properties['monitor']['plot_points'])
         set_spinbox_stepsize(self.plot_points_spinbox)
 
-    def update_monitor(self):
+    def update_monitor(self, data):
         """
-        Checks if new data is available and updates the graph.
-        Checks if thread is still running and if not: stops timer and reset gui elements
-        (called by timer)
+        Adds the new samples to the test data and updates the graph (which shows the voltage of the entire test).
+        (called by the publisher of the monitor thread when there's new data, see WorkThread.publish)
+
+        :param data: number of samples appended to the monitor buffer (read before the snapshot) and a snapshot of it
+        :type data: (int, numpy.ndarray)
         """
         from datetime import timedelta
-        if self.operator._new_monitor_data:
-            self.operator._new_monitor_data = False
-            self.curve1.setData(self.operator.analog_monitor_time, self.operator.analog_monitor_1)
-            self.label_1.setValue(self.operator.analog_monitor_1[-1])
-            self.measured_voltage_lineedit.setText(str(round(self.operator.analog_monitor_2[-1], 2)))
-            shunt_voltage = self.operator.analog_monitor_2[-1] - self.operator.analog_monitor_1[-1]
-            shunt_voltage = shunt_voltage if shunt_voltage > 0 else 0
-            self.current = round((shunt_voltage / self.shunt_resistance) * 1000, 2)
-            self.measured_current_lineedit.setText(str(self.current))
-            time_elapsed = timedelta(seconds=round(self.operator.analog_monitor_time[-1], 1))
-
-            timestr = str(time_elapsed).split('.')  # TODO: this section needs a one-liner
-            if len(timestr) == 1:
-                timestr.append("00")
-            else:
-                timestr[1] = timestr[1][0:2]
-            self.time_elapsed_value.setText(".".join(timestr))
-
-            self.buffer_time = np.append(self.buffer_time, self.operator.analog_monitor_time[-1])
-            self.buffer_voltage = np.append(self.buffer_voltage, self.operator.analog_monitor_1[-1])
-            self.buffer_current = np.append(self.buffer_current, self.current)
-
-        if time() >= self.end_time:
+        count, (monitor_time, analog_1, analog_2) = data
+        n = min(count, len(monitor_time))  # the last n samples of the snapshot are measured (not initial values)
+        if n == 0:
+            return
+        self.label_1.setValue(analog_1[-1])
+        self.measured_voltage_lineedit.setText(str(round(analog_2[-1], 2)))
+        self.current = self.control.current(analog_1[-1], analog_2[-1])
+        self.measured_current_lineedit.setText(str(self.current))
+        time_elapsed = timedelta(seconds=round(monitor_time[-1], 1))
+
+        timestr = str(time_elapsed).split('.')  # TODO: this section needs a one-liner
+        if len(timestr) == 1:
+            timestr.append("00")
+        else:
+            timestr[1] = timestr[1][0:2]
+        self.time_elapsed_value.setText(".".join(timestr))
+
+        # All samples since the previous update (a frame may contain several samples)
+        new = monitor_time[-n:] > self._last_sample_time
+        if new.any():
+            times = monitor_time[-n:][new]
+            currents = self.control.current(analog_1[-n:][new], analog_2[-n:][new])
+            self.test_data.extend(np.vstack((times, analog_1[-n:][new], currents)))
+            self._last_sample_time = times[-1]
+            self.voltage_trace.resize(plot_width(self.plot1))
+            self.voltage_trace.extend(times, analog_1[-n:][new])
+            self.curve1.setData(*self.voltage_trace.data())
+
+        self.statusbar.showMessage(self.charge_text())
+
+        if self.operator.now() >= self.end_time:
             self.stop_test_button()
 
-        # TODO: implement discharge function
-        if self.test_type == 0:     # If Charge (0) / Discharge (1) / Impedance (2) mode is selected
-            if self.test_selection == 0:    # If CV (0) / CC (1) / CR (2) test is selected
-                self.run_cv_charge_test(self.target_voltage)
-            elif self.test_selection == 1:  # If CV (0) / CC (1) / CR (2) test is selected
-                self.run_cc_charge_test(self.target_current)
+        self.out_voltage = self.control.out_voltage  # only for display, the control loop sets the output
 
-        elif self.test_type == 1:   # If Charge (0) / Discharge (1) / Impedance (2) mode is selected
-            if self.test_selection == 1:    # If CV (0) / CC (1) / CR (2) test is selected
-                self.run_cc_discharge_test(self.target_resistance)
+    def charge_text(self):
+        """Running totals of the coulomb counter of the control loop, as text."""
+        counter = self.control.counter
+        text = f'Charge: {counter.charge:.3f} mAh   Energy: {counter.energy:.3f} mWh'
+        if counter.soc is not None:
+            text += f'   SoC: {counter.soc * 100:.1f}%'
+        return text
 
-        elif self.test_type == 2:   # If Charge (0) / Discharge (1) / Impedance (2) mode is selected
-            self.run_impedance_test()
+    def test_summary(self):
+        """
+        Attributes of the last test for the run catalog (see labphew.core.tools.catalog): the fields of the loaded test
+        file, the mode and setpoint of the control loop, the start time and the totals of the coulomb counter.
+        """
+        summary = test_attributes(self.test_config) if hasattr(self, 'test_config') else {}
+        summary.update(mode=self.control.mode, setpoint=self.control.setpoint, **self.control.counter.totals())
+        if hasattr(self, 'test_start_time'):
+            summary['time'] = self.test_start_time
+        return summary
 
-        if self.monitor_thread.isFinished():
-            self.logger.debug('Monitor thread is finished')
-            self.monitor_timer.stop()
-            # RE-Enable UI Elements
-            self.start_button.setEnabled(True)
-            self.reset_button.setEnabled(True)
-            self.charge_radiobutton.setEnabled(True)
-            self.discharge_radiobutton.setEnabled(True)
-            self.target_selection_tabs.setEnabled(True)
-            self.test_mode_tabs.setEnabled(True)
-            self.target_voltage_spinbox.setEnabled(True)
-            self.target_current_spinbox.setEnabled(True)
-            self.target_resistance_spinbox.setEnabled(True)
+    def monitor_finished(self):
+        """
+        Stops the control loop and recording, and resets gui elements when the monitor thread is finished.
+        (called by the finished signal of the monitor thread)
+        """
+        self.logger.debug('Monitor thread is finished')
+        self.control.stop()
+        self.operator.stop_recorder(self.test_summary())
+        self.logger.info(self.charge_text())
+        # RE-Enable UI Elements
+        self.start_button.setEnabled(True)
+        self.reset_button.setEnabled(True)
+        self.charge_radiobutton.setEnabled(True)
+        self.discharge_radiobutton.setEnabled(True)
+        self.target_selection_tabs.setEnabled(True)
+        self.test_mode_tabs.setEnabled(True)
+        self.target_voltage_spinbox.setEnabled(True)
+        self.target_current_spinbox.setEnabled(True)
+        self.target_resistance_spinbox.setEnabled(True)
 
     def closeEvent(self, event):
         """ Gets called when the window is closed. Could be used to do some cleanup before closing. """
@@ -486,8 +515,9 @@ class MonitorWindow(MonitorWindowBase):
         if reply == QMessageBox.No:
             event.ignore()
             return
+        self.control.stop()  # stop control loop if it was running
         self.stop_monitor()  # stop monitor if it was running
-        self.monitor_timer.stop()  # stop monitor timer, just to be nice
+        self.monitor_publisher.close()  # stop pushing data to the gui
         # Close all child scan windows
         for scan_win in self.scan_windows.values():
             scan_win[0].close()
@@ -496,7 +526,8 @@ class MonitorWindow(MonitorWindowBase):
 
 
 if __name__ == "__main__":
-    import Battery_Testing_Software.labphew  # import this to use labphew style logging
+    import Battery_Testing_Software.labphew
+    Battery_Testing_Software.labphew.configure_logging()  # use labphew style logging
     import sys
     from PyQt5.QtWidgets import QApplication
 
@@ -506,9 +537,11 @@ if __name__ == "__main__":
 
     # To test with simulated device
     # from labphew.controller.digilent.waveforms import SimulatedDfwController as DfwController
-    # TODO: add simulated device functions
+    # To test with a simulated battery cell, running 100x faster than real time (use together with the line above)
+    # from labphew.controller.digilent.battery_simulator import BatteryTestBench
+    # simulator = BatteryTestBench(speed=100)
     try:
-        instrument = DfwController()
+        instrument = DfwController()  # for the simulated cell: DfwController(simulator=simulator)
         opr = Operator(instrument)  # Create operator instance
         opr.load_config()
     except dwf.DWFError as err:
@@ -103,7 +103,8 @@ class BlinkController:
 
 
 if __name__ == "__main__":
-    import labphew  # Import labphew, for labphew style logging
+    import labphew
+    labphew.configure_logging()  # use labphew style logging
 
     device = BlinkController()
     print('The state if the device is:', device.get_status())
@@ -149,10 +149,8 @@ class BlinkOperator(OperatorBase):
 
             # The remainder of the loop adds functionality to plot data and pause and stop the scan when it's run from a gui:
             self._new_scan_data = True
-            # before the end of the loop: halt if pause is True
-            while self._pause:
-                sleep(0.05)
-                if self._stop: break
+            # before the end of the loop: halt while pause is True (returns immediately on resume or stop)
+            self._wait_while_paused()
             # if (soft) stop was requested, break out of loop
             if self._stop:
                 break
@@ -254,7 +252,8 @@ class BlinkOperator(OperatorBase):
 
 
 if __name__ == "__main__":
-    import labphew   # import this to use labphew style logging (by importing it before matplotlib it also prevents matplotlib from printing many debugs)
+    import labphew
+    labphew.configure_logging()  # use labphew style logging (by configuring it before matplotlib this also prevents matplotlib from printing many debugs)
     import matplotlib.pyplot as plt
 
     from my_blink_controller import BlinkController
@@ -383,7 +383,8 @@ class ScanWindow(ScanWindowBase):
 if __name__ == '__main__':
     from my_blink_controller import BlinkController
     from my_blink_model import BlinkOperator
-    import Battery_Testing_Software.labphew  # import this to use labphew style logging
+    import Battery_Testing_Software.labphew
+    Battery_Testing_Software.labphew.configure_logging()  # use labphew style logging
 
     import platform
 
@@ -15,11 +15,11 @@ Or from an interactive python console:
 
 """
 
-# Get the version from the package setup.py file
-from pkg_resources import get_distribution
+# Get the version from the installed package metadata (importlib.metadata is much faster than pkg_resources)
+from importlib.metadata import version as _version, PackageNotFoundError as _PackageNotFoundError
 try:
-    __version__ = get_distribution("labphew").version
-except:
+    __version__ = _version("labphew")
+except _PackageNotFoundError:
     __version__ = "unknown"
 
 import os
@@ -27,27 +27,69 @@ package_path = os.path.dirname(os.path.abspath(__file__))
 repository_path = os.path.abspath(os.path.join(package_path, os.pardir))
 parent_path = os.path.abspath(os.path.join(repository_path, os.pardir))
 
-from pint import UnitRegistry
-ureg = UnitRegistry()
-Q_ = ureg.Quantity
+# Note that importing labphew should be fast and free of side effects. Therefore the unit registry is only created when
+# it's used for the first time, logging is only configured when configure_logging() is called and the modules for
+# labphew.start are only imported when they are started.
+
+
+def __getattr__(name):
+    """Create the pint unit registry (ureg) and Quantity (Q_) on first use."""
+    if name in ('ureg', 'Q_'):
+        from pint import UnitRegistry
+        global ureg, Q_
+        ureg = UnitRegistry()
+        Q_ = ureg.Quantity
+        return globals()[name]
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
 
 import logging
-# Set standard logging format and level.
-# (To use this, do 'import labphew' in your module)
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="[%(asctime)s] %(levelname)-8s: %(message)-50s  [%(lineno)d %(name)s]",
-    datefmt='%H:%M:%S')
 
-# Matplotlib uses the default logger and by setting the level to DEBUG in basicConfig, matplotlib will print a lot of
-# debug statements. We prevent that by the logger used by matplotlib manually to level WARNING
-logging.getLogger('matplotlib').setLevel(logging.WARNING)
+
+def configure_logging(level=logging.DEBUG):
+    """
+    Set standard labphew logging format and level.
+    Call this at the start of a script or main() function (don't call it from modules that are imported by others).
+
+    :param level: logging level (default logging.DEBUG)
+    :type level: int
+    """
+    logging.basicConfig(
+        level=level,
+        format="[%(asctime)s] %(levelname)-8s: %(message)-50s  [%(lineno)d %(name)s]",
+        datefmt='%H:%M:%S')
+
+    # Matplotlib uses the default logger and by setting the level to DEBUG in basicConfig, matplotlib will print a lot
+    # of debug statements. We prevent that by the logger used by matplotlib manually to level WARNING
+    logging.getLogger('matplotlib').setLevel(logging.WARNING)
+
+
+def register_package_alias(name='Battery_Testing_Software'):
+    """
+    Make labphew also importable as Battery_Testing_Software.labphew, the name by which the battery modules (e.g. the
+    orchestrator and the Analog Discovery 2 Operator) import it, if no package with that name can be imported.
+    The folder that contains labphew is then registered as that package. Called by the command line interface and the
+    benchmarks, so that they work from a checkout or a plain install.
+
+    :param name: name of the package (default 'Battery_Testing_Software')
+    :type name: str
+    """
+    import sys
+    import importlib.util
+    from importlib.machinery import ModuleSpec
+    if name in sys.modules or importlib.util.find_spec(name) is not None:
+        return
+    spec = ModuleSpec(name, None, is_package=True)
+    spec.submodule_search_locations = [repository_path]
+    sys.modules[name] = importlib.util.module_from_spec(spec)
+
 
 from importlib import import_module
 class _Start:
     """
     Calls the main() function of a module in the root of the package.
     The name of the module may be passed as the first argument, or accessed as an attribute.
+    The module is only imported when it is started (or when add_module_main() is called).
 
     Example usages:
     >>> labphew.start('blink', 'optional_config_file_name.yml')
@@ -57,25 +99,34 @@ class _Start:
     def __init__(self):
         self.__modules = {}
 
-        for file in os.listdir(package_path):
-            if file.endswith('.py') and not file.startswith('__'):
-                self.add_module_main(file[:-3])
+    def modules(self):
+        """Names of the modules in the root of the package that could be started."""
+        return [file[:-3] for file in sorted(os.listdir(package_path))
+                if file.endswith('.py') and not file.startswith('__')]
 
     def add_module_main(self, name):
         try:
-            mod = import_module('labphew.'+name)
-            self.__setattr__(name, getattr(mod, 'main'))
+            mod = import_module(__name__ + '.' + name)
             self.__modules[name] = getattr(mod, 'main')
         except:
             return
+        return self.__modules[name]
+
+    def __dir__(self):
+        return list(super().__dir__()) + self.modules()
 
     def __getattr__(self, name):
-        print('ERROR: Module {}.py does was not found or failed to import'.format(name))
+        if name.startswith('_'):
+            raise AttributeError(name)
+        main = self.__modules.get(name) or self.add_module_main(name)
+        if main is None:
+            print('ERROR: Module {}.py does was not found or failed to import'.format(name))
+        return main
 
     def __call__(self, *args, **kwargs):
         if len(args) < 1:
             print('ERROR')
             return
-        return self.__getattribute__(args[0])(*args[1:])
+        return getattr(self, args[0])(*args[1:])
 
 start = _Start()
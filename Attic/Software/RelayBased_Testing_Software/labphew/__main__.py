@@ -6,20 +6,64 @@ It takes two arguments that is the name of the example and a path to the configu
 
     $ labphew start blink -default
 
+Battery tests (test yml files like examples/101_project/current_test_example.yml) can also be run without gui, e.g. on
+a server or in CI against a simulated device. The samples are streamed to an HDF5 file next to the test file and the
+test stops at max_test_time or when a voltage or current limit is exceeded:
+
+    $ labphew run current_test_example.yml --device simulated --speed 10
+
+The exit code is 0 if every test completed: it ran until max_test_time, or a discharge reached min_test_voltage. It is
+1 if a test was aborted (a limit was exceeded, the monitor stopped, Ctrl+C) or could not be started.
+
+A rack file (see labphew.model.orchestrator) runs the tests of several cells at once. Use labphew run -h for options.
+The timing statistics of the acquisition and control loops are logged at the end of every test, with --stats-port they
+can also be followed while the tests run (e.g. curl localhost:9100/metrics).
+
+Exported and recorded tests (csv, npy, netCDF or HDF5 files, or folders containing them) can be analysed in parallel, the
+results (capacity, energy, efficiencies, overpotential) are saved to a csv file. Use labphew analyse -h for options:
+
+    $ labphew analyse campaign_folder --direction charge --output summary.csv
+
+Every record of a netCDF file with records (scans appended by save_scan) is analysed separately. Variables with other
+names than time, voltage and current can be mapped with e.g. --columns voltage=cell_voltage current=cell_current.
+
+Saved scans, exported tests and recordings are added to a run catalog if the catalog key of the config is set (or with
+labphew run --catalog). Existing files can be added to it and runs can be found by their attributes (see
+labphew.core.tools.catalog). Use labphew catalog -h for options:
+
+    $ labphew catalog runs.sqlite --index data_folder
+    $ labphew catalog runs.sqlite --kind recording --since 2026-09-01 mode=cc_charge setpoint=80 cell=cell_1
+
 """
 import sys
+import logging
+import yaml
 import labphew
 import os
 import glob
+import argparse
+from datetime import datetime
+from time import strftime
 # from PyQt5.QtWidgets import QApplication, QFileDialog
 # from time import time
 
+# The battery modules import labphew as Battery_Testing_Software.labphew. This is done on import (not in main()) so that
+# it also happens in the worker processes of labphew analyse that are spawned (they import this module again).
+labphew.register_package_alias()
+
 def main():
     """Starts the GUI for the application using the config file specified as system argument.
     """
 
     # note: 0th argument will be labphew
 
+    if len(sys.argv) > 1 and sys.argv[1] == 'run':
+        return run(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'analyse':
+        return analyse(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'catalog':
+        return catalog(sys.argv[2:])
+
     if len(sys.argv) < 3 or sys.argv[1] != 'start':
         show_help()
         return
@@ -39,6 +83,161 @@ def main():
     except:
         return
 
+def run(args):
+    """
+    Run a battery test (or a rack of tests) without gui, see labphew run -h.
+
+    :param args: command line arguments after 'run'
+    :type args: list of str
+    :return: exit code: 0 if all tests completed (max_test_time, or min_test_voltage of a discharge), 1 otherwise
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(prog='labphew run', description='Run battery tests without gui.',
+                                     epilog='Exits with 0 if all tests completed (max_test_time, or min_test_voltage '
+                                            'of a discharge), 1 if a test was aborted.')
+    parser.add_argument('test_file', help='test yml file, or rack yml file with a list of cells')
+    parser.add_argument('--device', default='0', help='device number, or simulated (default 0, ignored for a rack)')
+    parser.add_argument('--speed', type=float, default=None, help='speed of the clock of simulated devices')
+    parser.add_argument('--output', default=None, help='folder for the recordings (default: folder of the test file)')
+    parser.add_argument('--no-record', action='store_true', help="don't stream the samples to disk")
+    parser.add_argument('--status-interval', type=float, default=10, help='seconds between status logs (default 10)')
+    parser.add_argument('--operator-config', default=None, help='config file for the Operator')
+    parser.add_argument('--catalog', default=None, help='run catalog (SQLite file) to add the recordings to')
+    parser.add_argument('--stats-port', type=int, default=None,
+                        help='serve the timing stats (Prometheus text format) on this port of localhost')
+    options = parser.parse_args(args)
+
+    labphew.configure_logging(logging.INFO)
+    from Battery_Testing_Software.labphew.model.orchestrator import Orchestrator
+    with open(options.test_file, 'r') as f:
+        is_rack = 'cells' in yaml.safe_load(f)
+    if is_rack:
+        orchestrator = Orchestrator.from_file(options.test_file, simulation_speed=options.speed)
+    else:
+        orchestrator = Orchestrator(status_interval=options.status_interval, simulation_speed=options.speed or 1.0)
+        device = options.device if options.device == 'simulated' else int(options.device)
+        orchestrator.add_test_file(options.test_file, device=device, operator_config=options.operator_config)
+    if options.catalog is not None:
+        orchestrator.catalog = options.catalog
+    if options.stats_port is not None:
+        orchestrator.stats_port = options.stats_port
+    if options.no_record:
+        orchestrator.recording_folder = None
+    elif options.output is not None:
+        orchestrator.recording_folder = options.output
+    elif not is_rack:  # a rack file specifies its own recording folder
+        orchestrator.recording_folder = os.path.dirname(os.path.abspath(options.test_file))
+
+    status = orchestrator.run()
+    orchestrator.close()
+    if orchestrator.recording_folder is not None:
+        summary_file = os.path.join(orchestrator.recording_folder, 'summary' + strftime('_%Y%m%d-%H%M%S') + '.yml')
+        with open(summary_file, 'w') as f:
+            yaml.safe_dump(status, f, sort_keys=False)
+        logging.info(f'Summary saved to {summary_file}')
+    return 0 if all(cell['completed'] for cell in status['cells']) else 1
+
+
+def analyse(args):
+    """
+    Analyse exported or recorded battery tests, see labphew analyse -h.
+
+    :param args: command line arguments after 'analyse'
+    :type args: list of str
+    :return: exit code: 0 if all files (and all records in them) were analysed, 1 otherwise
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(prog='labphew analyse', description='Analyse battery test files in parallel.')
+    parser.add_argument('paths', nargs='+', help='csv, npy, nc or h5 files, or folders to search (recursively) for them')
+    parser.add_argument('--direction', choices=('charge', 'discharge', 'signed'), default=None,
+                        help='direction of the current (default: mode stored in the file, or charge)')
+    parser.add_argument('--emf', type=float, default=None, help='emf of the cell in V (default: fitted)')
+    parser.add_argument('--shunt-resistance', type=float, default=0.24, help='for h5 recordings (default 0.24)')
+    parser.add_argument('--columns', nargs='+', default=[], metavar='KEY=NAME',
+                        help='names of the time, voltage and/or current variables in nc and npy files, '
+                             'e.g. voltage=measured_voltage (default: time, voltage and current)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: number of cpus)')
+    parser.add_argument('--output', default='analysis_summary.csv', help='csv file for the results')
+    options = parser.parse_args(args)
+    columns = dict(column.partition('=')[::2] for column in options.columns)
+    if not all(key in ('time', 'voltage', 'current') and name for key, name in columns.items()):
+        parser.error('--columns should be time=NAME, voltage=NAME and/or current=NAME')
+
+    labphew.configure_logging(logging.INFO)
+    from Battery_Testing_Software.labphew.model.battery_analysis import analyse_files, find_files, save_summary
+    files = find_files(options.paths)
+    if not files:
+        logging.error('No files to analyse')
+        return 1
+    results = analyse_files(files, workers=options.workers, direction=options.direction, emf=options.emf,
+                            columns=columns, shunt_resistance=options.shunt_resistance)
+    save_summary(results, options.output)
+    return 0 if all('error' not in result for result in results) else 1
+
+
+def catalog(args):
+    """
+    Add files to a run catalog and find runs in it, see labphew catalog -h.
+
+    :param args: command line arguments after 'catalog'
+    :type args: list of str
+    :return: exit code: 0 if runs were found (or all files were added), 1 otherwise
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(prog='labphew catalog', description='Index saved runs and find them.')
+    parser.add_argument('catalog', help='SQLite file of the catalog (created if it does not exist)')
+    parser.add_argument('conditions', nargs='*',
+                        help='attribute=value, or attribute=min..max for a range (e.g. mode=cc_charge setpoint=80)')
+    parser.add_argument('--kind', default=None, help='scan, test or recording')
+    parser.add_argument('--since', default=None, help='only runs from this date on (e.g. 2026-09-01)')
+    parser.add_argument('--until', default=None, help='only runs before this date')
+    parser.add_argument('--limit', type=int, default=None, help='maximum number of runs to list')
+    parser.add_argument('--index', nargs='+', default=[],
+                        help='nc, h5, zarr or npy files, or folders, to add first (files already in the catalog are skipped)')
+    parser.add_argument('--prune', action='store_true', help='remove runs of files that do not exist anymore')
+    options = parser.parse_intermixed_args(args)
+
+    labphew.configure_logging(logging.INFO)
+    from Battery_Testing_Software.labphew.core.tools.catalog import RunCatalog
+    where = {}
+    for condition in options.conditions:
+        key, _, value = condition.partition('=')
+        if '..' in value:
+            where[key] = tuple(float(bound) if bound else None for bound in value.split('..', 1))
+        else:
+            try:
+                where[key] = float(value)
+            except ValueError:
+                where[key] = value
+    failed = False
+    with RunCatalog(options.catalog) as run_catalog:
+        for path in options.index:
+            files = [path]
+            if os.path.isdir(path) and not path.rstrip('/\\').endswith('.zarr'):
+                files = sorted(filename for extension in ('nc', 'h5', 'zarr', 'npy')
+                               for filename in glob.glob(os.path.join(path, '**', '*.' + extension), recursive=True))
+            for filename in files:
+                if filename in run_catalog:
+                    continue
+                try:
+                    run_catalog.index_file(filename)
+                except Exception as error:
+                    logging.error(f'Adding {filename} failed: {error}')
+                    failed = True
+        if options.prune:
+            logging.info(f'{run_catalog.prune()} missing files removed')
+        if options.index and not options.conditions and options.kind is None and options.since is None \
+                and options.until is None:
+            logging.info(f'{len(run_catalog)} runs in {options.catalog}')
+            return 1 if failed else 0
+        runs = run_catalog.find(options.kind, options.since, options.until, where, options.limit)
+    for run in runs:
+        record = '' if run.record is None else f' (record {run.record})'
+        print(f"{datetime.fromtimestamp(run.time):%Y-%m-%d %H:%M:%S}  {run.kind:<10} {run.path}{record}")
+    logging.info(f'{len(runs)} runs found')
+    return 0 if runs and not failed else 1
+
+
 def show_help():
     yml_path = os.path.join(labphew.repository_path, 'examples', 'default_config', 'blink_config.yml')
     print('\n'+help_message.format(yml_path))
@@ -59,7 +258,16 @@ labphew start blink {}
 
 For blink (and other files where it's implemented) you could use -default or -d for the config file
 and -browse or -b to open a browse window.
+
+To run a battery test without gui:
+labphew run test_file.yml [--device simulated]
+
+To analyse exported or recorded battery tests:
+labphew analyse files_or_folders [--direction charge]
+
+To find saved runs in a run catalog:
+labphew catalog runs.sqlite [attribute=value ...] [--kind recording] [--since 2026-09-01]
 """
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
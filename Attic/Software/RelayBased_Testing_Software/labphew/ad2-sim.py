@@ -22,6 +22,7 @@ def main(config_file = None):
     :param config_file: optional path to config file
     :type config_file: str
     """
+    labphew.configure_logging()
     os.environ['QT_MAC_WANTS_LAYER'] = '1'
     # If -browse (or -b) is used for config_file, display an open file dialog:
     if config_file=='-browse' or config_file=='-b':
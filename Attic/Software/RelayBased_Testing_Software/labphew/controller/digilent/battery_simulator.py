@@ -0,0 +1,418 @@
+"""
+=================
+Battery Simulator
+=================
+
+Simulation of the battery tester hardware, to be used as backend of SimulatedDfwController:
+
+    from labphew.controller.digilent.battery_simulator import BatteryTestBench
+    from labphew.controller.digilent.waveforms import SimulatedDfwController
+    bench = BatteryTestBench(speed=100)  # runs 100x faster than real time
+    instrument = SimulatedDfwController(simulator=bench)
+
+The cell is modelled as an equivalent circuit: an open circuit voltage that depends on the state of charge (OCV(SoC)),
+a series resistance (R0) and one or more RC pairs (for the slower polarization), and it has a finite capacity.
+
+The test bench connects the cell like the battery tester does:
+- the programmable power supply (pps V+) charges the cell through the shunt resistor
+- analog in 1 measures the cell voltage, analog in 2 measures the voltage on the pps side of the shunt, so the
+  current is (analog in 2 - analog in 1) / shunt resistance
+- the relay load bank is connected over the cell, its resistance is selected with digital pins (see LOAD_RESISTANCES
+  in labphew.model.battery_control)
+
+Time is kept by a VirtualClock, which can run (much) faster than real time. A SimulatedDfwController with a
+simulator exposes that clock, which is then used by the Operator (and the Pacers of its loops).
+Note that the loops still have to keep up in real time: with speed 100 a monitor time_step of 0.05s leaves only 0.5ms
+per point. Increase the time_step with the speed (and keep in mind that control gains are tuned for a time_step).
+
+To evaluate controller settings offline, CellBatch and BatchTestBench simulate many independent cells at once (each
+with its own parameters) with numpy arrays, without a clock: BatchTestBench.step() advances all cells by a given time.
+See evaluate_control() in labphew.model.battery_control.
+
+"""
+import logging
+import threading
+import numpy as np
+from Battery_Testing_Software.labphew.core.tools.timing import VirtualClock
+from Battery_Testing_Software.labphew.model.battery_control import LOAD_RESISTANCES
+
+# Default open circuit voltage (V) as function of state of charge
+DEFAULT_OCV = ([0.0, 0.05, 0.1, 0.2, 0.4, 0.6, 0.8, 0.9, 0.95, 1.0],
+               [3.0, 3.3, 3.45, 3.55, 3.65, 3.75, 3.9, 3.98, 4.05, 4.2])
+
+
+def solve_circuit(pps_voltage, pps_enabled, emf, r0, shunt_resistance, load_resistance):
+    """
+    Solve the circuit of the test bench: the power supply charges the cell (emf behind r0) through the shunt resistor
+    and the load is connected over the cell. The power supply can only source current. Accepts numpy arrays.
+
+    :param pps_voltage: voltage of the power supply (V)
+    :param pps_enabled: whether the power supply is enabled
+    :param emf: voltage of the cell behind its series resistance (V)
+    :param r0: series resistance of the cell (Ohm)
+    :param shunt_resistance: resistance of the shunt resistor (Ohm)
+    :param load_resistance: resistance of the load bank (Ohm)
+    :return: cell voltage (V), shunt current (A) and cell current (A, positive for charging)
+    """
+    g_load = 1 / load_resistance
+    g_cell = 1 / r0
+    g_shunt = 1 / shunt_resistance
+    charging = (pps_voltage * g_shunt + emf * g_cell) / (g_shunt + g_cell + g_load)
+    i_shunt = (pps_voltage - charging) * g_shunt
+    sourcing = np.logical_and(pps_enabled, i_shunt > 0)
+    voltage = np.where(sourcing, charging, emf * g_cell / (g_cell + g_load))
+    i_shunt = np.where(sourcing, i_shunt, 0.0)
+    return voltage, i_shunt, (voltage - emf) * g_cell
+
+
+class EquivalentCircuitCell:
+    """
+    Equivalent circuit model of a battery cell: OCV(SoC) in series with R0 and RC pairs.
+    Currents are in Ampere and are positive when charging.
+    """
+
+    def __init__(self, capacity=200.0, r0=0.5, rc_pairs=((0.2, 500.0),), ocv=DEFAULT_OCV, soc=0.5):
+        """
+        :param capacity: capacity of the cell (mAh) (default 200.0)
+        :type capacity: float
+        :param r0: series resistance (Ohm) (default 0.5)
+        :type r0: float
+        :param rc_pairs: resistance (Ohm) and capacitance (F) of each RC pair (default ((0.2, 500.0),))
+        :type rc_pairs: list of tuple
+        :param ocv: state of charge points (0 to 1) and the corresponding open circuit voltages (V)
+        :type ocv: tuple of lists
+        :param soc: initial state of charge (0 to 1) (default 0.5)
+        :type soc: float
+        """
+        self.capacity = capacity
+        self.r0 = r0
+        self.rc_r = np.array([r for r, c in rc_pairs], dtype=float)
+        self.rc_tau = np.array([r * c for r, c in rc_pairs], dtype=float)
+        self.ocv_soc = np.asarray(ocv[0], dtype=float)
+        self.ocv_voltage = np.asarray(ocv[1], dtype=float)
+        self.reset(soc)
+
+    def reset(self, soc=0.5):
+        """
+        Reset the cell to a state of charge, fully relaxed.
+
+        :param soc: state of charge (0 to 1)
+        :type soc: float
+        """
+        self.soc = soc
+        self.v_rc = np.zeros_like(self.rc_r)
+
+    def ocv(self, soc=None):
+        """
+        :param soc: state of charge (default None uses the present state of charge)
+        :type soc: float or None
+        :return: open circuit voltage (V)
+        :rtype: float
+        """
+        return float(np.interp(self.soc if soc is None else soc, self.ocv_soc, self.ocv_voltage))
+
+    @property
+    def emf(self):
+        """Voltage of the cell behind R0: OCV plus the voltage over the RC pairs (V)."""
+        return self.ocv() + float(self.v_rc.sum())
+
+    def terminal_voltage(self, current):
+        """
+        :param current: current (A), positive for charging
+        :type current: float
+        :return: voltage on the terminals of the cell (V)
+        :rtype: float
+        """
+        return self.emf + current * self.r0
+
+    def step(self, current, dt):
+        """
+        Advance the state for a constant current.
+
+        :param current: current (A), positive for charging
+        :type current: float
+        :param dt: duration (s)
+        :type dt: float
+        """
+        self.soc = min(max(self.soc + current * dt / 3.6 / self.capacity, 0.0), 1.0)  # capacity in mAh
+        decay = np.exp(-dt / self.rc_tau)
+        self.v_rc = self.v_rc * decay + self.rc_r * current * (1 - decay)
+
+
+class BatteryTestBench:
+    """
+    Simulation of the cell, shunt, programmable power supply and relay load bank of the battery tester.
+    The simulation is advanced to the time of the clock whenever a value is read or an output is changed.
+    """
+
+    def __init__(self, cell=None, shunt_resistance=0.24, noise=0.0005, clock=None, speed=1.0, max_step=1.0):
+        """
+        :param cell: the cell (default None creates an EquivalentCircuitCell with default parameters)
+        :type cell: EquivalentCircuitCell or None
+        :param shunt_resistance: resistance of the shunt resistor (Ohm) (default 0.24)
+        :type shunt_resistance: float
+        :param noise: standard deviation of the noise added to the analog in values (V) (default 0.0005)
+        :type noise: float
+        :param clock: clock to use (default None creates a VirtualClock with speed)
+        :type clock: VirtualClock or None
+        :param speed: speed of the clock that is created if clock is None (default 1.0)
+        :type speed: float
+        :param max_step: maximum time step of the simulation (s) (default 1.0)
+        :type max_step: float
+        """
+        self.logger = logging.getLogger(__name__)
+        self.cell = EquivalentCircuitCell() if cell is None else cell
+        self.shunt_resistance = shunt_resistance
+        self.noise = noise
+        self.clock = VirtualClock(speed) if clock is None else clock
+        self.max_step = max_step
+        self.pps_voltage = 0.0
+        self.pps_enabled = False
+        self.pins = set()  # digital pins that are high
+        # Conductance of the load bank without relays and the conductance each relay adds (the relays switch resistors
+        # in parallel, so other combinations of pins are calculated from these):
+        base = max(LOAD_RESISTANCES, key=lambda r: -len(LOAD_RESISTANCES[r]))
+        self._load_base = 1 / base
+        self._load_pins = {}
+        for resistance, pins in sorted(LOAD_RESISTANCES.items(), key=lambda item: len(item[1])):
+            if pins:
+                self._load_pins[pins[-1]] = 1 / resistance - self._load_base - sum(self._load_pins.values())
+        self._lock = threading.RLock()
+        self._time = self.clock.time()
+
+    @property
+    def load_resistance(self):
+        """Resistance of the load bank for the present state of the digital pins (Ohm)."""
+        return 1 / (self._load_base + sum(g for pin, g in self._load_pins.items() if pin in self.pins))
+
+    def solve(self):
+        """
+        Solve the circuit for the present state.
+
+        :return: cell voltage (V), shunt current (A) and cell current (A, positive for charging)
+        :rtype: float, float, float
+        """
+        result = solve_circuit(self.pps_voltage, self.pps_enabled, self.cell.emf, self.cell.r0,
+                               self.shunt_resistance, self.load_resistance)
+        return tuple(float(value) for value in result)
+
+    def update(self):
+        """Advance the simulation to the present time of the clock."""
+        with self._lock:
+            now = self.clock.time()
+            remaining = now - self._time
+            while remaining > 0:
+                dt = min(remaining, self.max_step)
+                self.cell.step(self.solve()[2], dt)
+                remaining -= dt
+            self._time = now
+
+    def set_pps(self, voltage):
+        """Set the voltage of the power supply (V+)."""
+        with self._lock:
+            self.update()
+            self.pps_voltage = voltage
+
+    def enable_pps(self, enable=True):
+        """Enable or disable the power supply."""
+        with self._lock:
+            self.update()
+            self.pps_enabled = bool(enable)
+
+    def set_pin(self, pin, level):
+        """Set a digital pin high (1) or low (0). Pin -1 means all pins."""
+        with self._lock:
+            self.update()
+            pins = self._load_pins if pin == -1 else [pin]
+            for p in pins:
+                if level:
+                    self.pins.add(p)
+                else:
+                    self.pins.discard(p)
+
+    def read_analog(self):
+        """
+        :return: voltages on analog in 1 (cell) and analog in 2 (pps side of the shunt) (V)
+        :rtype: float, float
+        """
+        with self._lock:
+            self.update()
+            voltage, i_shunt, _ = self.solve()
+        values = np.array([voltage, voltage + i_shunt * self.shunt_resistance])
+        if self.noise:
+            values += np.random.normal(0, self.noise / 10, 2)  # noise of an average of many samples
+        return tuple(float(v) for v in values)
+
+    def read_block(self, n):
+        """
+        :param n: number of samples
+        :type n: int
+        :return: n samples (with noise) of analog in 1 and 2, with shape (2, n)
+        :rtype: numpy.ndarray
+        """
+        with self._lock:
+            self.update()
+            voltage, i_shunt, _ = self.solve()
+        block = np.empty((2, n))
+        block[0] = voltage
+        block[1] = voltage + i_shunt * self.shunt_resistance
+        if self.noise:
+            block += np.random.normal(0, self.noise, (2, n))
+        return block
+
+
+class CellBatch:
+    """
+    Many independent equivalent circuit cells (see EquivalentCircuitCell), stored as numpy arrays.
+    Every parameter can be a single value (shared by all cells) or an array with a value per cell. The cells share the
+    OCV curve and the number of RC pairs.
+    """
+
+    def __init__(self, n, capacity=200.0, r0=0.5, rc_pairs=((0.2, 500.0),), ocv=DEFAULT_OCV, soc=0.5):
+        """
+        :param n: number of cells
+        :type n: int
+        :param capacity: capacity of the cells (mAh) (default 200.0)
+        :type capacity: float or numpy.ndarray
+        :param r0: series resistance (Ohm) (default 0.5)
+        :type r0: float or numpy.ndarray
+        :param rc_pairs: resistance (Ohm) and capacitance (F) of each RC pair, both may be arrays (default ((0.2, 500.0),))
+        :type rc_pairs: list of tuple
+        :param ocv: state of charge points (0 to 1) and the corresponding open circuit voltages (V)
+        :type ocv: tuple of lists
+        :param soc: initial state of charge (0 to 1) (default 0.5)
+        :type soc: float or numpy.ndarray
+        """
+        self.n = int(n)
+        self.capacity = np.broadcast_to(np.asarray(capacity, dtype=float), (self.n,)).copy()
+        self.r0 = np.broadcast_to(np.asarray(r0, dtype=float), (self.n,)).copy()
+        # arrays with shape (number of pairs, n):
+        self.rc_r = np.array([np.broadcast_to(np.asarray(r, dtype=float), (self.n,)) for r, c in rc_pairs])
+        self.rc_tau = self.rc_r * np.array([np.broadcast_to(np.asarray(c, dtype=float), (self.n,))
+                                            for r, c in rc_pairs])
+        self.ocv_soc = np.asarray(ocv[0], dtype=float)
+        self.ocv_voltage = np.asarray(ocv[1], dtype=float)
+        self.reset(soc)
+
+    def __len__(self):
+        return self.n
+
+    def reset(self, soc=0.5):
+        """
+        Reset all cells to a state of charge, fully relaxed.
+
+        :param soc: state of charge (0 to 1)
+        :type soc: float or numpy.ndarray
+        """
+        self.soc = np.broadcast_to(np.asarray(soc, dtype=float), (self.n,)).copy()
+        self.v_rc = np.zeros_like(self.rc_r)
+
+    def ocv(self):
+        """
+        :return: open circuit voltage of each cell (V)
+        :rtype: numpy.ndarray
+        """
+        return np.interp(self.soc, self.ocv_soc, self.ocv_voltage)
+
+    @property
+    def emf(self):
+        """Voltage of each cell behind R0: OCV plus the voltage over the RC pairs (V)."""
+        return self.ocv() + self.v_rc.sum(axis=0)
+
+    def step(self, current, dt):
+        """
+        Advance the state of all cells for a constant current.
+
+        :param current: current per cell (A), positive for charging
+        :type current: float or numpy.ndarray
+        :param dt: duration (s)
+        :type dt: float
+        """
+        self.soc = np.clip(self.soc + current * dt / 3.6 / self.capacity, 0.0, 1.0)  # capacity in mAh
+        decay = np.exp(-dt / self.rc_tau)
+        self.v_rc = self.v_rc * decay + self.rc_r * current * (1 - decay)
+
+
+class BatchTestBench:
+    """
+    Test bench (like BatteryTestBench) for a CellBatch, every cell has its own power supply. There is no clock, the
+    simulation is advanced explicitly with step(), as fast as numpy allows.
+
+    Example:
+        >>> bench = BatchTestBench(CellBatch(1000, r0=np.random.uniform(0.2, 1.0, 1000)))
+        >>> bench.pps_voltage[:] = 4.0
+        >>> bench.step(60)  # one minute
+        >>> analog_1, analog_2 = bench.read_analog()  # arrays with 1000 values
+    """
+
+    def __init__(self, cells, shunt_resistance=0.24, noise=0.0005, load_resistance=512.0, max_step=1.0):
+        """
+        :param cells: the cells
+        :type cells: CellBatch
+        :param shunt_resistance: resistance of the shunt resistors (Ohm) (default 0.24)
+        :type shunt_resistance: float or numpy.ndarray
+        :param noise: standard deviation of the noise on the analog in values (V) (default 0.0005)
+        :type noise: float or numpy.ndarray
+        :param load_resistance: resistance of the load banks (Ohm) (default 512.0, no relays switched on)
+        :type load_resistance: float or numpy.ndarray
+        :param max_step: maximum time step of the simulation (s) (default 1.0)
+        :type max_step: float
+        """
+        self.cells = cells
+        self.shunt_resistance = shunt_resistance
+        self.noise = noise
+        self.load_resistance = load_resistance
+        self.max_step = max_step
+        self.pps_voltage = np.zeros(len(cells))
+        self.pps_enabled = np.ones(len(cells), dtype=bool)
+        self.time = 0.0
+
+    def solve(self):
+        """
+        :return: cell voltages (V), shunt currents (A) and cell currents (A, positive for charging)
+        :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray
+        """
+        return solve_circuit(self.pps_voltage, self.pps_enabled, self.cells.emf, self.cells.r0,
+                             self.shunt_resistance, self.load_resistance)
+
+    def step(self, dt):
+        """
+        Advance all cells.
+
+        :param dt: duration (s)
+        :type dt: float
+        """
+        remaining = dt
+        while remaining > 0:
+            sub = min(remaining, self.max_step)
+            self.cells.step(self.solve()[2], sub)
+            remaining -= sub
+        self.time += dt
+
+    def read_analog(self):
+        """
+        :return: voltages (with noise) on analog in 1 (cell) and analog in 2 (pps side of the shunt) (V)
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        voltage, i_shunt, _ = self.solve()
+        analog_1 = voltage
+        analog_2 = voltage + i_shunt * self.shunt_resistance
+        if np.any(self.noise):
+            analog_1 = analog_1 + np.random.normal(0, 1, len(self.cells)) * self.noise
+            analog_2 = analog_2 + np.random.normal(0, 1, len(self.cells)) * self.noise
+        return analog_1, analog_2
+
+
+if __name__ == '__main__':
+    import Battery_Testing_Software.labphew
+    Battery_Testing_Software.labphew.configure_logging()
+
+    # Charge with the power supply at 4.1V for 2 hours (of simulated time) and print the state every 10 minutes
+    bench = BatteryTestBench(speed=1000)
+    bench.set_pps(4.1)
+    bench.enable_pps(True)
+    for minute in range(0, 121, 10):
+        ai1, ai2 = bench.read_analog()
+        print(f'{minute:3} min: cell {ai1:.3f} V, current {(ai2 - ai1) / bench.shunt_resistance * 1000:6.1f} mA, '
+              f'SoC {bench.cell.soc * 100:.1f} %')
+        bench.clock.sleep(600)
@@ -8,6 +8,8 @@ It is developed with the `Analog Discovery 2 <https://reference.digilentinc.com/
 
 It depends on `Digilent's DWF library wrapper <https://pypi.org/project/dwf/>`_ (pip install dwf) which provides a pythonic way of interacting with the WaveForms dll.
 The DfwController class inherits from the Dwf class of the dwf module, meaning all functionality of Dwf is available.
+Without dwf (or the WaveForms runtime it loads) this module can still be imported, but only SimulatedDfwController
+works then, e.g. to run tests in CI without hardware.
 In addition the input and output channels are made available internally and basic methods are added to read and write analog values.
 The example code at the end shows both examples of using these basic methods and of interacting with the more complex inherited methods.
 
@@ -15,16 +17,145 @@ Unfortunately there's no extended documentation for the dwf module, but original
 described in the `WaveForms SDK Reference Manual <https://s3-us-west-2.amazonaws.com/digilent/resources/instrumentation/waveforms/waveforms_sdk_rm.pdf>`_.
 Using an autocompleting IDE it's possible to explore the available methods and find the documentation of the corresponding functions in the WaveForms SDK Reference Manual.
 
+Besides the basic (single shot) methods, DfwController has a record mode (start_record(), iter_record(), record(),
+stop_record()) that configures analog in once and then keeps acquiring both channels continuously into a preallocated
+buffer. Use it when you need more than ~100 points per second or can't afford to lose samples between points.
+sweep_analog() applies a whole voltage sweep as one waveform of the arbitrary waveform generator and measures it with
+a single triggered acquisition, which is much faster than setting and reading one point at a time.
+
+Both DfwController and SimulatedDfwController measure their own timing in an Instrumentation object (the instrumentation
+attribute, see labphew.core.tools.instrumentation): the latency of every read_analog() and read_analog_block() call,
+counters of read timeouts and of samples lost or corrupted during a record, and the number of record samples waiting to
+be read. stats() returns them.
+
 In addition to the DfwController class this module contains functions to explore which devices are connected and to close connections.
 
 """
 import logging
-import dwf
 import time
+import threading
+import ctypes
 import numpy as np
+from Battery_Testing_Software.labphew.core.tools.instrumentation import Instrumentation, timed
+
+_dwf_error = None
+try:
+    import dwf  # loads the WaveForms runtime (libdwf)
+except (ImportError, OSError) as error:
+    dwf = None
+    _dwf_error = error
+
+_c_double_p = ctypes.POINTER(ctypes.c_double)
 
+DEVICE_LIST_TTL = 30  # (s) time after which get_devices() enumerates the devices again
+_device_list = None  # cached result of enumerate_devices(), see get_devices()
+_device_list_time = 0.0
+_device_list_lock = threading.Lock()
 
-class DfwController(dwf.Dwf):
+
+def _require_dwf():
+    """Raise an ImportError if dwf (or the WaveForms runtime it loads) could not be imported."""
+    if dwf is None:
+        raise ImportError(f'Connecting to a WaveForms device requires dwf and the WaveForms runtime ({_dwf_error})')
+
+
+class _RecordBuffer:
+    """
+    Preallocated circular buffer used by the record mode of (Simulated)DfwController.
+    The acquisition side writes blocks of samples for all channels, the consumer side reads them in order (first in,
+    first out). If the consumer falls behind by more than the size of the buffer, the oldest samples are dropped and
+    counted in overflow.
+    """
+
+    def __init__(self, size, channels=2):
+        """
+        :param size: number of samples (per channel) the buffer can hold
+        :type size: int
+        :param channels: number of channels (default 2)
+        :type channels: int
+        """
+        self.size = int(size)
+        self.data = np.zeros((channels, self.size))
+        self.written = 0  # total number of samples written since creation
+        self.read_index = 0  # total number of samples handed to the consumer
+        self.overflow = 0  # number of samples that were overwritten before they were read
+
+    @property
+    def available(self):
+        """Number of samples written but not yet read."""
+        return self.written - self.read_index
+
+    def write(self, block):
+        """
+        Write a block of samples.
+
+        :param block: samples with shape (channels, n)
+        :type block: numpy.ndarray
+        """
+        n = block.shape[1]
+        if n > self.size:  # only the last part of the block fits
+            block = block[:, -self.size:]
+            self.written += n - self.size
+            n = self.size
+        start = self.written % self.size
+        first = min(n, self.size - start)
+        self.data[:, start:start + first] = block[:, :first]
+        self.data[:, :n - first] = block[:, first:]
+        self.written += n
+        if self.available > self.size:
+            self.overflow += self.available - self.size
+            self.read_index = self.written - self.size
+
+    def skip(self, n, value=np.nan):
+        """
+        Write n samples with a constant value, e.g. for samples lost by the device. All n samples count for the time
+        axis (written), but at most size of them are stored, so n may be larger than the buffer.
+
+        :param n: number of samples
+        :type n: int
+        :param value: value to write (default NaN)
+        :type value: float
+        """
+        if n > self.size:
+            self.written += n - self.size
+            n = self.size
+        self.write(np.full((self.data.shape[0], n), value))
+
+    def _copy(self, start, n):
+        idx = start % self.size
+        first = min(n, self.size - idx)
+        out = np.empty((self.data.shape[0], n))
+        out[:, :first] = self.data[:, idx:idx + first]
+        out[:, first:] = self.data[:, :n - first]
+        return out
+
+    def read(self, n):
+        """
+        Return a copy of the next n unread samples and mark them as read.
+
+        :param n: number of samples (should not exceed available)
+        :type n: int
+        :return: samples with shape (channels, n)
+        :rtype: numpy.ndarray
+        """
+        out = self._copy(self.read_index, n)
+        self.read_index += n
+        return out
+
+    def latest(self, n):
+        """
+        Return a copy of the last n samples written (without marking anything as read).
+
+        :param n: number of samples
+        :type n: int
+        :return: samples with shape (channels, <=n)
+        :rtype: numpy.ndarray
+        """
+        n = min(n, self.written, self.size)
+        return self._copy(self.written - n, n)
+
+
+class DfwController(object if dwf is None else dwf.Dwf):  # (see _require_dwf)
     """
     Controller for Digilent devices controlled through WaveForms software
     """
@@ -35,16 +166,16 @@ class DfwController(dwf.Dwf):
 
         It connects to device with device_number as listed by the enumerate_devices() function of this module.
         Note that the default value of 0 will simply connect to the first device found.
-        The possible configurations are also returned by enumerate_devices(). Note that enumerate devices is run at time
-        of module import and stored in the variable devices. Note that the information returned by enumerate_devices()
-        (or stored in the variable devices) can be diplayed in more readable form with the function print_device_list()
-        of this module.
+        The possible configurations are also returned by enumerate_devices(). Note that get_devices() returns a cached
+        version of that list (which is also available as the variable devices of this module). The information can be
+        diplayed in more readable form with the function print_device_list() of this module.
 
         :param device_number: the device number (default: 0)
         :type device_number: int
         :param config: configuration number (default: 0)
         :type config: int
         """
+        _require_dwf()
         self.logger = logging.getLogger(__name__)
         super().__init__(device_number, config)
 
@@ -73,10 +204,32 @@ class DfwController(dwf.Dwf):
         self._last_ao0 = 0  # will be overwritten by write_analog()
         self._last_ao1 = 0  # will be overwritten by write_analog()
         self._time_stabilized = time.time()  # will be overwritten by write_analog()
+        self._basic_analog_settings = (80, 10000, 50.0)  # will be overwritten by preset_basic_analog()
+        self._record = None  # _RecordBuffer while recording, see start_record()
+        self._record_lock = threading.Lock()
+        self.instrumentation = Instrumentation()  # latencies and counters, see stats()
+        self._instrument_record()
+        self._allocate_ai_buffer(self._basic_analog_settings[0])  # will be reallocated by _status_data() if too small
         self.preset_basic_analog()
 
         self.logger.debug('DfwController object created')
 
+    def _instrument_record(self):
+        """Add the gauges of the record mode to the instrumentation."""
+        self.instrumentation.gauge('record_backlog', lambda: getattr(self._record, 'available', 0))
+        self.instrumentation.gauge('record_overflow', lambda: getattr(self._record, 'overflow', 0))
+
+    def stats(self):
+        """
+        Timing statistics of the controller: latencies of read_analog() and read_analog_block(), counters of read
+        timeouts (ai_timeouts, record_timeouts) and of samples lost and corrupted during records, and the number of
+        record samples waiting to be read (record_backlog) and overwritten before they were read (record_overflow).
+
+        :return: see Instrumentation.stats()
+        :rtype: dict
+        """
+        return self.instrumentation.stats()
+
     # AnalogIn
     def preset_basic_analog(self, n=80, freq=10000, range=50.0, return_std=False):
         """
@@ -94,17 +247,49 @@ class DfwController(dwf.Dwf):
         :param return_std: also returns the standard deviations (default False)
         :type return_std:  bool
         """
+        if self._record is not None:
+            self.stop_record()
         self.ao.reset()
-        self.ai.reset()
         self.ao.nodeFunctionSet(-1, self.ao.NODE.CARRIER, self.ao.FUNC.DC)
         self.ao.configure(-1, 3)  # apply
+        self._basic_analog_settings = (n, freq, range)
+        self._configure_basic_analog_in()
+        # self._read_timeout = 1.9 + self.ai.bufferSizeGet() / self.ai.frequencyGet()
+        self.ao.configure(-1, 1)
+        self.basic_analog_return_std = False
+
+    def _configure_basic_analog_in(self):
+        """Apply the analog in settings stored by preset_basic_analog() (used by read_analog())"""
+        n, freq, range = self._basic_analog_settings
+        self.ai.reset()
+        self.ai.acquisitionModeSet(self.ai.ACQMODE.SINGLE)
         self.ai.bufferSizeSet(n)
         self.ai.frequencySet(freq)
         self.ai.channelRangeSet(-1, range)
         self.ai.configure(1, 0)  # apply config to AI, but not start
-        # self._read_timeout = 1.9 + self.ai.bufferSizeGet() / self.ai.frequencyGet()
-        self.ao.configure(-1, 1)
-        self.basic_analog_return_std = False
+        self._ai_buffer_size = self.ai.bufferSizeGet()  # the device may adjust the requested size
+
+    def _allocate_ai_buffer(self, n):
+        """(Re)allocate the buffer used by _status_data() and the pointers to its rows."""
+        self._ai_buffer = np.empty((2, n))
+        self._ai_pointers = [row.ctypes.data_as(_c_double_p) for row in self._ai_buffer]
+
+    def _status_data(self, n):
+        """
+        Copy the last n acquired samples of both analog in channels into a preallocated buffer that is reused for every
+        read. FDwfAnalogInStatusData writes directly into the buffer, in stead of returning tuples of python floats
+        (which is what ai.statusData() does).
+
+        :param n: number of samples
+        :type n: int
+        :return: view of shape (2, n) of the buffer (only valid until the next read)
+        :rtype: numpy.ndarray
+        """
+        if self._ai_buffer.shape[1] < n:
+            self._allocate_ai_buffer(n)
+        for channel, pointer in enumerate(self._ai_pointers):
+            dwf.FDwfAnalogInStatusData(self.hdwf, channel, pointer, n)
+        return self._ai_buffer[:, :n]
 
     def stop_analog_out(self, channel=-1):
         """
@@ -150,6 +335,7 @@ class DfwController(dwf.Dwf):
             return wait
         return 0
 
+    @timed('read_analog')
     def read_analog(self):
         """
         Basic method to read voltage of analog in channels.
@@ -157,19 +343,47 @@ class DfwController(dwf.Dwf):
         Returns both channels.
         (Also returns standard deviations if self.basic_analog_return_std is True)
 
+        While record mode is running (see start_record()) it does not start a new acquisition, but returns the
+        average of the latest samples of the record instead.
+
         :return: the analog values of both AI channels (and possibly the standard deviations)
         :rtype: float, float [,float, float] (or None's in case of read timeout)
         """
-        self.ai.configure(0, 1)  # start acquisition
-        if self.wait_for_ai_acquisition():
+        if self._record is not None:
+            self.poll_record()
+            with self._record_lock:
+                latest = self._record.latest(self._basic_analog_settings[0])
+            if latest.shape[1] == 0:
+                return tuple([None, None]) * (1 + self.basic_analog_return_std)
+            if self.basic_analog_return_std:
+                return (*latest.mean(axis=1), *latest.std(axis=1))
+            return tuple(latest.mean(axis=1))
+        data = self.read_analog_block()
+        if data is None:
             return tuple([None, None]) * (1 + self.basic_analog_return_std)  # return the right amount of None's
-        buf = self.ai.bufferSizeGet()
-        c0 = np.array(self.ai.statusData(0, buf))
-        c1 = np.array(self.ai.statusData(1, buf))
         if self.basic_analog_return_std:
-            return c0.mean(), c1.mean(), c0.std(), c1.std()
+            return (*data.mean(axis=1), *data.std(axis=1))
         else:
-            return c0.mean(), c1.mean()
+            return tuple(data.mean(axis=1))
+
+    @timed('read_analog_block')
+    def read_analog_block(self):
+        """
+        Acquire a block of samples of both analog in channels with the settings of preset_basic_analog() and return
+        them without averaging. Note that the returned array is a view of a buffer that is reused for the next read,
+        make a copy if you want to keep the data.
+
+        :return: the samples of both AI channels with shape (2, n) (or None in case of read timeout)
+        :rtype: numpy.ndarray or None
+        """
+        if self._record is not None:
+            self.poll_record()
+            with self._record_lock:
+                return self._record.latest(self._basic_analog_settings[0])
+        self.ai.configure(0, 1)  # start acquisition
+        if self.wait_for_ai_acquisition():
+            return
+        return self._status_data(self._ai_buffer_size)
 
     def wait_for_ai_acquisition(self, start_timestamp=None):
         """
@@ -188,8 +402,258 @@ class DfwController(dwf.Dwf):
         while self.ai.status(True) != self.ai.STATE.DONE:
             if time.time() > start_timestamp + read_timeout:
                 self.logger.error('AI read timeout occured')
+                self.instrumentation.count('ai_timeouts')
                 return True
 
+    # Hardware timed sweep
+    def sweep_analog(self, voltages, step_time, channel=0, samples_per_step=20, settle_time=0.0, range=50.0):
+        """
+        Apply a sequence of voltages to an analog out channel and measure both analog in channels at every step, timed
+        by the device in stead of by the computer.
+
+        The voltages are uploaded as one custom waveform (a staircase) to the arbitrary waveform generator. Analog in
+        is triggered by the start of that waveform and acquires the entire sweep in one go. The trace is then split
+        per step: the samples taken during settle_time after each step are discarded and the rest is averaged. The
+        device rounds the analog in frequency (samples_per_step / step_time) to a divider of its clock, so the samples of
+        each step are selected based on the frequency it actually uses.
+        Afterwards the analog out channel is left at the last voltage and the settings of preset_basic_analog() are
+        restored.
+
+        Note that the number of voltages is limited by the waveform generator (typically 4096) and that
+        samples_per_step is reduced if the total number of samples would not fit in the analog in buffer.
+
+        :param voltages: the voltages to apply (in Volt)
+        :type voltages: list or numpy.ndarray
+        :param step_time: duration of each step (s)
+        :type step_time: float
+        :param channel: analog out channel (0 or 1) (default 0)
+        :type channel: int
+        :param samples_per_step: number of analog in samples per step (default 20)
+        :type samples_per_step: int
+        :param settle_time: time after each step to ignore (s) (default 0.0)
+        :type settle_time: float
+        :param range: the voltage range for the ADC (5.0 or 50.0) (default 50.0)
+        :type range: float
+        :return: the averaged measurements with shape (2, len(voltages)) (or None if the sweep failed)
+        :rtype: numpy.ndarray or None
+        """
+        voltages = np.asarray(voltages, dtype=float)
+        n = len(voltages)
+        if self._record is not None:
+            self.stop_record()
+        if n > self.ao.nodeDataInfo(channel, self.ao.NODE.CARRIER)[1]:
+            self.logger.error(f'Too many points for the waveform generator: {n}')
+            return
+        max_buffer_size = self.ai.bufferSizeInfo()[1]
+        samples_per_step = int(max(1, min(samples_per_step, max_buffer_size // n)))
+
+        # Analog in: a single acquisition of the whole sweep, triggered by the analog out channel
+        self.ai.reset()
+        self.ai.acquisitionModeSet(self.ai.ACQMODE.SINGLE)
+        self.ai.frequencySet(samples_per_step / step_time)
+        ai_freq = self.ai.frequencyGet()  # the device rounds the frequency to a divider of its clock
+        buffer_size = int(min(np.ceil(n * step_time * ai_freq), max_buffer_size))
+        # Sample indices where each step starts (and the last one ends), based on the actual frequency
+        edges = np.minimum(np.round(np.arange(n + 1) * step_time * ai_freq).astype(int), buffer_size)
+        if np.any(np.diff(edges) < 1):
+            self.logger.error(f'No samples for some steps at {ai_freq} Hz, increase step_time or samples_per_step')
+            self._configure_basic_analog_in()
+            return
+        self.ai.bufferSizeSet(buffer_size)
+        self.ai.channelRangeSet(-1, range)
+        self.ai.triggerSourceSet(self.ai.TRIGSRC.ANALOG_OUT1 + channel)
+        self.ai.triggerPositionSet(0.5 * buffer_size / ai_freq)  # the default position is the middle of the buffer
+        self.ai.configure(0, 1)  # arm
+        start = time.time()
+        armed = True
+        while self.ai.status(True) != self.ai.STATE.ARMED:
+            if time.time() > start + 1:
+                self.logger.error('AI could not be armed for sweep')
+                armed = False
+                break
+
+        timeout = not armed
+        if armed:
+            # Analog out: the staircase as one period of a custom waveform (data is normalized to -1..1)
+            offset = (voltages.max() + voltages.min()) / 2
+            amplitude = (voltages.max() - voltages.min()) / 2
+            data = (voltages - offset) / amplitude if amplitude > 0 else np.zeros(n)
+            self.ao.nodeEnableSet(channel, self.ao.NODE.CARRIER, True)
+            self.ao.nodeFunctionSet(channel, self.ao.NODE.CARRIER, self.ao.FUNC.CUSTOM)
+            self.ao.nodeDataSet(channel, self.ao.NODE.CARRIER, data.tolist())
+            self.ao.nodeFrequencySet(channel, self.ao.NODE.CARRIER, 1 / (n * step_time))
+            self.ao.nodeAmplitudeSet(channel, self.ao.NODE.CARRIER, amplitude)
+            self.ao.nodeOffsetSet(channel, self.ao.NODE.CARRIER, offset)
+            self.ao.runSet(channel, n * step_time)
+            self.ao.repeatSet(channel, 1)
+            self.ao.configure(channel, 1)  # start
+
+            timeout = self.wait_for_ai_acquisition()
+            if not timeout:
+                trace = self._status_data(buffer_size)  # (view of the reused buffer, no other reads until averaged)
+
+        # Leave the output at the last voltage (unchanged if the sweep didn't start) and restore basic analog settings,
+        # also after a timeout
+        self.ao.nodeFunctionSet(channel, self.ao.NODE.CARRIER, self.ao.FUNC.DC)
+        self.ao.runSet(channel, 0)
+        self.ao.repeatSet(channel, 0)
+        if armed:
+            self.write_analog(voltages[-1], channel)
+        self._configure_basic_analog_in()
+        if timeout:
+            return
+
+        # Average each step, without the samples taken during settle_time (but at least one sample per step)
+        first = np.minimum(edges[:-1] + int(np.ceil(settle_time * ai_freq)), edges[1:] - 1)
+        total = np.concatenate((np.zeros((2, 1)), np.cumsum(trace, axis=1)), axis=1)
+        return (total[:, edges[1:]] - total[:, first]) / (edges[1:] - first)
+
+    # AnalogIn record mode
+    def start_record(self, freq=10000, range=50.0, buffer_time=60):
+        """
+        Configure analog in once for continuous acquisition of both channels (record mode) and start it.
+        The samples are collected in a preallocated buffer that can hold buffer_time seconds of data. Retrieve them with
+        iter_record() or record(). Note that the device has a limited internal buffer, so the record needs to be polled
+        (which iter_record() and read_analog() do) regularly enough to prevent samples from being lost.
+        Call stop_record() to return to the basic read_analog() settings.
+
+        :param freq: analog in frequency (default 10000)
+        :type freq: int or float
+        :param range: the voltage range for the ADC (5.0 or 50.0) (default 50.0)
+        :type range: int or float
+        :param buffer_time: amount of data (in seconds) the buffer on the computer side can hold (default 60)
+        :type buffer_time: int or float
+        """
+        if self._record is not None:
+            self.stop_record()
+        self.ai.reset()
+        self.ai.channelEnableSet(-1, True)
+        self.ai.channelRangeSet(-1, range)
+        self.ai.acquisitionModeSet(self.ai.ACQMODE.RECORD)
+        self.ai.frequencySet(freq)
+        self.ai.recordLengthSet(0)  # a length of 0 means: record until stopped
+        self._record_freq = self.ai.frequencyGet()
+        self._record_lost = 0
+        self._record_corrupted = 0
+        self._record = _RecordBuffer(max(1, int(buffer_time * self._record_freq)))
+        self.ai.configure(False, True)  # start acquisition
+        self.logger.debug(f'Record started at {self._record_freq} Hz')
+
+    def poll_record(self):
+        """
+        Transfer the samples collected by the device since the last poll into the record buffer.
+        Lost samples (when polling too slowly) are counted and replaced by NaN so that the time axis remains valid.
+
+        :return: number of new samples
+        :rtype: int
+        """
+        with self._record_lock:
+            if self._record is None:
+                return 0
+            status = self.ai.status(True)
+            if status in (self.ai.STATE.CONFIG, self.ai.STATE.PREFILL, self.ai.STATE.ARMED):
+                return 0  # acquisition not started yet
+            available, lost, corrupted = self.ai.statusRecord()
+            if lost:
+                self._record_lost += lost
+                self.instrumentation.count('record_samples_lost', lost)
+                self.logger.warning(f'{lost} samples lost, poll the record more often or reduce the frequency')
+                self._record.skip(lost)
+            if corrupted:
+                self._record_corrupted += corrupted
+                self.instrumentation.count('record_samples_corrupted', corrupted)
+            if available:
+                self._record.write(self._status_data(available))
+            return available + lost
+
+    def iter_record(self, block_size=1000, average=False, timeout=None):
+        """
+        Generator that yields consecutive blocks of the running record (see start_record()). No samples are skipped
+        between blocks unless the buffer overflowed.
+        It yields tuples of the time of the first sample of the block (in seconds since the start of the record) and the
+        data: an array of shape (2, block_size), or of shape (2,) containing the block averages if average is True.
+        The generator ends when stop_record() is called or when no full block arrived within timeout seconds.
+
+        :param block_size: number of samples (per channel) per block (default 1000)
+        :type block_size: int
+        :param average: yield block averages in stead of raw samples (default False)
+        :type average: bool
+        :param timeout: maximum time to wait for a block (default None, meaning twice the duration of one block + 1s)
+        :type timeout: float or None
+        """
+        block_size = int(block_size)
+        if self._record is None:
+            self.logger.error('Record is not running, call start_record() first')
+            return
+        if block_size > self._record.size:
+            self.logger.error('block_size should not exceed the size of the record buffer')
+            return
+        block_time = block_size / self._record_freq
+        if timeout is None:
+            timeout = 2 * block_time + 1
+        while self._record is not None:
+            t0 = time.time()
+            while self._record is not None and self._record.available < block_size:
+                if time.time() - t0 > timeout:
+                    self.logger.error('Record read timeout occured')
+                    self.instrumentation.count('record_timeouts')
+                    return
+                time.sleep(min(block_time / 4, 0.05))
+                self.poll_record()
+            with self._record_lock:
+                if self._record is None:
+                    return
+                t = self._record.read_index / self._record_freq
+                block = self._record.read(block_size)
+            yield t, (block.mean(axis=1) if average else block)
+
+    def record(self, callback, block_size=1000, average=False, duration=None):
+        """
+        Convenience method that passes blocks of the running record to callback until the callback returns False or
+        duration (seconds of recorded data) is reached. Starts the record with default settings if it is not running and
+        stops it afterwards.
+        The callback is called as callback(t, data), see iter_record() for the arguments.
+
+        :param callback: function to call with every block
+        :type callback: callable
+        :param block_size: number of samples (per channel) per block (default 1000)
+        :type block_size: int
+        :param average: pass block averages in stead of raw samples (default False)
+        :type average: bool
+        :param duration: stop after this many seconds of data (default None, meaning no limit)
+        :type duration: float or None
+        """
+        if self._record is None:
+            self.start_record()
+        try:
+            for t, data in self.iter_record(block_size, average):
+                if callback(t, data) is False:
+                    break
+                if duration is not None and t + block_size / self._record_freq >= duration:
+                    break
+        finally:
+            self.stop_record()
+
+    def stop_record(self):
+        """
+        Stop the record and restore the settings used by read_analog().
+
+        :return: number of samples lost and corrupted during the record, and number of samples dropped because the
+                 buffer overflowed
+        :rtype: int, int, int
+        """
+        with self._record_lock:
+            if self._record is None:
+                return 0, 0, 0
+            overflow = self._record.overflow
+            self._record = None
+            self.ai.configure(False, False)
+            self._configure_basic_analog_in()
+        if self._record_lost or self._record_corrupted or overflow:
+            self.logger.warning(f'Record finished with {self._record_lost} lost, {self._record_corrupted} corrupted and '
+                                f'{overflow} overflowed samples')
+        return self._record_lost, self._record_corrupted, overflow
+
     # AnalogOut
     def write_pps(self, volt, channel, enable=True, enable_master=True):
         """
@@ -252,14 +716,29 @@ class SimulatedDfwController:
     Rudimentary simulated version of DfwController for the purpose of developing without a connected device.
     Note that it is far from a complete simulation, it just mimics a few basic methods.
     You can add any simulation function to relate read_analog() to a value set with write_analog() via _analog_simulation_functions.
+
+    Alternatively pass a simulator (a BatteryTestBench from labphew.controller.digilent.battery_simulator) to simulate
+    the battery tester: analog in, the power supply and the digital pins are then connected to the simulated cell, and
+    the clock of the simulator (which may run faster than real time) is available as the clock attribute.
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, simulator=None, **kwargs):
+        """
+        :param simulator: optional simulation of the battery tester (default None)
+        :type simulator: BatteryTestBench or None
+        """
         self.logger = logging.getLogger(__name__)
+        self.simulator = simulator
+        self.clock = None if simulator is None else simulator.clock  # None means real time
         self._analog_in_values = [0.0, 0.0]  # empty dictionary to hold simulated analog values
         # self._analog_simulation_functions = [lambda v: np.exp(v-0.7)/20, lambda v: np.random.normal(1,.5)]
         self._analog_simulation_functions = [lambda v: np.random.normal(1, .5), lambda v: np.exp(v - 0.7) / 20]
         self.basic_analog_return_std = False
+        self._basic_analog_settings = (80, 10000, 50.0)
+        self._record = None
+        self._record_lock = threading.Lock()
+        self.instrumentation = Instrumentation()
+        self._instrument_record()
         from collections import defaultdict
 
         class Dummy:
@@ -305,11 +784,27 @@ class SimulatedDfwController:
     def __len__(self):
         pass
 
+    @timed('read_analog')
     def read_analog(self):
         """
         Simulated version of read_analog().
         Applies functions specified in self._analog_simulation_functions (optionally to the values set by write_analog() ).
         """
+        if self.simulator is not None:
+            results = self.simulator.read_analog()
+            if self.basic_analog_return_std:
+                return tuple([*results, self.simulator.noise, self.simulator.noise])
+            return results
+        if self._record is not None:
+            self.poll_record()
+            with self._record_lock:
+                latest = self._record.latest(self._basic_analog_settings[0])
+            if latest.shape[1] == 0:
+                return tuple([None, None]) * (1 + self.basic_analog_return_std)
+            results = list(latest.mean(axis=1))
+            if self.basic_analog_return_std:
+                return tuple([*results, 0.0, 0.0])
+            return tuple(results)
         time.sleep(0.01)
         results = [func(v) for func, v in zip(self._analog_simulation_functions, self._analog_in_values)]
         if self.basic_analog_return_std:
@@ -333,6 +828,57 @@ class SimulatedDfwController:
         if channel == 1 or channel == -1:
             self._analog_in_values[1] = volt
 
+    @timed('read_analog_block')
+    def read_analog_block(self):
+        """
+        Simulated version of read_analog_block().
+        Returns the values of read_analog() (with some noise) for the number of points set by preset_basic_analog().
+        """
+        if self.simulator is not None:
+            return self.simulator.read_block(self._basic_analog_settings[0])
+        if self._record is not None:
+            self.poll_record()
+            with self._record_lock:
+                return self._record.latest(self._basic_analog_settings[0])
+        n = self._basic_analog_settings[0]
+        time.sleep(0.01)
+        results = [func(v) for func, v in zip(self._analog_simulation_functions, self._analog_in_values)]
+        return np.array(results)[:, np.newaxis] + np.random.normal(0, 0.01, size=(2, n))
+
+    def sweep_analog(self, voltages, step_time, channel=0, samples_per_step=20, settle_time=0.0, range=50.0):
+        """
+        Simulated version of sweep_analog().
+        Applies the functions in self._analog_simulation_functions to every voltage and waits for the sweep duration.
+        """
+        voltages = np.asarray(voltages, dtype=float)
+        result = np.empty((2, len(voltages)))
+        for i, volt in enumerate(voltages):
+            self.write_analog(volt, channel)
+            result[:, i] = [func(v) for func, v in zip(self._analog_simulation_functions, self._analog_in_values)]
+        time.sleep(len(voltages) * step_time)
+        return result
+
+    def write_pps(self, volt, channel, enable=True, enable_master=True):
+        """Simulated version of write_pps(). Only remembers the voltage (and sets V+ of the simulator)."""
+        if channel == 0:
+            self._last_pps0 = volt
+            if self.simulator is not None:
+                if enable_master:
+                    self.simulator.enable_pps(True)
+                self.simulator.set_pps(volt)
+        if channel == 1:
+            self._last_pps1 = volt
+
+    def enable_pps(self, enable=True):
+        """Simulated version of enable_pps(). Does nothing (or enables the power supply of the simulator)."""
+        if self.simulator is not None:
+            self.simulator.enable_pps(enable)
+
+    def write_digital(self, level, pin=-1, enable=1, idle_set=0, output_set=0):
+        """Simulated version of write_digital(). Does nothing (or switches the load bank of the simulator)."""
+        if self.simulator is not None:
+            self.simulator.set_pin(pin, level)
+
     def wait_for_ai_acquisition(self, start_timestamp=None):
         """
         Simulated version of wait_for_ai_acquisition().
@@ -361,14 +907,76 @@ class SimulatedDfwController:
         """
         self.ai.frequencySet(freq)
         self.ai.channelRangeSet(-1, int(range))
+        self._basic_analog_settings = (n, freq, range)
         self.basic_analog_return_std = return_std
 
+    def start_record(self, freq=10000, range=50.0, buffer_time=60):
+        """
+        Simulated version of start_record(). Samples are "generated" at freq, based on the time passed since the start.
+
+        :param freq: analog in frequency (default 10000)
+        :type freq: int or float
+        :param range: is ignored in simulated version
+        :type range: int or float
+        :param buffer_time: amount of data (in seconds) the buffer can hold (default 60)
+        :type buffer_time: int or float
+        """
+        self._record_freq = freq
+        self._record_lost = 0
+        self._record_corrupted = 0
+        self._record = _RecordBuffer(max(1, int(buffer_time * freq)))
+        self._record_start_time = time.time() if self.clock is None else self.clock.time()
+
+    def poll_record(self):
+        """
+        Simulated version of poll_record(). Applies self._analog_simulation_functions once per poll and fills all new
+        samples with the result.
+
+        :return: number of new samples
+        :rtype: int
+        """
+        with self._record_lock:
+            if self._record is None:
+                return 0
+            now = time.time() if self.clock is None else self.clock.time()
+            n = int((now - self._record_start_time) * self._record_freq) - self._record.written
+            if n <= 0:
+                return 0
+            if self.simulator is not None:
+                self._record.write(self.simulator.read_block(n))
+                return n
+            values = [func(v) for func, v in zip(self._analog_simulation_functions, self._analog_in_values)]
+            self._record.write(np.repeat(np.array(values, dtype=float)[:, np.newaxis], n, axis=1))
+            return n
+
+    # The generic parts of the record mode are identical to those of the real device
+    iter_record = DfwController.iter_record
+    record = DfwController.record
+    _instrument_record = DfwController._instrument_record
+    stats = DfwController.stats
+
+    def stop_record(self):
+        """
+        Simulated version of stop_record().
+
+        :return: number of samples lost and corrupted during the record, and number of samples dropped because the
+                 buffer overflowed
+        :rtype: int, int, int
+        """
+        with self._record_lock:
+            if self._record is None:
+                return 0, 0, 0
+            overflow = self._record.overflow
+            self._record = None
+        return 0, 0, overflow
+
     def close(self):
         pass
 
 
 def close_all():
     """Close all Digilent "WaveForms" devices"""
+    _require_dwf()
     dwf.FDwfDeviceCloseAll()
 
 
@@ -381,6 +989,9 @@ def enumerate_devices():
     :rtype: list
     """
     devices = []
+    if dwf is None:
+        logging.getLogger(__name__).warning(f"Can't enumerate devices without dwf ({_dwf_error})")
+        return devices
     try:
         last_err_msg = dwf.FDwfGetLastErrorMsg()
         if last_err_msg:
@@ -399,7 +1010,7 @@ def enumerate_devices():
             if device.isOpened():
                 logging.getLogger(__name__).warning(
                     f"Can't connect to device {i} ({dev_dict['info']['SN']}), a connection is already open.\n"
-                    "Note that the list was stored in " + __name__ + ".devices at the moment of import.")
+                    "Note that the cached list can be refreshed with " + __name__ + ".get_devices(refresh=True).")
                 dev_dict['configs'] = "Couldn't connect to device for further information"
             else:
                 dwf_ai = dwf.DwfAnalogIn(device)
@@ -423,27 +1034,51 @@ def enumerate_devices():
                 dwf_ai.close()
             devices.append(dev_dict)
     except:
-        from sys import exc_info
-        logging.getLogger(__name__).warning("Exception occured while enumerating devices:\n", exc_info()[0])
+        logging.getLogger(__name__).warning("Exception occured while enumerating devices", exc_info=True)
     return devices
 
 
-# Run enumerate_devices() once when loading the module to make the list available afterwards
-devices = enumerate_devices()
+def get_devices(refresh=False, ttl=None):
+    """
+    Return the list of devices as generated by enumerate_devices(), but cached.
+    The devices are only enumerated on the first call, when refresh is True or when the cached list is older than ttl.
+    This keeps importing this module fast and free of side effects (enumerating opens all connected devices).
+    The cached list is also available as the variable devices of this module.
+
+    :param refresh: enumerate the devices again (default False)
+    :type refresh: bool
+    :param ttl: maximum age (s) of the cached list (default None uses DEVICE_LIST_TTL)
+    :type ttl: float or None
+    :return: list of dictionaries containing information about the devices found
+    :rtype: list
+    """
+    global _device_list, _device_list_time
+    ttl = DEVICE_LIST_TTL if ttl is None else ttl
+    with _device_list_lock:
+        if refresh or _device_list is None or time.monotonic() - _device_list_time > ttl:
+            _device_list = enumerate_devices()
+            _device_list_time = time.monotonic()
+        return _device_list
+
+
+def __getattr__(name):
+    """Make the variable devices available without enumerating the devices at import."""
+    if name == 'devices':
+        return get_devices()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 
 def print_device_list(devices_list=None):
     """
     Prints the information in the list generated by enumerate_devices() in a readable form.
-    If no argument is given it prints the list stored at time of importing the module.
+    If no argument is given it prints the cached list of get_devices() (enumerating the devices if required).
 
-    :param devices: the list generated by enumerate_devices() (or None (default) to print the list stored at import)
+    :param devices: the list generated by enumerate_devices() (or None (default) to print the cached list)
     :type devices: list
     """
     incomplete = False
     if devices_list is None:
-        global devices
-        devices_list = list(devices)
+        devices_list = list(get_devices())
         incomplete = None
     for i, device in enumerate(devices_list):
         print("------------------------------")
@@ -467,13 +1102,13 @@ def print_device_list(devices_list=None):
                     conf['do']['ch'], conf['do']['buf']))
     if incomplete:
         print("\nThe device list appears to be incomplete. "
-              "Try " + __name__ + ".devices_list() without argument to print the list stored at time of import")
+              "Try " + __name__ + ".print_device_list() without argument to print the cached list")
 
 
 if __name__ == '__main__':
 
-    import \
-        labphew  # import this to use labphew style logging (by importing it before matplotlib it also prevents matplotlib from printing many debugs)
+    import labphew
+    labphew.configure_logging()  # use labphew style logging (by configuring it before matplotlib this also prevents matplotlib from printing many debugs)
     import matplotlib.pyplot as plt
 
     # Display a list of devices and their possible configurations
@@ -514,6 +1149,14 @@ if __name__ == '__main__':
     # If you only need one you can select it immediately with standard python:
     read_value = daq.read_analog()[0]
 
+    # Example of record mode: continuously acquire both channels at 10kHz and print averages of blocks of 1000 samples
+    daq.start_record(freq=10000)
+    for t, (avg0, avg1) in daq.iter_record(block_size=1000, average=True):
+        print(f'{t:.1f}s: {avg0:.3f} V, {avg1:.3f} V')
+        if t > 2:
+            break
+    daq.stop_record()
+
     # Example illustrating the use of (advanced) inherited methods:
 
     print("\nConfigure analog out channel 0")
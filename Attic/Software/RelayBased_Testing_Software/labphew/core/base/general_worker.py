@@ -7,13 +7,85 @@ This is a very simple example, that could be further expanded, but it is suffici
 working with methods(operations) from an Operator class.
 The only requisite of QThreads is to re-implement the ``run``
 method.
+
+Instead of polling the Operator with a QTimer, a view can let the WorkThread push new data with publish(). The
+returned DataPublisher emits data_ready in the gui thread as soon as the Operator sets a flag (e.g. _new_monitor_data),
+but at most once per frame_interval: many samples arriving within one frame result in a single update with all of
+them. When nothing happens, nothing runs in the gui thread.
+
 Although it works, this may not be the optimum/correct way of doing things, as pointed out in this `blog post
 <https://mayaposch.wordpress.com/2011/11/01/how-to-really-truly-use-qthreads-the-full-explanation/>`_
 """
 
 from PyQt5 import QtCore
+import threading
 import traceback
-from time import time, sleep
+from time import perf_counter
+
+
+class DataPublisher(QtCore.QObject):
+    """
+    Emits data_ready (in the thread the publisher lives in, normally the gui thread) when an Operator flag is set, at
+    most once per frame_interval. The payload is the return value of fetch (called in the gui thread, just before
+    emitting), e.g. a snapshot of the monitor buffer. The flag is cleared when the data is fetched.
+    """
+    data_ready = QtCore.pyqtSignal(object)
+    _wake = QtCore.pyqtSignal()  # emitted from the worker thread, received in the gui thread (queued connection)
+
+    def __init__(self, operator, flag='new_monitor_data', fetch=None, frame_interval=1 / 60, parent=None):
+        """
+        :param operator: the Operator (see OperatorBase.add_flag_listener)
+        :type operator: OperatorBase
+        :param flag: name of the flag that signals new data (default 'new_monitor_data')
+        :type flag: str
+        :param fetch: function that returns the data to emit (default None emits None)
+        :type fetch: callable or None
+        :param frame_interval: minimum time between two emits (s) (default 1/60)
+        :type frame_interval: float
+        :param parent: parent QObject
+        """
+        super().__init__(parent)
+        self.operator = operator
+        self.flag = flag
+        self.fetch = fetch
+        self.frame_interval = frame_interval
+        self.frames = 0  # number of times data_ready was emitted
+        self.notifications = 0  # number of times the flag was set
+        self._pending = threading.Event()  # a wake up is on its way to the gui thread
+        self._last_frame = 0.0
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.emit_frame)
+        self._wake.connect(self._schedule, QtCore.Qt.QueuedConnection)
+        operator.add_flag_listener(self._on_flag)
+
+    def _on_flag(self, name, value):
+        """Called in the worker thread whenever a flag of the operator changes. Only wakes the gui thread once."""
+        if name == self.flag and value:
+            self.notifications += 1
+            if not self._pending.is_set():
+                self._pending.set()
+                self._wake.emit()
+
+    def _schedule(self):
+        """Emit immediately if the previous frame is long enough ago, otherwise at the start of the next frame."""
+        if not self._timer.isActive():
+            delay = self._last_frame + self.frame_interval - perf_counter()
+            self._timer.start(max(0, int(delay * 1000)))
+
+    def emit_frame(self):
+        """Fetch the data and emit data_ready (may also be called directly, e.g. for a final update)."""
+        self._last_frame = perf_counter()
+        self._pending.clear()  # from here on new data wakes the gui thread again
+        setattr(self.operator, '_' + self.flag, False)
+        self.frames += 1
+        self.data_ready.emit(None if self.fetch is None else self.fetch())
+
+    def close(self):
+        """Stop listening to the operator."""
+        self._timer.stop()
+        self.operator.remove_flag_listener(self._on_flag)
+
 
 class WorkThread(QtCore.QThread):
     def __init__(self,  function, *args, **kwargs):
@@ -36,13 +108,29 @@ class WorkThread(QtCore.QThread):
         """
         Convenience method to gracefully stop thread before terminating forcefully after a timeout
         """
-        t0 = time()
         self.quit()
-        while time() < t0+timeout:
-            if self.isFinished():
-                return
-            sleep(0.005)
-        self.terminate()
+        if not self.wait(int(timeout * 1000)):  # returns as soon as the thread finishes
+            self.terminate()
+
+    def publish(self, operator, flag='new_monitor_data', fetch=None, frame_interval=1 / 60):
+        """
+        Push data from the operator to the gui in stead of polling it with a timer (see DataPublisher).
+        A final frame is emitted when the thread finishes, so the last data is always displayed.
+
+        :param operator: the Operator that runs in this thread
+        :type operator: OperatorBase
+        :param flag: name of the flag that signals new data (default 'new_monitor_data')
+        :type flag: str
+        :param fetch: function that returns the data to emit (default None emits None)
+        :type fetch: callable or None
+        :param frame_interval: minimum time between two updates of the gui (s) (default 1/60)
+        :type frame_interval: float
+        :return: the publisher, connect its data_ready signal to the update method of the view
+        :rtype: DataPublisher
+        """
+        publisher = DataPublisher(operator, flag, fetch, frame_interval, parent=self)
+        self.finished.connect(publisher.emit_frame)
+        return publisher
 
 if __name__ == '__main__':
     from time import sleep
@@ -9,18 +9,53 @@ Base class for operators.
 - By inheriting, methods from this base class will be used if they are missing in the child class. This allows to
   implement some fallback functionality and to warn the user.
 - In addition it implements the __enter__ and __exit__ methods to allow the class to be used in a python with block.
+- The flags used to coordinate with a gui (_stop, _pause, _busy, _new_monitor_data and _new_scan_data) are backed by
+  threading.Events. They are still set and read like booleans (self._stop = True), but loops can wait for them in stead
+  of polling: stop_event can be passed to a Pacer, _wait_while_paused() and _interruptible_sleep() return as soon as
+  the gui resumes or stops, wait_for_flag() waits for any flag and add_flag_listener() calls a function whenever a
+  flag is set (e.g. to emit a Qt signal when there's new data).
+- Every operator has an Instrumentation object (instrumentation, see labphew.core.tools.instrumentation) in which
+  loops record their latencies, deadline misses and queue depths. stats() combines them with the stats of the
+  instrument (if it has a stats() method), log_stats() logs a summary and prometheus_text() formats them for a
+  StatsServer.
 
 Example usage can be found at the bottom of the file under if __name__=='__main___'
 """
 
 from Battery_Testing_Software.labphew.core.base.tools import check_method_presence_and_warn
+from Battery_Testing_Software.labphew.core.tools.catalog import add_run
+from Battery_Testing_Software.labphew.core.tools.instrumentation import Instrumentation, format_stats, merge_stats, \
+    prometheus_text
 import logging
 import os.path
+import threading
 import yaml
 
 
+class _Flag:
+    """Boolean attribute of an Operator that is backed by a threading.Event (see OperatorBase)."""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj._flag_events[self.name].is_set()
+
+    def __set__(self, obj, value):
+        obj._set_flag(self.name, bool(value))
+
 
 class OperatorBase:
+    # Flags to coordinate with a gui, backed by Events (created in __new__, so child classes don't need to call super):
+    _flag_names = ('_stop', '_pause', '_busy', '_new_monitor_data', '_new_scan_data')
+    _stop = _Flag()  # signal a loop to stop
+    _pause = _Flag()  # signal a loop to pause
+    _busy = _Flag()  # the operator is busy (e.g. with scan or monitor)
+    _new_monitor_data = _Flag()  # new monitor data is available for a gui
+    _new_scan_data = _Flag()  # new scan data is available for a gui
+
     def __new__(cls, *args, **kwargs):
         """
         Get's called before the object (of the child class) is created and warns if required or
@@ -30,7 +65,102 @@ class OperatorBase:
         required = ['__init__']
         recommended = ['load_config', 'disconnect_devices', '_monitor_loop', 'save_scan', 'do_scan']
         check_method_presence_and_warn(cls, required, recommended)
-        return super().__new__(cls)
+        obj = super().__new__(cls)
+        obj._flag_events = {name: threading.Event() for name in cls._flag_names}
+        obj._flag_condition = threading.Condition()  # notified whenever a flag changes
+        obj._flag_listeners = []
+        obj.instrumentation = Instrumentation()  # latencies, counters and gauges of the loops, see stats()
+        return obj
+
+    def _set_flag(self, name, value):
+        """Set or clear a flag, wake up the threads waiting for it and call the listeners."""
+        with self._flag_condition:
+            event = self._flag_events[name]
+            changed = event.is_set() != value
+            if value:
+                event.set()
+            else:
+                event.clear()
+            self._flag_condition.notify_all()
+        if changed or value:  # setting a flag that is already set still notifies (e.g. new data)
+            for listener in list(self._flag_listeners):
+                listener(name.lstrip('_'), value)
+
+    def add_flag_listener(self, callback):
+        """
+        Call a function whenever a flag is set (or cleared). Note that it's called from the thread that sets the flag,
+        so it should be fast (e.g. emit a Qt signal).
+
+        :param callback: function that takes the name of the flag (without underscore, e.g. 'new_monitor_data') and
+                         its new value
+        :type callback: callable
+        """
+        self._flag_listeners.append(callback)
+
+    def remove_flag_listener(self, callback):
+        """Remove a function added with add_flag_listener()."""
+        if callback in self._flag_listeners:
+            self._flag_listeners.remove(callback)
+
+    def wait_for_flag(self, name, value=True, timeout=None):
+        """
+        Wait until a flag has a value.
+
+        :param name: name of the flag (e.g. 'stop' or 'new_monitor_data')
+        :type name: str
+        :param value: value to wait for (default True)
+        :type value: bool
+        :param timeout: maximum time to wait (s) (default None waits forever)
+        :type timeout: float or None
+        :return: True if the flag has the value, False if the timeout expired
+        :rtype: bool
+        """
+        event = self._flag_events['_' + name]
+        if value:
+            return event.wait(timeout)
+        with self._flag_condition:
+            return self._flag_condition.wait_for(lambda: not event.is_set(), timeout)
+
+    @property
+    def stop_event(self):
+        """The Event behind the _stop flag (e.g. to pass to a Pacer, so that it returns immediately on stop)."""
+        return self._flag_events['_stop']
+
+    def _claim_busy(self):
+        """
+        Set the _busy flag, unless it was already set (checking and setting is done at once, so two threads can't
+        both claim the operator).
+
+        :return: True if the operator was claimed
+        :rtype: bool
+        """
+        with self._flag_condition:
+            if self._busy:
+                return False
+            self._busy = True  # the condition is reentrant
+            return True
+
+    def _wait_while_paused(self):
+        """
+        Wait while _pause is set, returns immediately when the pause is released or when _stop is set.
+
+        :return: False if _stop is set
+        :rtype: bool
+        """
+        with self._flag_condition:
+            self._flag_condition.wait_for(lambda: not self._pause or self._stop)
+            return not self._stop
+
+    def _interruptible_sleep(self, seconds):
+        """
+        Sleep, but return as soon as _stop is set.
+
+        :param seconds: time to sleep (s)
+        :type seconds: float
+        :return: False if _stop is set
+        :rtype: bool
+        """
+        return not self.stop_event.wait(seconds)
 
     def __init__(self, *args, **kwargs):
         self.logger = logging.getLogger(self.__module__)
@@ -69,6 +199,58 @@ class OperatorBase:
         your GUI to actually use those save methods. 
         """)
 
+    def add_to_catalog(self, filename, kind, attrs=None, record=None):
+        """
+        Add saved data to the run catalog (see labphew.core.tools.catalog), if the catalog key of the properties is set
+        to the path of a database file. Errors are logged, so saving data never fails because of the catalog.
+
+        :param filename: path of the data file
+        :type filename: str
+        :param kind: kind of run, e.g. 'scan', 'test' or 'recording'
+        :type kind: str
+        :param attrs: attributes of the run (default None)
+        :type attrs: dict or None
+        :param record: index of the record in a file with records (default None)
+        :type record: int or None
+        """
+        catalog = getattr(self, 'properties', {}).get('catalog')
+        if catalog and add_run(os.path.expanduser(catalog), filename, kind, attrs, record):
+            self.logger.debug(f'{filename} added to catalog {catalog}')
+
+    def stats(self):
+        """
+        Timing statistics of the operator (e.g. monitor_lateness, monitor_deadline_misses, recorder_queue) combined with
+        those of the instrument (e.g. the latency of read_analog), if the instrument has a stats() method.
+
+        :return: latencies, counters and gauges (see Instrumentation.stats())
+        :rtype: dict
+        """
+        parts = [self.instrumentation.stats()]
+        instrument_stats = getattr(type(getattr(self, 'instrument', None)), 'stats', None)
+        if callable(instrument_stats):  # checked on the class, as simulated instruments answer any attribute
+            parts.insert(0, self.instrument.stats())
+        return merge_stats(*parts)
+
+    def log_stats(self, level=logging.INFO):
+        """
+        Log a one line summary of stats().
+
+        :param level: logging level (default logging.INFO)
+        :type level: int
+        """
+        self.logger.log(level, 'stats: ' + (format_stats(self.stats()) or 'nothing measured yet'))
+
+    def prometheus_text(self, labels=None):
+        """
+        stats() in the Prometheus text format, e.g. to serve with a StatsServer.
+
+        :param labels: labels added to every metric, e.g. {'cell': 'cell_1'} (default None)
+        :type labels: dict or None
+        :return: the text
+        :rtype: str
+        """
+        return prometheus_text([(labels or {}, self.stats())])
+
     def disconnect_devices(self):
         self.logger.warning(f"Your {self.__class__.__name__} is missing the disconnect_devices method. Use that to disconnect from your devices when required.")
 
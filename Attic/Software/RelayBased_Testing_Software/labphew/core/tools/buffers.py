@@ -0,0 +1,277 @@
+"""
+Buffers
+=======
+
+Containers for acquired samples that don't allocate or copy the existing data when a new datapoint arrives.
+
+RingBuffer keeps a fixed number of the most recent samples, which is what a Monitor needs to plot the last plot_points.
+ChunkedSampleStore keeps all samples of a (possibly multi-day) test, at a constant cost per sample.
+
+"""
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed capacity circular buffer for one or more columns of samples (for example time, channel 1 and channel 2).
+
+    Appending a sample is O(1) and does not allocate memory. Every sample is written twice (at index i and at
+    i + capacity) so that the samples in chronological order always form one contiguous block of memory. This allows
+    view() to return them (oldest first) without copying.
+
+    Note that a view is only consistent until the next append, because the writer keeps overwriting the oldest sample.
+    Use snapshot() to get a copy that can be handed to another thread (e.g. a gui).
+    There is a single writer and no lock: readers may see a sample that is being written, which is fine for display.
+    """
+
+    def __init__(self, capacity, columns=1, fill_value=0.0, dtype=float):
+        """
+        :param capacity: maximum number of samples (per column) to keep
+        :type capacity: int
+        :param columns: number of columns (default 1)
+        :type columns: int
+        :param fill_value: initial value of the buffer (default 0.0)
+        :type fill_value: float
+        :param dtype: numpy dtype of the buffer (default float)
+        :type dtype: type
+        """
+        if capacity < 1:
+            raise ValueError('capacity should be at least 1')
+        self.capacity = int(capacity)
+        self.columns = int(columns)
+        self._data = np.full((self.columns, 2 * self.capacity), fill_value, dtype=dtype)
+        self._index = 0  # position at which the next sample will be written (this is also the oldest sample)
+        self.count = 0  # total number of samples appended since creation
+
+    def __len__(self):
+        """Number of valid samples in the buffer (at most capacity)."""
+        return min(self.count, self.capacity)
+
+    def append(self, *values):
+        """
+        Append one sample (one value per column), overwriting the oldest sample.
+
+        :param values: one value per column
+        :type values: float
+        """
+        i = self._index
+        j = i + self.capacity
+        data = self._data
+        for c, value in enumerate(values):
+            data[c, i] = value
+            data[c, j] = value
+        self._index = i + 1 if i + 1 < self.capacity else 0
+        self.count += 1
+
+    def extend(self, block):
+        """
+        Append multiple samples at once.
+
+        :param block: samples with shape (columns, n)
+        :type block: numpy.ndarray
+        """
+        block = np.asarray(block)
+        n = block.shape[1]
+        if n >= self.capacity:
+            self._data[:, :self.capacity] = block[:, -self.capacity:]
+            self._data[:, self.capacity:] = block[:, -self.capacity:]
+            self._index = 0
+        else:
+            i = self._index
+            first = min(n, self.capacity - i)
+            for offset in (0, self.capacity):
+                self._data[:, offset + i:offset + i + first] = block[:, :first]
+                self._data[:, offset:offset + n - first] = block[:, first:]
+            self._index = (i + n) % self.capacity
+        self.count += n
+
+    def fill(self, column, values):
+        """
+        Overwrite an entire column (in chronological order, oldest first). Useful to initialize a time axis.
+
+        :param column: column index
+        :type column: int
+        :param values: capacity values
+        :type values: numpy.ndarray
+        """
+        ordered = np.roll(np.asarray(values, dtype=self._data.dtype), self._index)
+        self._data[column, :self.capacity] = ordered
+        self._data[column, self.capacity:] = ordered
+
+    def view(self, column=None):
+        """
+        Return the buffer in chronological order (oldest first) without copying.
+        Includes the initial fill values if fewer than capacity samples were appended.
+
+        :param column: column index, or None for all columns (default None)
+        :type column: int or None
+        :return: view of shape (capacity,) or (columns, capacity)
+        :rtype: numpy.ndarray
+        """
+        i = self._index
+        if column is None:
+            return self._data[:, i:i + self.capacity]
+        return self._data[column, i:i + self.capacity]
+
+    def snapshot(self, column=None):
+        """
+        Return a copy of the buffer in chronological order (oldest first).
+
+        :param column: column index, or None for all columns (default None)
+        :type column: int or None
+        :return: array of shape (capacity,) or (columns, capacity)
+        :rtype: numpy.ndarray
+        """
+        return self.view(column).copy()
+
+    def last(self, column=None):
+        """
+        Return the most recent sample.
+
+        :param column: column index, or None for all columns (default None)
+        :type column: int or None
+        :return: the value(s) of the most recent sample
+        :rtype: float or numpy.ndarray
+        """
+        i = self._index - 1 + self.capacity
+        if column is None:
+            return self._data[:, i].copy()
+        return self._data[column, i]
+
+
+class ChunkedSampleStore:
+    """
+    Append-only store for an unbounded number of samples with named columns (for example time, voltage and current).
+
+    The samples are stored in preallocated chunks of chunk_size samples. Appending is O(1) and never copies the data
+    that was already stored (in contrast to numpy.append, which copies the whole array every time). Slicing only touches
+    the chunks involved and iter_chunks() allows exporting all data without concatenating it into one big array.
+    """
+
+    def __init__(self, columns, chunk_size=4096, dtype=float):
+        """
+        :param columns: names of the columns
+        :type columns: list of str
+        :param chunk_size: number of samples per chunk (default 4096)
+        :type chunk_size: int
+        :param dtype: numpy dtype of the data (default float)
+        :type dtype: type
+        """
+        self.columns = tuple(columns)
+        self._column_index = {name: i for i, name in enumerate(self.columns)}
+        self.chunk_size = int(chunk_size)
+        self.dtype = dtype
+        self.clear()
+
+    def clear(self):
+        """Remove all samples."""
+        self._chunks = []
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def _column(self, column):
+        """Convert a column name (or index) to a column index."""
+        if isinstance(column, str):
+            return self._column_index[column]
+        return column
+
+    def append(self, *values):
+        """
+        Append one sample (one value per column).
+
+        :param values: one value per column
+        :type values: float
+        """
+        i = self._length % self.chunk_size
+        if i == 0:
+            self._chunks.append(np.empty((len(self.columns), self.chunk_size), dtype=self.dtype))
+        chunk = self._chunks[-1]
+        for c, value in enumerate(values):
+            chunk[c, i] = value
+        self._length += 1
+
+    def extend(self, block):
+        """
+        Append multiple samples at once.
+
+        :param block: samples with shape (columns, n)
+        :type block: numpy.ndarray
+        """
+        block = np.asarray(block)
+        done = 0
+        while done < block.shape[1]:
+            i = self._length % self.chunk_size
+            if i == 0:
+                self._chunks.append(np.empty((len(self.columns), self.chunk_size), dtype=self.dtype))
+            n = min(self.chunk_size - i, block.shape[1] - done)
+            self._chunks[-1][:, i:i + n] = block[:, done:done + n]
+            self._length += n
+            done += n
+
+    def last(self, column=None):
+        """
+        Return the most recent sample.
+
+        :param column: column name or index, or None for all columns (default None)
+        :type column: str or int or None
+        :return: the value(s) of the most recent sample
+        :rtype: float or numpy.ndarray
+        """
+        if not self._length:
+            raise IndexError('store is empty')
+        i = (self._length - 1) % self.chunk_size
+        if column is None:
+            return self._chunks[-1][:, i].copy()
+        return self._chunks[-1][self._column(column), i]
+
+    def iter_chunks(self, start=0, stop=None):
+        """
+        Iterate over the stored samples chunk by chunk, without copying. Useful to export data in a streaming fashion.
+        Samples appended while iterating are not included.
+
+        :param start: first sample (default 0)
+        :type start: int
+        :param stop: stop before this sample (default None, meaning all samples)
+        :type stop: int or None
+        :return: generator yielding arrays of shape (columns, n) (views of the internal chunks)
+        """
+        start, stop, _ = slice(start, stop).indices(self._length)
+        while start < stop:
+            chunk, i = divmod(start, self.chunk_size)
+            n = min(self.chunk_size - i, stop - start)
+            yield self._chunks[chunk][:, i:i + n]
+            start += n
+
+    def __getitem__(self, item):
+        """
+        store[start:stop] returns a copy of that range of samples with shape (columns, n).
+        store['name'] returns a copy of an entire column.
+        store[-1] returns the values of a single sample.
+        """
+        if isinstance(item, str):
+            return self.to_array()[self._column(item)]
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._length)
+            if step != 1:
+                return self.to_array()[:, item]
+            out = np.empty((len(self.columns), max(stop - start, 0)), dtype=self.dtype)
+            done = 0
+            for block in self.iter_chunks(start, stop):
+                out[:, done:done + block.shape[1]] = block
+                done += block.shape[1]
+            return out
+        index = item + self._length if item < 0 else item
+        if not 0 <= index < self._length:
+            raise IndexError('sample index out of range')
+        chunk, i = divmod(index, self.chunk_size)
+        return self._chunks[chunk][:, i].copy()
+
+    def to_array(self):
+        """
+        Return a copy of all samples as one array of shape (columns, n).
+
+        :rtype: numpy.ndarray
+        """
+        return self[0:self._length]
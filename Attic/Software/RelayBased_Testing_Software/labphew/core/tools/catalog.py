@@ -0,0 +1,432 @@
+"""
+Catalog
+=======
+
+Index of saved runs (scans, exported tests and recordings) in an SQLite database, so runs can be found by their
+attributes without opening the data files.
+
+Every run is a file (or one record of a file with records, see labphew.core.tools.writers) with a kind ('scan', 'test'
+or 'recording'), a time and its attributes: user, config_file, scan parameters, test yml fields, summary statistics,
+... Nested dictionaries are flattened with dots (e.g. 'test.target_current'). Numbers (and booleans) and strings are
+stored in an indexed table of key/value pairs, so a lookup only reads the index, also for tens of thousands of runs.
+
+The Operators add a run whenever they save data, if the catalog key of their properties (config file) is set to the
+path of a database file. Existing files can be added with index_file(). Queries return the path (and record) of the
+matching runs:
+
+    with RunCatalog('catalog.sqlite') as catalog:
+        for run in catalog.find('recording', since='2026-09-01', mode='cc_charge', setpoint=80, cell='cell_1'):
+            print(run.path, run.record)
+        runs = catalog.find(where={'test.target_current': (75, 85)})  # keys with dots, ranges as (min, max)
+
+"""
+import os
+import json
+import sqlite3
+import logging
+from collections import namedtuple
+from datetime import datetime
+from Battery_Testing_Software.labphew.core.tools.writers import RUN
+from Battery_Testing_Software.labphew.core.tools.columnar import read_sidecar
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = '%d-%m-%YT%H:%M:%S'  # format of the time attributes written by save_scan and the StreamRecorder
+TIME_KEYS = ('time', 'start_time')  # attributes that are used as the time of a run
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, path TEXT NOT NULL, record INTEGER, kind TEXT,
+                                 time REAL, indexed REAL);
+CREATE INDEX IF NOT EXISTS runs_path ON runs (path, record);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (time);
+CREATE INDEX IF NOT EXISTS runs_kind ON runs (kind, time);
+CREATE TABLE IF NOT EXISTS attrs (run INTEGER NOT NULL, key TEXT NOT NULL, number REAL, text TEXT);
+CREATE INDEX IF NOT EXISTS attrs_number ON attrs (key, number, run);
+CREATE INDEX IF NOT EXISTS attrs_text ON attrs (key, text, run);
+CREATE INDEX IF NOT EXISTS attrs_run ON attrs (run, key, number, text);
+"""
+
+
+# Handle of a run in the catalog: record is the index along run in a file with records (otherwise None), time is a
+# unix timestamp
+Run = namedtuple('Run', ('id', 'path', 'record', 'kind', 'time'))
+
+
+def flatten(attrs, prefix=''):
+    """
+    Flatten nested dictionaries to a single dictionary with dotted keys.
+
+    :param attrs: attributes
+    :type attrs: dict
+    :param prefix: prefix for the keys (default '')
+    :type prefix: str
+    :return: flattened attributes
+    :rtype: dict
+    """
+    flat = {}
+    for key, value in attrs.items():
+        key = prefix + str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, key + '.'))
+        else:
+            flat[key] = value
+    return flat
+
+
+def to_timestamp(value):
+    """
+    Convert a time to a unix timestamp.
+
+    :param value: timestamp, datetime, ISO date(time) string ('2026-09-01') or string in TIME_FORMAT
+    :type value: float or datetime or str
+    :return: unix timestamp, or None if the time can't be interpreted
+    :rtype: float or None
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, bytes):
+        value = value.decode()
+    if isinstance(value, str):
+        for parse in (lambda s: datetime.strptime(s, TIME_FORMAT), datetime.fromisoformat):
+            try:
+                return parse(value).timestamp()
+            except ValueError:
+                pass
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _column(value):
+    """Number and text column of a value (bool counts as number), or None if it can't be stored."""
+    if hasattr(value, 'item') and getattr(value, 'ndim', 1) == 0:  # numpy scalar
+        value = value.item()
+    if isinstance(value, bytes):
+        value = value.decode(errors='replace')
+    if isinstance(value, (bool, int, float)):
+        return float(value), None
+    if isinstance(value, str):
+        return None, value
+    if value is None:
+        return None
+    try:
+        return None, json.dumps(value if not hasattr(value, 'tolist') else value.tolist())
+    except TypeError:
+        return None
+
+
+def dataset_summary(dataset):
+    """
+    Summary statistics of the data variables of a (scan) Dataset, to store in the catalog.
+
+    :param dataset: the data
+    :type dataset: xarray.Dataset
+    :return: number of points and minimum, maximum and mean of every numeric data variable ('<name>.min', ...)
+    :rtype: dict
+    """
+    summary = {'points': int(max(dataset.sizes.values(), default=0))}
+    for name, variable in dataset.data_vars.items():
+        if variable.dtype.kind in 'biuf' and variable.size:
+            summary[f'{name}.min'] = float(variable.min())
+            summary[f'{name}.max'] = float(variable.max())
+            summary[f'{name}.mean'] = float(variable.mean())
+    return summary
+
+
+class RunCatalog:
+    """
+    SQLite index of saved runs. Can be used in a with block (the connection is closed at the end).
+    """
+
+    def __init__(self, filename, timeout=30):
+        """
+        :param filename: path of the database file (created if it doesn't exist)
+        :type filename: str
+        :param timeout: time to wait for another process that is writing to the database (s) (default 30)
+        :type timeout: float
+        """
+        self.filename = filename
+        self._connection = sqlite3.connect(filename, timeout=timeout)
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def __contains__(self, path):
+        """The catalog has runs of the file."""
+        return self._connection.execute('SELECT 1 FROM runs WHERE path = ? LIMIT 1',
+                                        (os.path.abspath(path),)).fetchone() is not None
+
+    def add(self, path, kind, attrs=None, record=None, time=None):
+        """
+        Add a run. A run that was already in the catalog for the same file (and record) is replaced, adding a file
+        without record (or record 0) replaces all runs of the file.
+
+        :param path: path of the data file
+        :type path: str
+        :param kind: kind of run, e.g. 'scan', 'test' or 'recording'
+        :type kind: str
+        :param attrs: attributes of the run, nested dictionaries are flattened (see flatten) (default None)
+        :type attrs: dict or None
+        :param record: index of the record in a file with records (default None)
+        :type record: int or None
+        :param time: time of the run (see to_timestamp) (default None: time or start_time attribute, or modification
+                     time of the file)
+        :type time: float or datetime or str or None
+        :return: the run
+        :rtype: Run
+        """
+        path = os.path.abspath(path)
+        attrs = flatten(attrs or {})
+        if time is None:
+            time = next((to_timestamp(attrs[key]) for key in TIME_KEYS if key in attrs), None)
+        time = to_timestamp(time)
+        if time is None:
+            time = os.path.getmtime(path) if os.path.exists(path) else datetime.now().timestamp()
+        rows = []
+        for key, value in attrs.items():
+            column = _column(value)
+            if column is None:
+                logger.debug(f"attribute '{key}' of {path} is not stored in the catalog")
+            else:
+                rows.append((key,) + column)
+        with self._connection:
+            if record:
+                self._remove(path, record)
+            else:
+                self._remove(path)
+            cursor = self._connection.execute('INSERT INTO runs (path, record, kind, time, indexed) '
+                                              'VALUES (?, ?, ?, ?, ?)',
+                                              (path, record, kind, time, datetime.now().timestamp()))
+            run_id = cursor.lastrowid
+            self._connection.executemany('INSERT INTO attrs (run, key, number, text) VALUES (?, ?, ?, ?)',
+                                         [(run_id,) + row for row in rows])
+        return Run(run_id, path, record, kind, time)
+
+    def _remove(self, path, record=None):
+        """Delete the runs of a file (or of one record of it), without committing."""
+        if record is None:
+            ids = self._connection.execute('SELECT id FROM runs WHERE path = ?', (path,)).fetchall()
+        else:
+            ids = self._connection.execute('SELECT id FROM runs WHERE path = ? AND record = ?',
+                                           (path, record)).fetchall()
+        self._connection.executemany('DELETE FROM attrs WHERE run = ?', ids)
+        self._connection.executemany('DELETE FROM runs WHERE id = ?', ids)
+
+    def remove(self, path, record=None):
+        """
+        Remove the runs of a file from the catalog.
+
+        :param path: path of the data file
+        :type path: str
+        :param record: only remove this record (default None, all runs of the file)
+        :type record: int or None
+        """
+        with self._connection:
+            self._remove(os.path.abspath(path), record)
+
+    def prune(self):
+        """
+        Remove the runs of files that don't exist anymore.
+
+        :return: number of files removed from the catalog
+        :rtype: int
+        """
+        paths = [path for (path,) in self._connection.execute('SELECT DISTINCT path FROM runs')
+                 if not os.path.exists(path)]
+        with self._connection:
+            for path in paths:
+                self._remove(path)
+        return len(paths)
+
+    def find(self, kind=None, since=None, until=None, where=None, limit=None, **conditions):
+        """
+        Find runs by kind, time and attributes. Only the catalog is read, not the data files.
+
+        A condition is an attribute name and a value: a number (or bool) or string matches runs with exactly that
+        value, a tuple (min, max) matches numbers in that range (use None for an open end), and a list matches any of
+        its values.
+
+        :param kind: kind of run, e.g. 'scan', 'test' or 'recording' (default None, all kinds)
+        :type kind: str or None
+        :param since: only runs at or after this time (see to_timestamp) (default None)
+        :type since: float or datetime or str or None
+        :param until: only runs before this time (default None)
+        :type until: float or datetime or str or None
+        :param where: conditions, for attributes that are no valid keyword (e.g. {'test.target_current': 80})
+        :type where: dict or None
+        :param limit: maximum number of runs (default None, all)
+        :type limit: int or None
+        :param conditions: conditions as keyword arguments (e.g. mode='cc_charge', setpoint=80)
+        :return: matching runs, most recent first
+        :rtype: list of Run
+        """
+        conditions = dict(where or {}, **conditions)
+        # Every condition is a join with attrs. The condition with the fewest matches is used to start from, so a
+        # query only reads the index entries of the most selective attribute and looks up the others per run.
+        matches = [self._condition(key, value) for key, value in conditions.items()]
+        counts = []
+        for match in matches:  # counting stops as soon as a condition has more matches than the best one so far
+            counts.append(self._count(match, min(counts, default=10000)))
+        matches = [match for count, match in sorted(zip(counts, matches), key=lambda pair: pair[0])]
+        # (the other attributes are looked up by run, forced with INDEXED BY: the planner may prefer a range scan)
+        tables = ['attrs a{}'.format(n) + (' INDEXED BY attrs_run' if n else '') for n in range(len(matches))]
+        tables.append('runs')
+        sql, parameters = [], []
+        for n, (match, values) in enumerate(matches):
+            sql.append(match.format(a=f'a{n}'))
+            sql += [f'a{n}.run = a0.run'] if n else ['runs.id = a0.run']
+            parameters += values
+        if kind is not None:
+            sql.append('kind = ?')
+            parameters.append(kind)
+        for bound, operator in ((since, '>='), (until, '<')):
+            if bound is not None:
+                timestamp = to_timestamp(bound)
+                if timestamp is None:
+                    raise ValueError(f'Invalid time: {bound}')
+                sql.append(f'time {operator} ?')
+                parameters.append(timestamp)
+        query = 'SELECT runs.id, path, record, kind, time FROM {} WHERE {} ORDER BY time DESC'.format(
+            ' CROSS JOIN '.join(tables), ' AND '.join(sql) or '1')
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(int(limit))
+        return [Run(*row) for row in self._connection.execute(query, parameters)]
+
+    def _count(self, condition, maximum):
+        """Number of attributes that match a condition (see _condition), counted up to maximum + 1."""
+        match, values = condition
+        query = 'SELECT COUNT(*) FROM (SELECT 1 FROM attrs a WHERE {} LIMIT {})'.format(match.format(a='a'),
+                                                                                       int(maximum) + 1)
+        return self._connection.execute(query, values).fetchone()[0]
+
+    @staticmethod
+    def _condition(key, value):
+        """SQL expression (with {a} for the alias of the attrs table) and parameters of a condition on an attribute."""
+        if isinstance(value, tuple):
+            low, high = value
+            expressions, values = ['{a}.key = ?'], [key]
+            if low is not None:
+                expressions.append('{a}.number >= ?')
+                values.append(float(low))
+            if high is not None:
+                expressions.append('{a}.number <= ?')
+                values.append(float(high))
+            if low is None and high is None:
+                expressions.append('{a}.number IS NOT NULL')
+            return ' AND '.join(expressions), values
+        if isinstance(value, (list, set)):
+            columns = [column for column in map(_column, value) if column is not None]
+            numbers = [number for number, text in columns if number is not None]
+            texts = [text for number, text in columns if text is not None]
+            expressions = []
+            if numbers:
+                expressions.append('{{a}}.number IN ({})'.format(', '.join('?' * len(numbers))))
+            if texts:
+                expressions.append('{{a}}.text IN ({})'.format(', '.join('?' * len(texts))))
+            return '{{a}}.key = ? AND ({})'.format(' OR '.join(expressions) or '0'), [key] + numbers + texts
+        number, text = _column(value)
+        if number is not None:
+            return '{a}.key = ? AND {a}.number = ?', [key, number]
+        return '{a}.key = ? AND {a}.text = ?', [key, text]
+
+    def attrs(self, run):
+        """
+        Attributes of a run, as stored in the catalog (lists are stored as json strings).
+
+        :param run: the run (or its id)
+        :type run: Run or int
+        :return: attributes with flattened keys
+        :rtype: dict
+        """
+        run_id = run.id if isinstance(run, Run) else int(run)
+        rows = self._connection.execute('SELECT key, number, text FROM attrs WHERE run = ?', (run_id,))
+        return {key: text if number is None else number for key, number, text in rows}
+
+    def index_file(self, path, kind=None):
+        """
+        Add an existing file to the catalog, reading only its attributes: a netCDF file or Zarr store saved by
+        save_scan (one run per record for a file with records), an HDF5 recording of a test (requires h5py) or an
+        exported test in a .npy file with json sidecar (see labphew.core.tools.columnar).
+        Runs of the file that are already in the catalog are replaced (and lose the summary statistics that were added
+        when the file was saved).
+
+        :param path: path of the file
+        :type path: str
+        :param kind: kind of run (default None: 'scan' for netCDF and Zarr, 'recording' for HDF5 recordings, 'test' for
+                     npy files)
+        :type kind: str or None
+        :return: the runs that were added
+        :rtype: list of Run
+        """
+        extension = os.path.splitext(path.rstrip('/\\'))[1].lower()
+        if extension == '.npy':
+            return [self.add(path, kind or 'test', read_sidecar(path)['attrs'])]
+        if extension == '.h5':
+            import h5py
+            with h5py.File(path, 'r') as f:
+                is_recording = 'data' in f and 'columns' in f['data'].attrs
+                attrs = dict(f.attrs)
+            if is_recording:
+                return [self.add(path, kind or 'recording', attrs)]
+        if extension not in ('.nc', '.h5', '.zarr'):
+            raise ValueError(f'Unsupported file type: {path}')
+        import xarray as xr
+        with (xr.open_zarr(path) if extension == '.zarr' else xr.open_dataset(path)) as dataset:
+            attrs = dict(dataset.attrs)
+            if RUN not in dataset.sizes:
+                return [self.add(path, kind or 'scan', attrs)]
+            records = {name: variable.values for name, variable in dataset.variables.items()
+                       if variable.dims == (RUN,)}
+        runs = []
+        for record in range(len(next(iter(records.values()), []))):
+            run_attrs = dict(attrs)
+            for name, values in records.items():
+                value = values[record]
+                if not (isinstance(value, float) and value != value):  # skip missing (NaN) values
+                    run_attrs[name] = value
+            runs.append(self.add(path, kind or 'scan', run_attrs, record=record))
+        return runs
+
+
+def add_run(catalog, path, kind, attrs=None, record=None):
+    """
+    Add a run to a catalog file, logging (in stead of raising) errors, so that saving data never fails because of the
+    catalog.
+
+    :param catalog: path of the catalog database, or None to do nothing
+    :type catalog: str or None
+    :param path: path of the data file
+    :type path: str
+    :param kind: kind of run, e.g. 'scan', 'test' or 'recording'
+    :type kind: str
+    :param attrs: attributes of the run (default None)
+    :type attrs: dict or None
+    :param record: index of the record in a file with records (default None)
+    :type record: int or None
+    :return: the run, or None
+    :rtype: Run or None
+    """
+    if not catalog:
+        return None
+    try:
+        with RunCatalog(catalog) as run_catalog:
+            return run_catalog.add(path, kind, attrs, record)
+    except Exception as error:
+        logger.error(f'Adding {path} to catalog {catalog} failed: {error}')
+        return None
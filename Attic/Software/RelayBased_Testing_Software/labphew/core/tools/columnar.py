@@ -0,0 +1,148 @@
+"""
+Columnar
+========
+
+Lossless binary export of samples with named columns (e.g. time, voltage and current of a battery test), that can be
+read back without parsing.
+
+save_npy() writes a standard .npy file with shape (columns, samples), so every column is one contiguous block in the
+file, and a JSON sidecar with the same name (.json) that describes the columns, their units and the attributes of the
+run. The data is written chunk by chunk straight into a memory-mapped file, so exporting millions of samples takes about
+as long as copying them. load_npy() maps the file into memory: a column is only read from disk when it is used.
+
+    save_npy('test.npy', store, units={'time': 's', 'voltage': 'V', 'current': 'mA'}, attrs={'mode': 'cc_charge'})
+    data = load_npy('test.npy')
+    data['voltage'].max(), data['attrs']['mode']
+
+Without labphew the file can be read with numpy alone: np.load('test.npy', mmap_mode='r') gives the array with one row
+per column, the order of the columns is in the sidecar.
+
+save_csv() streams the same data to a text file (larger and slower, and rounded to the format), for tools that can only
+read csv.
+
+"""
+import os
+import json
+import numpy as np
+
+FORMAT = 'labphew-columns'  # identifies the sidecar
+VERSION = 1
+
+
+def sidecar_filename(filename):
+    """
+    :param filename: path of the .npy file
+    :type filename: str
+    :return: path of the JSON sidecar that belongs to it
+    :rtype: str
+    """
+    return os.path.splitext(filename)[0] + '.json'
+
+
+def _to_json(value):
+    """Convert numpy scalars and arrays in attributes to plain python for json."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+def _blocks(data):
+    """Columns, number of samples and an iterator over blocks of shape (columns, n) of a store or an array."""
+    if hasattr(data, 'iter_chunks'):  # e.g. ChunkedSampleStore
+        return data.columns, len(data), data.iter_chunks()
+    data = np.asarray(data)
+    return None, data.shape[1], iter((data,))
+
+
+def save_npy(filename, data, columns=None, units=None, attrs=None, dtype=float):
+    """
+    Save samples to a .npy file with shape (columns, samples) and a JSON sidecar (see sidecar_filename).
+
+    :param filename: path of the .npy file
+    :type filename: str
+    :param data: samples, e.g. a ChunkedSampleStore (written chunk by chunk) or an array with shape (columns, samples)
+    :type data: ChunkedSampleStore or numpy.ndarray
+    :param columns: names of the columns (default None uses the columns of the store)
+    :type columns: list of str or None
+    :param units: unit of every column, e.g. {'time': 's'} (default None)
+    :type units: dict or None
+    :param attrs: attributes of the run, stored in the sidecar (should be json serializable) (default None)
+    :type attrs: dict or None
+    :param dtype: numpy dtype of the file (default float, i.e. float64)
+    :type dtype: type
+    """
+    store_columns, length, blocks = _blocks(data)
+    columns = tuple(columns or store_columns or ())
+    if not columns:
+        raise ValueError('The names of the columns are required')
+    array = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(len(columns), length))
+    start = 0
+    for block in blocks:
+        array[:, start:start + block.shape[1]] = block
+        start += block.shape[1]
+    array.flush()
+    del array
+    sidecar = {'format': FORMAT, 'version': VERSION, 'data': os.path.basename(filename), 'layout': 'columns',
+               'columns': list(columns), 'units': dict(units or {}), 'samples': length,
+               'dtype': np.dtype(dtype).str, 'attrs': dict(attrs or {})}
+    with open(sidecar_filename(filename), 'w') as f:
+        json.dump(sidecar, f, indent=2, default=_to_json)
+
+
+def read_sidecar(filename):
+    """
+    Read the JSON sidecar of a .npy file.
+
+    :param filename: path of the .npy file (or of the sidecar)
+    :type filename: str
+    :return: contents of the sidecar: columns, units, samples, dtype and attrs
+    :rtype: dict
+    """
+    with open(sidecar_filename(filename), 'r') as f:
+        sidecar = json.load(f)
+    if sidecar.get('format') != FORMAT:
+        raise ValueError(f'{sidecar_filename(filename)} is not a sidecar of a {FORMAT} file')
+    return sidecar
+
+
+def load_npy(filename, mmap=True):
+    """
+    Load a file saved with save_npy().
+
+    :param filename: path of the .npy file
+    :type filename: str
+    :param mmap: map the file into memory in stead of reading it (default True)
+    :type mmap: bool
+    :return: every column as a 1d array (read-only views of the mapped file if mmap), and the attributes (attrs) and
+             units of the run
+    :rtype: dict
+    """
+    sidecar = read_sidecar(filename)
+    array = np.load(filename, mmap_mode='r' if mmap else None)
+    if array.shape[0] != len(sidecar['columns']):
+        raise ValueError(f"{filename} has {array.shape[0]} columns, its sidecar describes {len(sidecar['columns'])}")
+    data = {name: array[i] for i, name in enumerate(sidecar['columns'])}
+    data['attrs'] = sidecar['attrs']
+    data['units'] = sidecar['units']
+    return data
+
+
+def save_csv(filename, data, header=(), fmt='%1.3f'):
+    """
+    Stream samples to a csv file, one sample per line, without copying them into one big array first.
+
+    :param filename: path of the csv file
+    :type filename: str
+    :param data: samples, e.g. a ChunkedSampleStore or an array with shape (columns, samples)
+    :type data: ChunkedSampleStore or numpy.ndarray
+    :param header: lines written (as comments, starting with #) before the data (default ())
+    :type header: list of str
+    :param fmt: format of the values (default '%1.3f')
+    :type fmt: str
+    """
+    _, _, blocks = _blocks(data)
+    with open(filename, 'w') as f:
+        for line in header:
+            f.write('# ' + line + '\n')
+        for block in blocks:
+            np.savetxt(f, block.T, delimiter=',', fmt=fmt)
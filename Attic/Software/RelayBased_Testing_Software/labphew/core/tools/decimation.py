@@ -0,0 +1,180 @@
+"""
+Decimation
+==========
+
+Reduce the number of points of a (long) trace before plotting it, without losing its visual envelope.
+
+A plot cannot show more than about one point per pixel, but pyqtgraph still has to process every point passed to
+setData(). The min/max envelope keeps the lowest and highest sample of every bucket of consecutive samples, so spikes
+and dips remain visible while the number of plotted points only depends on the width of the plot.
+
+minmax_decimate() does this for a complete trace (e.g. the snapshot of a RingBuffer).
+MinMaxDecimator maintains the envelope incrementally while samples arrive, so plotting the full history of a
+(possibly multi-day) test costs the same on every gui update, regardless of its length.
+
+"""
+import numpy as np
+
+
+def _bucket_extrema(y, size):
+    """
+    Indices of the minimum and maximum of every complete bucket of size consecutive samples.
+
+    :param y: samples
+    :type y: numpy.ndarray
+    :param size: number of samples per bucket
+    :type size: int
+    :return: indices of the minima and of the maxima (one per bucket)
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    full = len(y) // size
+    blocks = y[:full * size].reshape(full, size)
+    offset = np.arange(full) * size
+    return blocks.argmin(axis=1) + offset, blocks.argmax(axis=1) + offset
+
+
+def minmax_decimate(x, y, buckets):
+    """
+    Min/max envelope of a trace: the lowest and highest sample of each of (about) buckets consecutive blocks of samples.
+    The order of the samples is preserved. Traces of at most 2 * buckets samples are returned unchanged.
+
+    :param x: x values (e.g. time)
+    :type x: numpy.ndarray
+    :param y: y values
+    :type y: numpy.ndarray
+    :param buckets: number of buckets, typically the width of the plot in pixels
+    :type buckets: int
+    :return: decimated x and y values (at most 2 * buckets + 2 points)
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    buckets = max(int(buckets), 1)
+    if n <= 2 * buckets:
+        return x, y
+    size = -(-n // buckets)  # ceil
+    i_min, i_max = _bucket_extrema(y, size)
+    tail = n - n % size
+    if tail < n:
+        i_min = np.append(i_min, tail + y[tail:].argmin())
+        i_max = np.append(i_max, tail + y[tail:].argmax())
+    index = np.sort(np.stack((i_min, i_max), axis=1), axis=1).ravel()
+    return x[index], y[index]
+
+
+class MinMaxDecimator:
+    """
+    Incrementally maintained min/max envelope of a growing trace.
+
+    Samples are grouped in buckets of bucket_size consecutive samples, of which only the minimum and maximum are kept.
+    When the number of buckets exceeds twice the requested width, neighbouring buckets are merged and the bucket size is
+    doubled. Therefore memory use and the number of points returned by data() stay between 2 and 4 points per pixel
+    (plus the extrema of the incomplete last bucket), while the cost of adding a sample is constant on average.
+
+    Note that the bucket boundaries depend on when merges happened, so buckets may differ in size. The envelope is
+    exact: every bucket reports the true minimum and maximum of the samples it contains.
+    """
+
+    def __init__(self, width=1000):
+        """
+        :param width: width of the plot in pixels (default 1000)
+        :type width: int
+        """
+        self.width = max(int(width), 1)
+        self.clear()
+
+    def __len__(self):
+        """Total number of samples added since creation (or the last clear)."""
+        return self.count
+
+    def clear(self):
+        """
+        Remove all samples (e.g. at the start of a new test).
+        """
+        self.bucket_size = 1
+        self.count = 0
+        self._min = np.empty((3, 0))  # rows: sample index, x, y of the minimum of each bucket
+        self._max = np.empty((3, 0))  # rows: sample index, x, y of the maximum of each bucket
+        self._pending_x = np.empty(0)  # samples of the incomplete last bucket
+        self._pending_y = np.empty(0)
+
+    def resize(self, width):
+        """
+        Change the width (e.g. when the plot is resized). Reducing the width merges buckets immediately, increasing it
+        only affects new samples.
+
+        :param width: width of the plot in pixels
+        :type width: int
+        """
+        self.width = max(int(width), 1)
+        self._merge()
+
+    def append(self, x, y):
+        """
+        Add one sample.
+
+        :param x: x value (e.g. time)
+        :type x: float
+        :param y: y value
+        :type y: float
+        """
+        self.extend((x,), (y,))
+
+    def extend(self, x, y):
+        """
+        Add multiple samples (e.g. all samples acquired since the previous gui update).
+
+        :param x: x values (e.g. time)
+        :type x: numpy.ndarray
+        :param y: y values
+        :type y: numpy.ndarray
+        """
+        x = np.concatenate((self._pending_x, np.asarray(x, dtype=float).ravel()))
+        y = np.concatenate((self._pending_y, np.asarray(y, dtype=float).ravel()))
+        start = self.count - len(self._pending_y)  # sample index of the first sample in x and y
+        self.count = start + len(y)
+        size = self.bucket_size
+        full = len(y) // size * size
+        if full:
+            i_min, i_max = _bucket_extrema(y, size)
+            self._min = np.hstack((self._min, np.vstack((i_min + start, x[i_min], y[i_min]))))
+            self._max = np.hstack((self._max, np.vstack((i_max + start, x[i_max], y[i_max]))))
+            self._merge()
+        self._pending_x = x[full:]
+        self._pending_y = y[full:]
+
+    def _merge(self):
+        """
+        Merge pairs of neighbouring buckets until there are at most 2 * width buckets.
+        """
+        while self._min.shape[1] > 2 * self.width:
+            n = self._min.shape[1]
+            pairs = n // 2 * 2
+            first_min, second_min = self._min[:, 0:pairs:2], self._min[:, 1:pairs:2]
+            first_max, second_max = self._max[:, 0:pairs:2], self._max[:, 1:pairs:2]
+            merged_min = np.where(second_min[2] < first_min[2], second_min, first_min)
+            merged_max = np.where(second_max[2] > first_max[2], second_max, first_max)
+            self._min = np.hstack((merged_min, self._min[:, pairs:]))  # an odd last bucket is kept as it is
+            self._max = np.hstack((merged_max, self._max[:, pairs:]))
+            self.bucket_size *= 2
+
+    def data(self):
+        """
+        Return the envelope in chronological order, ready to be passed to setData().
+
+        :return: x and y values
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        minima, maxima = self._min, self._max
+        if len(self._pending_y):
+            start = self.count - len(self._pending_y)
+            i_min, i_max = self._pending_y.argmin(), self._pending_y.argmax()
+            minima = np.hstack((minima, [[start + i_min], [self._pending_x[i_min]], [self._pending_y[i_min]]]))
+            maxima = np.hstack((maxima, [[start + i_max], [self._pending_x[i_max]], [self._pending_y[i_max]]]))
+        min_first = minima[0] <= maxima[0]
+        first = np.where(min_first, minima, maxima)
+        second = np.where(min_first, maxima, minima)
+        points = np.stack((first, second), axis=2).reshape(3, -1)  # interleave: first and second point of each bucket
+        keep = np.stack((np.ones(len(first[0]), dtype=bool), first[0] != second[0]), axis=1).ravel()  # no duplicates
+        return points[1, keep], points[2, keep]
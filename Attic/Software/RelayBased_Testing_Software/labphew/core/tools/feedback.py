@@ -0,0 +1,253 @@
+"""
+Feedback
+========
+
+Feedback controllers and tools to judge how well they perform.
+
+PID and BangBang share the same interface: update(measurement, dt) returns the new output. Both only use numpy
+operations on their inputs, so they also accept arrays (e.g. to control many simulated cells at once).
+StepResponse keeps track of the overshoot and settling time after a setpoint is applied, it accepts arrays too.
+
+"""
+import numpy as np
+
+
+class PID:
+    """
+    PID controller with optional feed-forward, anti-windup, output limits, slew rate limit and dead band.
+
+    output = kp * error + integral(ki * error) - kd * d(measurement)/dt + feed_forward * setpoint
+
+    The derivative acts on the measurement (not on the error) so a change of setpoint doesn't cause a kick.
+    With anti_windup the integral is corrected whenever the output is limited, so that the integral doesn't keep
+    growing while the output can't follow (which would cause a large overshoot once the limit is no longer reached).
+    """
+
+    def __init__(self, kp, ki=0.0, kd=0.0, setpoint=0.0, feed_forward=0.0, output_limits=(None, None),
+                 anti_windup=True, max_step=None, margin=0.0):
+        """
+        :param kp: proportional gain
+        :type kp: float
+        :param ki: integral gain (per second)
+        :type ki: float
+        :param kd: derivative gain (seconds)
+        :type kd: float
+        :param setpoint: initial setpoint
+        :type setpoint: float or numpy.ndarray
+        :param feed_forward: gain applied to the setpoint and added to the output (default 0.0)
+        :type feed_forward: float
+        :param output_limits: (lower, upper) limit of the output, None for no limit (default (None, None))
+        :type output_limits: tuple
+        :param anti_windup: correct the integral when the output is limited (default True)
+        :type anti_windup: bool
+        :param max_step: maximum change of the output per update, None for no limit (default None)
+        :type max_step: float or None
+        :param margin: dead band around the setpoint in which the error is considered 0 (default 0.0)
+        :type margin: float
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.setpoint = setpoint
+        self.feed_forward = feed_forward
+        self.output_limits = output_limits
+        self.anti_windup = anti_windup
+        self.max_step = max_step
+        self.margin = margin
+        self.reset()
+
+    def reset(self, output=0.0):
+        """
+        Reset the controller. The integral is set such that the first output (without error) equals output, which
+        allows a bumpless start from the present output value.
+
+        :param output: present output value (default 0.0)
+        :type output: float or numpy.ndarray
+        """
+        self.output = output
+        self._integral = output - self.feed_forward * self.setpoint
+        self._last_measurement = None
+
+    def _limit(self, output):
+        lower, upper = self.output_limits
+        return np.clip(output, -np.inf if lower is None else lower, np.inf if upper is None else upper)
+
+    def update(self, measurement, dt):
+        """
+        Calculate the new output.
+        A measurement that is not finite (e.g. NaN of a read timeout) is ignored: the integral and previous measurement
+        are kept and the previous output is returned (per element for arrays).
+
+        :param measurement: the measured value(s)
+        :type measurement: float or numpy.ndarray
+        :param dt: time since the previous update (s)
+        :type dt: float
+        :return: the new output
+        :rtype: float or numpy.ndarray
+        """
+        valid = np.isfinite(measurement)
+        error = self.setpoint - measurement
+        error = np.where(np.abs(error) <= self.margin, 0.0, error)
+        integral = self._integral + self.ki * error * dt
+        if self._last_measurement is None or dt <= 0:
+            derivative = 0.0
+        else:
+            derivative = -self.kd * (measurement - self._last_measurement) / dt
+            derivative = np.where(np.isfinite(derivative), derivative, 0.0)  # no previous valid measurement
+        output = self.kp * error + integral + derivative + self.feed_forward * self.setpoint
+        limited = self._limit(output)
+        if self.max_step is not None:
+            limited = np.clip(limited, self.output - self.max_step, self.output + self.max_step)
+        if self.anti_windup:
+            integral = integral - (output - limited)
+        self._integral = _result(np.where(valid, integral, self._integral))
+        if self._last_measurement is not None:
+            measurement = np.where(valid, measurement, self._last_measurement)
+        self._last_measurement = _result(np.asarray(measurement))
+        limited = np.where(valid, limited, self.output)
+        self.output = limited if np.ndim(limited) else float(limited)
+        return self.output
+
+
+class BangBang:
+    """
+    Controller that changes the output by a fixed increment when the measurement is outside a margin around the
+    setpoint (this is how the first battery tests were controlled).
+    """
+
+    def __init__(self, increment, margin=0.0, setpoint=0.0, output_limits=(None, None)):
+        """
+        :param increment: change of the output per update
+        :type increment: float
+        :param margin: the loop doesn't react when the measurement is within setpoint +/- margin (default 0.0)
+        :type margin: float
+        :param setpoint: initial setpoint
+        :type setpoint: float or numpy.ndarray
+        :param output_limits: (lower, upper) limit of the output, None for no limit (default (None, None))
+        :type output_limits: tuple
+        """
+        self.increment = increment
+        self.margin = margin
+        self.setpoint = setpoint
+        self.output_limits = output_limits
+        self.reset()
+
+    def reset(self, output=0.0):
+        """
+        Reset the controller.
+
+        :param output: present output value (default 0.0)
+        :type output: float or numpy.ndarray
+        """
+        self.output = output
+
+    def update(self, measurement, dt=None):
+        """
+        Calculate the new output.
+
+        :param measurement: the measured value(s)
+        :type measurement: float or numpy.ndarray
+        :param dt: ignored, for compatibility with PID
+        :return: the new output
+        :rtype: float or numpy.ndarray
+        """
+        step = np.where(measurement < self.setpoint - self.margin, self.increment, 0.0)
+        step = np.where(measurement > self.setpoint + self.margin, -self.increment, step)
+        lower, upper = self.output_limits
+        output = np.clip(self.output + step, -np.inf if lower is None else lower, np.inf if upper is None else upper)
+        self.output = output if np.ndim(output) else float(output)
+        return self.output
+
+
+def _result(value):
+    """Return a 0-dimensional array as a python scalar (like the controllers do)."""
+    return value.item() if np.ndim(value) == 0 else value
+
+
+class StepResponse:
+    """
+    Keeps track of overshoot and settling time of a measurement after a step to a new setpoint.
+
+    The measurement is considered settled once it stays within tolerance of the setpoint. The settling time is the time
+    from start() until the first sample of the last period within tolerance.
+    With arrays (one value per simulated cell) all results are arrays, with nan instead of None when not settled.
+    """
+
+    def __init__(self, setpoint, initial, tolerance):
+        """
+        :param setpoint: the new setpoint
+        :type setpoint: float or numpy.ndarray
+        :param initial: the measured value at the moment the setpoint was applied
+        :type initial: float or numpy.ndarray
+        :param tolerance: allowed deviation from the setpoint (absolute)
+        :type tolerance: float or numpy.ndarray
+        """
+        self.setpoint = setpoint
+        self.initial = initial
+        self.tolerance = tolerance
+        self.start()
+
+    def start(self, t=0.0):
+        """
+        (Re)start tracking.
+
+        :param t: time at which the setpoint was applied (s)
+        :type t: float
+        """
+        shape = np.broadcast(self.setpoint, self.initial, self.tolerance).shape
+        self.start_time = t
+        self.samples = 0
+        self.peak = np.broadcast_to(np.asarray(self.initial, dtype=float), shape).copy()  # value furthest from initial
+        # time and sample number of the first sample of the current period within tolerance (nan if not within):
+        self._settled_time = np.full(shape, np.nan)
+        self._settled_sample = np.full(shape, np.nan)
+
+    def update(self, t, measurement):
+        """
+        Add a sample.
+
+        :param t: time of the sample (s)
+        :type t: float
+        :param measurement: measured value
+        :type measurement: float or numpy.ndarray
+        """
+        self.samples += 1
+        further = np.abs(measurement - self.initial) > np.abs(self.peak - self.initial)
+        self.peak = np.where(further, measurement, self.peak)
+        within = np.abs(measurement - self.setpoint) <= self.tolerance
+        first = within & np.isnan(self._settled_time)
+        self._settled_time = np.where(within, np.where(first, t, self._settled_time), np.nan)
+        self._settled_sample = np.where(within, np.where(first, self.samples, self._settled_sample), np.nan)
+
+    @property
+    def settled(self):
+        return _result(~np.isnan(self._settled_time))
+
+    @property
+    def settling_time(self):
+        """Time from start until settled (s), None (or nan for arrays) if not settled."""
+        if np.ndim(self._settled_time) == 0 and np.isnan(self._settled_time):
+            return None
+        return _result(self._settled_time - self.start_time)
+
+    @property
+    def settling_samples(self):
+        """Number of samples (control periods) until settled, None (or nan for arrays) if not settled."""
+        if np.ndim(self._settled_sample) == 0:
+            return None if np.isnan(self._settled_sample) else int(self._settled_sample)
+        return self._settled_sample
+
+    @property
+    def overshoot(self):
+        """Overshoot beyond the setpoint as a percentage of the step size (0 if there was no overshoot)."""
+        step = np.asarray(self.setpoint - self.initial, dtype=float)
+        ratio = np.divide(self.peak - self.setpoint, step, out=np.zeros(np.shape(self.peak)), where=step != 0)
+        return _result(np.maximum(0.0, ratio) * 100)
+
+    def summary(self):
+        """
+        :return: dictionary with setpoint, settled, settling_time, settling_samples and overshoot (%)
+        :rtype: dict
+        """
+        return {'setpoint': self.setpoint, 'settled': self.settled, 'settling_time': self.settling_time,
+                'settling_samples': self.settling_samples, 'overshoot': self.overshoot}
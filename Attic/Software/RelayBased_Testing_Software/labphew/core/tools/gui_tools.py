@@ -30,6 +30,15 @@ def set_spinbox_stepsize(spinbox):
     spinbox.setSingleStep(10 ** p)
 
 
+def plot_width(plot_item, minimum=100):
+    """
+    Helper function that returns the width (in pixels) of the data area of a pyqtgraph PlotItem.
+    Used to size the display decimation of live plots (see labphew.core.tools.decimation).
+    The minimum is returned while the plot is not shown yet (and has no size).
+    """
+    return max(int(plot_item.getViewBox().width()), minimum)
+
+
 class SaverWidget(QWidget):
     """
     Simple widget for saving, consisting of a line edit to enter the filename and a save button.
@@ -0,0 +1,388 @@
+"""
+Instrumentation
+===============
+
+Measurements of the timing of acquisition and control, to size settings like time_step and plot_points on data in
+stead of guesses.
+
+An Instrumentation object collects three kinds of metrics, by name:
+- latencies: LatencyHistograms of durations in seconds (e.g. of every read_analog() call, or how late the monitor loop
+  ran compared to its time_step), with count, mean, percentiles and maximum
+- counters: numbers that only increase (e.g. deadline misses, read timeouts, samples lost)
+- gauges: current values, read when the stats are requested (e.g. the number of samples waiting in a queue)
+
+Every Operator has one (operator.instrumentation) and so do the DfwController and SimulatedDfwController
+(instrument.instrumentation). operator.stats() combines both:
+
+    stats = operator.stats()
+    stats['latency']['read_analog']['p99'], stats['counters']['monitor_deadline_misses']
+
+The stats can be logged (operator.log_stats(), or periodically with stats_interval in the monitor section of the config
+of the Analog Discovery 2 Operator) and served as Prometheus text (prometheus_text()) by a StatsServer, so that a local
+scraper (or a browser) can read them from http://localhost:<port>/metrics (see also labphew run --stats-port):
+
+    server = StatsServer(operator.prometheus_text, port=9100)
+    server.start()
+
+Recording a latency takes about a microsecond, so it can be done in the acquisition loop.
+
+"""
+import math
+import time
+import bisect
+import logging
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the buckets of a LatencyHistogram (s), from 10 us to 10 s
+DEFAULT_BOUNDS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0,
+                  2.5, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations with fixed buckets (like a Prometheus histogram), so memory use and the cost of adding a
+    value don't depend on the number of values. Percentiles are interpolated within a bucket, which makes them accurate
+    to about the width of a bucket.
+    Not thread safe by itself, Instrumentation serializes the access.
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        """
+        :param bounds: increasing upper bounds of the buckets (s), a last bucket for larger values is added
+        :type bounds: tuple of float
+        """
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """
+        Add a duration.
+
+        :param seconds: the duration (s)
+        :type seconds: float
+        """
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """
+        Estimate a percentile.
+
+        :param q: percentile (0-100)
+        :type q: float
+        :return: estimated duration (s), or None if empty
+        :rtype: float or None
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                # the smallest and largest values narrow the first and last bucket that contain values
+                low = max(self.bounds[i - 1] if i else 0.0, self.min)
+                high = min(self.bounds[i] if i < len(self.bounds) else math.inf, self.max)
+                fraction = (rank - cumulative) / n
+                # the buckets are spaced logarithmically, so interpolate logarithmically
+                return low * (high / low) ** fraction if low > 0 else high * fraction
+            cumulative += n
+        return self.max
+
+    def summary(self):
+        """
+        :return: count, sum, mean, min, p50, p90, p99 and max (s), and the cumulative counts per upper bound (buckets)
+        :rtype: dict
+        """
+        cumulative, buckets = 0, []
+        for bound, n in zip(self.bounds + (math.inf,), self.counts):
+            cumulative += n
+            buckets.append((bound, cumulative))
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else None,
+                'min': self.min if self.count else None, 'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'max': self.max if self.count else None, 'buckets': buckets}
+
+
+class Instrumentation:
+    """
+    Thread safe collection of latency histograms, counters and gauges.
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        """
+        :param bounds: upper bounds of the buckets of the latency histograms (s) (default DEFAULT_BOUNDS)
+        :type bounds: tuple of float
+        """
+        self.bounds = bounds
+        self._latencies = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        """
+        Add a duration to a latency histogram (created if it doesn't exist yet).
+
+        :param name: name of the histogram
+        :type name: str
+        :param seconds: the duration (s)
+        :type seconds: float
+        """
+        with self._lock:
+            histogram = self._latencies.get(name)
+            if histogram is None:
+                histogram = self._latencies[name] = LatencyHistogram(self.bounds)
+            histogram.observe(seconds)
+
+    def timer(self, name):
+        """
+        Context manager that adds the duration of the with block to a latency histogram:
+
+            with instrumentation.timer('save_scan'):
+                ...
+
+        :param name: name of the histogram
+        :type name: str
+        """
+        return _Timer(self, name)
+
+    def count(self, name, n=1):
+        """
+        Increase a counter (created at 0 if it doesn't exist yet).
+
+        :param name: name of the counter
+        :type name: str
+        :param n: amount to add (default 1)
+        :type n: int
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        """
+        Set a gauge to a value, or to a function that returns its current value when the stats are requested.
+
+        :param name: name of the gauge
+        :type name: str
+        :param value: the value, or a function without arguments
+        :type value: float or callable
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+    def reset(self):
+        """Clear the histograms and counters (gauges are kept)."""
+        with self._lock:
+            self._latencies.clear()
+            self._counters.clear()
+
+    def stats(self):
+        """
+        :return: summary of every latency histogram (see LatencyHistogram.summary), counters and current gauge values
+        :rtype: dict
+        """
+        with self._lock:
+            latencies = {name: histogram.summary() for name, histogram in self._latencies.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        for name, value in gauges.items():
+            if callable(value):
+                try:
+                    gauges[name] = value()
+                except Exception as error:
+                    logger.debug(f'gauge {name} failed: {error}')
+                    gauges[name] = None
+        return {'latency': latencies, 'counters': counters, 'gauges': gauges}
+
+
+class _Timer:
+    """Context manager of Instrumentation.timer()."""
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.instrumentation.observe(self.name, time.perf_counter() - self.start)
+
+
+def timed(name):
+    """
+    Decorator for methods of an object with an instrumentation attribute: adds the duration of every call to the
+    latency histogram name.
+
+    :param name: name of the histogram
+    :type name: str
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.instrumentation.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def merge_stats(*stats):
+    """
+    Combine the stats of several Instrumentation objects (e.g. of an Operator and its instrument) into one.
+
+    :param stats: results of Instrumentation.stats()
+    :type stats: dict
+    :return: combined stats (later ones win if names are equal)
+    :rtype: dict
+    """
+    merged = {'latency': {}, 'counters': {}, 'gauges': {}}
+    for part in stats:
+        for section in merged:
+            merged[section].update(part.get(section, {}))
+    return merged
+
+
+def format_stats(stats):
+    """
+    Compact one line summary of stats, for logging.
+
+    :param stats: result of Instrumentation.stats() (or merge_stats())
+    :type stats: dict
+    :return: e.g. "read_analog n=100 p50=8.1ms p99=9.9ms max=12.0ms; monitor_deadline_misses=2; recorder_queue=0"
+    :rtype: str
+    """
+    parts = []
+    for name, summary in sorted(stats['latency'].items()):
+        if summary['count']:
+            parts.append('{} n={} p50={:.3g}ms p99={:.3g}ms max={:.3g}ms'.format(
+                name, summary['count'], summary['p50'] * 1000, summary['p99'] * 1000, summary['max'] * 1000))
+    parts += [f'{name}={value}' for name, value in sorted(stats['counters'].items())]
+    parts += [f'{name}={value}' for name, value in sorted(stats['gauges'].items())]
+    return '; '.join(parts)
+
+
+def _labels(labels, **extra):
+    items = dict(labels or {}, **extra)
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in items.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(items, escaped)) + '}'
+
+
+def _bound(bound):
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+
+def prometheus_text(sources, prefix='labphew'):
+    """
+    Format stats in the Prometheus text exposition format: latencies as histograms (<prefix>_<name>_seconds),
+    counters as <prefix>_<name>_total and gauges as <prefix>_<name>.
+
+    :param sources: stats (result of Instrumentation.stats()), or a list of (labels, stats) pairs to combine the
+                    stats of e.g. several cells, with labels a dict like {'cell': 'cell_1'}
+    :type sources: dict or list of tuple
+    :param prefix: prefix of the metric names (default 'labphew')
+    :type prefix: str
+    :return: the text
+    :rtype: str
+    """
+    if isinstance(sources, dict):
+        sources = [({}, sources)]
+    families = {}  # all samples of a metric have to be grouped under one TYPE line
+    for labels, stats in sources:
+        for name, summary in stats['latency'].items():
+            family = families.setdefault(f'{prefix}_{name}_seconds', ('histogram', []))[1]
+            for bound, cumulative in summary['buckets']:
+                family.append(('_bucket', _labels(labels, le=_bound(bound)), cumulative))
+            family.append(('_sum', _labels(labels), summary['sum']))
+            family.append(('_count', _labels(labels), summary['count']))
+        for name, value in stats['counters'].items():
+            families.setdefault(f'{prefix}_{name}_total', ('counter', []))[1].append(('', _labels(labels), value))
+        for name, value in stats['gauges'].items():
+            if isinstance(value, (bool, int, float)):
+                families.setdefault(f'{prefix}_{name}', ('gauge', []))[1].append(('', _labels(labels), value))
+    lines = []
+    for name, (kind, samples) in families.items():
+        lines.append(f'# TYPE {name} {kind}')
+        lines += [f'{name}{suffix}{labels} {float(value):g}' for suffix, labels, value in samples]
+    return '\n'.join(lines) + '\n'
+
+
+class StatsServer:
+    """
+    Minimal http server (in a daemon thread) that serves Prometheus text on every path (e.g. /metrics).
+    """
+
+    def __init__(self, text_function, port=9100, host='127.0.0.1'):
+        """
+        :param text_function: function that returns the text to serve, e.g. operator.prometheus_text
+        :type text_function: callable
+        :param port: tcp port, 0 picks a free port (see the port attribute after start()) (default 9100)
+        :type port: int
+        :param host: address to listen on, the default only accepts local connections (default '127.0.0.1')
+        :type host: str
+        """
+        self.text_function = text_function
+        self.port = port
+        self.host = host
+        self._server = None
+
+    def start(self):
+        """
+        Start serving.
+
+        :return: True if the server started
+        :rtype: bool
+        """
+        text_function = self.text_function
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    body = text_function().encode()
+                except Exception as error:
+                    self.send_error(500, str(error))
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # don't print every request
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as error:
+            logger.error(f'Could not serve stats on {self.host}:{self.port}: {error}')
+            return False
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='StatsServer', daemon=True).start()
+        logger.info(f'Serving stats on http://{self.host}:{self.port}/metrics')
+        return True
+
+    def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,208 @@
+"""
+Recorder
+========
+
+Streams samples to an HDF5 file while they are being acquired, so that a crash during a (long) test doesn't lose the
+data and the samples don't have to be kept in memory.
+
+The acquisition thread only puts the samples in a queue (which is cheap). A writer thread collects them and appends
+them in chunks to an extendable dataset, and flushes the file at a fixed interval. The file is opened in SWMR
+(single writer multiple reader) mode, so it can be read while it is being written:
+
+    import h5py
+    with h5py.File(filename, 'r', libver='latest', swmr=True) as f:
+        data = f['data'][:]  # call f['data'].refresh() to see newly flushed samples
+
+Note that this requires the optional dependency h5py, which is only imported when a recorder is started.
+
+"""
+import contextlib
+import logging
+import queue
+import threading
+import time
+import numpy as np
+
+
+class StreamRecorder:
+    """
+    Background recorder that appends samples (rows with one value per column) to the dataset 'data' in an HDF5 file.
+
+    Example:
+        >>> recorder = StreamRecorder('test.h5', ('time', 'ai1', 'ai2'), attrs={'user': 'me'})
+        >>> recorder.start()
+        >>> recorder.append(0.0, 1.2, 1.3)  # typically called from an acquisition loop
+        >>> recorder.stop()
+    """
+
+    def __init__(self, filename, columns, chunk_size=1024, flush_interval=5.0, max_queue=100000, attrs=None):
+        """
+        :param filename: path of the HDF5 file (an existing file will be overwritten)
+        :type filename: str
+        :param columns: names of the columns
+        :type columns: list of str
+        :param chunk_size: number of rows written to the file at once (and the HDF5 chunk size) (default 1024)
+        :type chunk_size: int
+        :param flush_interval: maximum time between writes to disk (s) (default 5.0)
+        :type flush_interval: float
+        :param max_queue: maximum number of queued samples (or blocks), more are dropped (default 100000)
+        :type max_queue: int
+        :param attrs: optional attributes to store in the file (keys should be strings, values numbers or strings)
+        :type attrs: dict or None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.filename = filename
+        self.columns = tuple(columns)
+        self.chunk_size = int(chunk_size)
+        self.flush_interval = flush_interval
+        self.attrs = attrs or {}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self.start_time = None  # time the recording started, as stored in the file
+        self.written = 0  # number of rows written to the file
+        self.dropped = 0  # number of samples (or blocks) dropped because the queue was full
+        self.failed = 0  # number of samples that could not be written (see the log for the errors)
+
+    @property
+    def queue_depth(self):
+        """Number of samples (or blocks) waiting to be written."""
+        return self._queue.qsize()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Create the file and start the writer thread.
+
+        :return: True if the recorder was started
+        :rtype: bool
+        """
+        if self.running:
+            self.logger.warning('Recorder is already running')
+            return False
+        try:
+            import h5py
+        except ImportError:
+            self.logger.error('Recording requires h5py (pip install h5py)')
+            return False
+        self._file = h5py.File(self.filename, 'w', libver='latest')
+        self._dataset = self._file.create_dataset('data', shape=(0, len(self.columns)), dtype=float,
+                                                  maxshape=(None, len(self.columns)),
+                                                  chunks=(self.chunk_size, len(self.columns)))
+        self._dataset.attrs['columns'] = ','.join(self.columns)
+        self.start_time = time.strftime('%d-%m-%YT%H:%M:%S')
+        self._file.attrs['start_time'] = self.start_time
+        for key, value in self.attrs.items():
+            self._file.attrs[key] = value
+        self._file.swmr_mode = True  # from here on the file can be read while it is being written
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._writer, name='StreamRecorder', daemon=True)
+        self._thread.start()
+        self.logger.info(f'Recording to {self.filename}')
+        return True
+
+    def append(self, *values):
+        """
+        Queue one sample (one value per column) for writing. Doesn't block.
+
+        :param values: one value per column (None is written as NaN, e.g. for a read timeout)
+        :type values: float or None
+        """
+        try:
+            self._queue.put_nowait(values)
+        except queue.Full:
+            self.dropped += 1
+
+    def extend(self, block):
+        """
+        Queue multiple samples for writing. Doesn't block.
+
+        :param block: samples with shape (columns, n)
+        :type block: numpy.ndarray
+        """
+        try:
+            self._queue.put_nowait(np.array(block, dtype=float).T)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout=10):
+        """
+        Write the remaining samples, close the file and stop the writer thread.
+
+        :param timeout: maximum time to wait for the writer to finish (s) (default 10)
+        :type timeout: float
+        """
+        if not self.running:
+            return
+        self._queue.put(None)  # sentinel
+        self._thread.join(timeout)
+        if self.dropped:
+            self.logger.warning(f'Recorder dropped {self.dropped} samples (or blocks), the disk could not keep up')
+        if self.failed:
+            self.logger.error(f'Recorder could not write {self.failed} samples to {self.filename}')
+        self.logger.info(f'Recording stopped: {self.written} samples written to {self.filename}')
+
+    def _write(self, rows):
+        """
+        Append rows (list of samples or 2D arrays) to the dataset. Errors are logged and the samples that could not be
+        written are counted in failed, they don't stop the writer, so later samples are still written.
+
+        :param rows: samples or 2D arrays with one value per column (None is written as NaN)
+        :type rows: list
+        """
+        blocks = []
+        for row in rows:
+            try:
+                block = np.atleast_2d(np.asarray(row, dtype=float))
+            except (TypeError, ValueError):
+                block = None
+            if block is None or block.ndim != 2 or block.shape[1] != len(self.columns):
+                self.failed += len(row) if isinstance(row, np.ndarray) else 1
+                self.logger.error(f'Could not write a sample to {self.filename}: {row!r}')
+                continue
+            blocks.append(block)
+        if not blocks:
+            return
+        block = np.vstack(blocks)  # converted before the dataset is resized
+        n = self.written + block.shape[0]
+        try:
+            self._dataset.resize((n, len(self.columns)))
+            self._dataset[self.written:n] = block
+            self._dataset.flush()
+        except Exception:
+            self.failed += block.shape[0]
+            self.logger.exception(f'Error while writing {block.shape[0]} samples to {self.filename}')
+            with contextlib.suppress(Exception):
+                self._dataset.resize((self.written, len(self.columns)))  # don't leave empty rows in the file
+            return
+        self.written = n
+
+    def _writer(self):
+        """Writer thread: collects samples from the queue and writes them in chunks (or after flush_interval)."""
+        rows = []
+        pending = 0
+        last_write = time.monotonic()
+        try:
+            while True:
+                timeout = max(0.0, last_write + self.flush_interval - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if len(item):
+                    rows.append(item)
+                    pending += len(item) if isinstance(item, np.ndarray) else 1
+                if pending >= self.chunk_size or time.monotonic() - last_write >= self.flush_interval:
+                    self._write(rows)
+                    rows = []
+                    pending = 0
+                    last_write = time.monotonic()
+            self._write(rows)
+        finally:
+            self._file.close()
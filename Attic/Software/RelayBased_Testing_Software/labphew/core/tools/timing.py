@@ -0,0 +1,198 @@
+"""
+Timing
+======
+
+Tools to run loops (like the monitor loop of an Operator) at a fixed rate.
+
+Pacer replaces the "while time() < next_time: pass" busy-wait. It sleeps for most of the time and only spins for the
+last few milliseconds before a deadline, so a running monitor no longer occupies a full cpu core.
+
+VirtualClock is a clock that can run faster than real time. A simulated instrument can provide one (as its clock
+attribute), in which case Pacers and Operators use it so that a simulated test of hours takes only seconds.
+
+"""
+import math
+import threading
+import time
+
+
+class Pacer:
+    """
+    Waits for consecutive deadlines that are spaced by period seconds.
+
+    The deadlines are absolute (each one is the previous deadline plus period, not "now" plus period), so the timing
+    doesn't drift when the work done between two deadlines takes a varying amount of time. If a deadline was already
+    missed, it counts the miss and skips ahead to the next deadline in the future (in stead of firing a burst of
+    iterations to catch up).
+
+    Waiting is done by sleeping on a threading.Event until spin_time before the deadline and then spinning. Calling
+    interrupt() (or setting the stop_event) wakes the waiting thread immediately. In addition should_stop is checked
+    at least every poll_interval seconds, which allows stopping through a plain flag.
+    Note that on Windows the sleep resolution is typically 1 to 16ms; increase spin_time if accuracy matters more than
+    cpu usage.
+
+    Example:
+        >>> pacer = Pacer(0.1)
+        >>> pacer.start()
+        >>> while pacer.wait():
+        ...     do_something()  # runs every 0.1s until pacer.interrupt() is called
+    """
+
+    def __init__(self, period, spin_time=0.001, stop_event=None, should_stop=None, poll_interval=0.02, clock=None,
+                 instrumentation=None, name='pacer'):
+        """
+        :param period: time between deadlines (s), may be changed while running
+        :type period: float
+        :param spin_time: time before a deadline to stop sleeping and start spinning (s) (default 0.001)
+        :type spin_time: float
+        :param stop_event: event that stops the pacer when set (default None creates a new event)
+        :type stop_event: threading.Event or None
+        :param should_stop: optional function that returns True when the pacer should stop
+        :type should_stop: callable or None
+        :param poll_interval: maximum sleep time between checks of should_stop (s) (default 0.02)
+        :type poll_interval: float
+        :param clock: optional VirtualClock, period is then in virtual seconds (spin_time and poll_interval remain real)
+        :type clock: VirtualClock or None
+        :param instrumentation: optional Instrumentation that receives the lateness of every deadline (as latency
+                                <name>_lateness, in seconds of the clock) and the missed deadlines (as counter
+                                <name>_deadline_misses)
+        :type instrumentation: Instrumentation or None
+        :param name: prefix of the metrics in instrumentation (default 'pacer')
+        :type name: str
+        """
+        self.clock = clock
+        self.instrumentation = instrumentation
+        self.name = name
+        self._now = time.perf_counter if clock is None else clock.time
+        self.period = period
+        self.spin_time = spin_time
+        self.stop_event = threading.Event() if stop_event is None else stop_event
+        self.should_stop = should_stop
+        self.poll_interval = poll_interval
+        self.start()
+
+    def start(self):
+        """(Re)start the pacer: the first deadline will be one period from now. Also resets the statistics."""
+        self.start_time = self._now()
+        self._deadline = self.start_time
+        self.ticks = 0  # number of deadlines waited for
+        self.missed = 0  # number of deadlines that had already passed
+        self._lateness_sum = 0.0
+        self._lateness_sq_sum = 0.0
+        self._lateness_max = 0.0
+
+    def stopped(self):
+        """Returns True if the pacer was interrupted or should_stop returns True."""
+        return self.stop_event.is_set() or (self.should_stop is not None and self.should_stop())
+
+    def interrupt(self):
+        """Stop the pacer, waking up a waiting thread immediately."""
+        self.stop_event.set()
+
+    def wait(self):
+        """
+        Wait until the next deadline.
+
+        :return: False if the pacer was stopped (possibly before the deadline), True otherwise
+        :rtype: bool
+        """
+        self._deadline += self.period
+        speed = 1.0 if self.clock is None else self.clock.speed
+        now = self._now()
+        if now > self._deadline:
+            # Deadline missed: skip to the first deadline in the future
+            missed = math.ceil((now - self._deadline) / self.period) if self.period > 0 else 0
+            self.missed += max(missed, 1)
+            if self.instrumentation is not None:
+                self.instrumentation.count(self.name + '_deadline_misses', max(missed, 1))
+            self._deadline += missed * self.period
+        while True:
+            if self.stopped():
+                return False
+            remaining = (self._deadline - self._now()) / speed - self.spin_time  # in real seconds
+            if remaining <= 0:
+                break
+            if self.stop_event.wait(min(remaining, self.poll_interval)):
+                return False
+        while self._now() < self._deadline:
+            pass
+        lateness = self._now() - self._deadline
+        self.ticks += 1
+        self._lateness_sum += lateness
+        self._lateness_sq_sum += lateness * lateness
+        self._lateness_max = max(self._lateness_max, lateness)
+        if self.instrumentation is not None:
+            self.instrumentation.observe(self.name + '_lateness', lateness)
+        return not self.stopped()
+
+    def stats(self):
+        """
+        Timing statistics since start(). Jitter is the time between a deadline and the moment wait() returned.
+
+        :return: dictionary with ticks, missed, mean_jitter, std_jitter, max_jitter (all times in seconds)
+        :rtype: dict
+        """
+        n = self.ticks
+        mean = self._lateness_sum / n if n else 0.0
+        variance = max(self._lateness_sq_sum / n - mean * mean, 0.0) if n else 0.0
+        return {'ticks': n, 'missed': self.missed, 'mean_jitter': mean, 'std_jitter': math.sqrt(variance),
+                'max_jitter': self._lateness_max}
+
+
+class VirtualClock:
+    """
+    Clock that runs speed times faster than real time (for simulations).
+    time() starts at 0 when the clock is created. Besides running, the clock can also jump ahead with advance().
+
+    Example:
+        >>> clock = VirtualClock(speed=100)
+        >>> clock.sleep(60)  # takes 0.6s of real time
+        >>> clock.time()  # approximately 60
+    """
+
+    def __init__(self, speed=1.0):
+        """
+        :param speed: how many times faster than real time the clock runs (default 1.0)
+        :type speed: float
+        """
+        self._speed = float(speed)
+        self._real_start = time.perf_counter()
+        self._virtual_start = 0.0
+
+    @property
+    def speed(self):
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        """Change the speed without a jump in time."""
+        now = self.time()
+        self._real_start = time.perf_counter()
+        self._virtual_start = now
+        self._speed = float(speed)
+
+    def time(self):
+        """
+        :return: the virtual time (s)
+        :rtype: float
+        """
+        return self._virtual_start + (time.perf_counter() - self._real_start) * self._speed
+
+    def sleep(self, seconds):
+        """
+        Sleep for a duration in virtual time.
+
+        :param seconds: virtual time to sleep (s)
+        :type seconds: float
+        """
+        if seconds > 0:
+            time.sleep(seconds / self._speed)
+
+    def advance(self, seconds):
+        """
+        Let the clock jump ahead.
+
+        :param seconds: virtual time to add (s)
+        :type seconds: float
+        """
+        self._virtual_start += seconds
@@ -0,0 +1,312 @@
+"""
+Writers
+=======
+
+Storage backends for scan data (an xarray Dataset), used by save_scan() of the Operators.
+
+The backend is selected by the extension of the filename (see get_writer):
+- .nc or .h5: NetCDFWriter, a netCDF4/HDF5 file (requires the netCDF4 package)
+- .zarr: ZarrWriter, a Zarr directory store (requires the zarr package)
+
+Both backends chunk the data and compress it with zlib or blosc (compression: 'zlib', 'blosc_lz4', 'blosc_zstd', ... or
+None). With append=True a scan is added as a new record to an existing file instead of overwriting it. In a file with
+records, every variable of the scan has the dimensions (run, point) and the attributes of the scan (time, user, scan
+settings, metadata) are variables along run, so scans with different settings can be stored together. Scans appended to
+a file can't have more points than the first scan in it, shorter scans are padded with NaN.
+
+An archive of many files can be opened at once:
+
+    import xarray as xr
+    data = xr.open_mfdataset('archive/*.nc', combine='nested', concat_dim='run')
+
+Other backends can be added with register_writer(extension, writer_class), where the writer class implements
+create() and append() (see ScanWriter).
+
+"""
+import os
+import logging
+import importlib.util
+import numpy as np
+import xarray as xr
+
+logger = logging.getLogger(__name__)
+
+RUN = 'run'  # name of the record dimension
+POINT = 'point'  # name of the dimension of the points of a scan in a file with records
+
+
+def to_record(dataset):
+    """
+    Convert the Dataset of one (1-dimensional) scan to a single record along the run dimension.
+    All variables get the dimensions (run, point), the attributes become variables along run. Integers and booleans
+    (of variables and attributes) are stored as floats, so that missing values can be NaN.
+
+    :param dataset: Dataset of one scan
+    :type dataset: xarray.Dataset
+    :return: Dataset with one record
+    :rtype: xarray.Dataset
+    """
+    if len(dataset.sizes) != 1:
+        raise ValueError('Only scans with one dimension can be stored as records')
+    dim = next(iter(dataset.sizes))
+    variables = {}
+    for name, variable in dataset.variables.items():
+        values = np.asarray(variable.values)[np.newaxis]
+        if values.dtype.kind in 'biu':
+            values = values.astype(float)  # so that shorter scans can be padded with NaN
+        variables[name] = ((RUN, POINT), values, variable.attrs)
+    for key, value in dataset.attrs.items():
+        if isinstance(value, (bool, int, float, np.number)):
+            variables[key] = ((RUN,), np.array([value], dtype=float))
+        elif isinstance(value, str):
+            variables[key] = ((RUN,), np.array([value], dtype=object))
+        else:
+            logger.warning(f"attribute '{key}' is not a number or string and is not stored")
+    record = xr.Dataset(variables)
+    record.attrs['scan_dimension'] = dim  # name of the original dimension of the scan
+    return record
+
+
+class ScanWriter:
+    """
+    Base class of the storage backends. A backend implements create() and append().
+    """
+
+    def __init__(self, compression='zlib', complevel=4, chunk_points=4096, chunk_runs=256):
+        """
+        :param compression: 'zlib', 'blosc_lz4', 'blosc_lz4hc', 'blosc_zlib', 'blosc_zstd' or None (default 'zlib')
+        :type compression: str or None
+        :param complevel: compression level, 1 (fast) - 9 (small) (default 4)
+        :type complevel: int
+        :param chunk_points: maximum number of points per chunk (default 4096)
+        :type chunk_points: int
+        :param chunk_runs: number of records per chunk, for variables along run only (default 256)
+        :type chunk_runs: int
+        """
+        if compression is not None and compression != 'zlib' and not str(compression).startswith('blosc_'):
+            raise ValueError(f'Unknown compression: {compression}')
+        self.compression = compression
+        self.complevel = int(complevel)
+        self.chunk_points = int(chunk_points)
+        self.chunk_runs = int(chunk_runs)
+
+    def write(self, dataset, filename, append=False):
+        """
+        Write a scan to a new file, or append it as a record to an existing file.
+
+        :param dataset: Dataset of one scan
+        :type dataset: xarray.Dataset
+        :param filename: path of the file (or directory store)
+        :type filename: str
+        :param append: add the scan as record (creates a file with records if it doesn't exist yet) (default False)
+        :type append: bool
+        :return: index of the record along run, None if the scan was not appended
+        :rtype: int or None
+        """
+        if not append:
+            dataset = dataset.copy()
+            # netCDF doesn't support boolean attributes
+            dataset.attrs = {key: int(value) if isinstance(value, (bool, np.bool_)) else value
+                             for key, value in dataset.attrs.items()}
+            self.create(dataset, filename)
+            return None
+        if os.path.exists(filename):
+            return self.append(to_record(dataset), filename)
+        self.create(to_record(dataset), filename, records=True)
+        return 0
+
+    def chunks(self, variable):
+        """
+        Chunk shape of a variable: one record and at most chunk_points points per chunk.
+
+        :param variable: variable to store
+        :type variable: xarray.Variable
+        :return: chunk shape
+        :rtype: tuple of int
+        """
+        if variable.dims == (RUN,):
+            return (self.chunk_runs,)
+        return tuple(1 if dim == RUN else max(1, min(size, self.chunk_points))
+                     for dim, size in zip(variable.dims, variable.shape))
+
+    def create(self, dataset, filename, records=False):
+        """
+        Write a Dataset to a new file, overwriting an existing file.
+
+        :param dataset: Dataset to write
+        :type dataset: xarray.Dataset
+        :param filename: path of the file
+        :type filename: str
+        :param records: the Dataset has a run dimension (that will be appended to)
+        :type records: bool
+        """
+        raise NotImplementedError
+
+    def append(self, record, filename):
+        """
+        Append a record (see to_record) to an existing file with records.
+
+        :param record: Dataset with one record
+        :type record: xarray.Dataset
+        :param filename: path of the file
+        :type filename: str
+        :return: index of the record along run
+        :rtype: int
+        """
+        raise NotImplementedError
+
+
+class NetCDFWriter(ScanWriter):
+    """
+    netCDF4 (HDF5) files, with run as unlimited dimension so that records can be appended in place.
+    """
+
+    def encoding(self, dataset):
+        """Chunking and compression of the numeric variables."""
+        encoding = {}
+        for name, variable in dataset.variables.items():
+            if variable.dtype.kind not in 'biuf' or not variable.dims:
+                continue
+            encoding[name] = {'chunksizes': self.chunks(variable)}
+            if self.compression == 'zlib':
+                encoding[name].update(zlib=True, complevel=self.complevel, shuffle=True)
+            elif self.compression is not None:
+                encoding[name].update(compression=self.compression, complevel=self.complevel)
+        return encoding
+
+    def create(self, dataset, filename, records=False):
+        if importlib.util.find_spec('netCDF4') is None:
+            if records:
+                raise ImportError('Appending scans to a netCDF file requires the netCDF4 package')
+            logger.warning('netCDF4 is not installed, saving without compression')
+            dataset.to_netcdf(filename)
+            return
+        dataset.to_netcdf(filename, engine='netcdf4', encoding=self.encoding(dataset),
+                          unlimited_dims=[RUN] if records else None)
+
+    def append(self, record, filename):
+        import netCDF4
+        with netCDF4.Dataset(filename, 'a') as nc:
+            if RUN not in nc.dimensions or POINT not in nc.dimensions:
+                raise ValueError(f'{filename} does not contain records, use a new file to append scans')
+            run = len(nc.dimensions[RUN])
+            points = record.sizes[POINT]
+            if points > len(nc.dimensions[POINT]):
+                raise ValueError(f'The scan has more points ({points}) than the scans in {filename} '
+                                 f'({len(nc.dimensions[POINT])})')
+            for name, variable in record.variables.items():
+                if name not in nc.variables:
+                    logger.warning(f"{filename} has no variable '{name}', it is not stored")
+                elif variable.dims == (RUN,):
+                    nc.variables[name][run] = variable.values[0]
+                else:
+                    nc.variables[name][run, :points] = variable.values[0]  # the remaining points stay NaN
+        return run
+
+
+class ZarrWriter(ScanWriter):
+    """
+    Zarr directory stores, records are appended along run (one chunk per record).
+    """
+
+    def codec(self):
+        """Compressor for the installed version of zarr."""
+        import zarr
+        blosc_name = self.compression[len('blosc_'):] if str(self.compression).startswith('blosc_') else None
+        if int(zarr.__version__.split('.')[0]) >= 3:
+            from zarr.codecs import BloscCodec, GzipCodec
+            if blosc_name:
+                return BloscCodec(cname=blosc_name, clevel=self.complevel, shuffle='shuffle')
+            return GzipCodec(level=self.complevel)
+        import numcodecs
+        if blosc_name:
+            return numcodecs.Blosc(cname=blosc_name, clevel=self.complevel, shuffle=numcodecs.Blosc.SHUFFLE)
+        return numcodecs.Zlib(level=self.complevel)
+
+    def encoding(self, dataset):
+        """Chunking and compression of the numeric variables."""
+        import zarr
+        key = 'compressors' if int(zarr.__version__.split('.')[0]) >= 3 else 'compressor'
+        encoding = {}
+        for name, variable in dataset.variables.items():
+            if variable.dtype.kind not in 'biuf' or not variable.dims:
+                continue
+            encoding[name] = {'chunks': self.chunks(variable)}
+            if self.compression is None:
+                encoding[name][key] = None
+            else:
+                encoding[name][key] = (self.codec(),) if key == 'compressors' else self.codec()
+        return encoding
+
+    def create(self, dataset, filename, records=False):
+        dataset.to_zarr(filename, mode='w', encoding=self.encoding(dataset))
+
+    def append(self, record, filename):
+        with xr.open_zarr(filename) as existing:
+            if RUN not in existing.sizes or POINT not in existing.sizes:
+                raise ValueError(f'{filename} does not contain records, use a new store to append scans')
+            points = existing.sizes[POINT]
+            run = existing.sizes[RUN]
+            stored = {name: (variable.dims, variable.dtype) for name, variable in existing.variables.items()}
+        if record.sizes[POINT] > points:
+            raise ValueError(f'The scan has more points ({record.sizes[POINT]}) than the scans in {filename} '
+                             f'({points})')
+        record = record.pad({POINT: (0, points - record.sizes[POINT])})  # pads with NaN
+        # Every variable along run has to be appended to keep the same length
+        for name in set(record.variables) - set(stored):
+            logger.warning(f"{filename} has no variable '{name}', it is not stored")
+            record = record.drop_vars(name)
+        for name, (dims, dtype) in stored.items():
+            if name not in record.variables and RUN in dims:
+                shape = tuple(1 if dim == RUN else points for dim in dims)
+                fill = np.nan if dtype.kind in 'fc' else ''
+                record[name] = (dims, np.full(shape, fill, dtype=float if dtype.kind in 'fc' else object))
+        record.attrs = {}
+        record.to_zarr(filename, append_dim=RUN)
+        return run
+
+
+WRITERS = {'.nc': NetCDFWriter, '.h5': NetCDFWriter, '.zarr': ZarrWriter}
+
+
+def register_writer(extension, writer_class):
+    """
+    Add (or replace) the backend for files with a certain extension.
+
+    :param extension: file extension, including the dot (e.g. '.zarr')
+    :type extension: str
+    :param writer_class: subclass of ScanWriter
+    :type writer_class: type
+    """
+    WRITERS[extension.lower()] = writer_class
+
+
+def get_writer(filename, **options):
+    """
+    Create the backend for a filename (netCDF for unknown extensions).
+
+    :param filename: path of the file
+    :type filename: str
+    :param options: options of the writer (compression, complevel, chunk_points, chunk_runs)
+    :return: writer
+    :rtype: ScanWriter
+    """
+    extension = os.path.splitext(filename.rstrip('/\\'))[1].lower()
+    return WRITERS.get(extension, NetCDFWriter)(**options)
+
+
+def save_dataset(dataset, filename, append=False, **options):
+    """
+    Save (or append) a scan with the backend that belongs to the filename (see get_writer).
+
+    :param dataset: Dataset of one scan
+    :type dataset: xarray.Dataset
+    :param filename: path of the file
+    :type filename: str
+    :param append: add the scan as record to the file (default False)
+    :type append: bool
+    :param options: options of the writer (compression, complevel, chunk_points, chunk_runs)
+    :return: index of the record along run, None if the scan was not appended
+    :rtype: int or None
+    """
+    return get_writer(filename, **options).write(dataset, filename, append)
@@ -9,17 +9,26 @@ This Operator contains:
 - basic methods to get analog in values, set analog out values
 - a monitor, to provide continuous data for a Monitor gui
 - an example of a scan that could be run from command line or from a Scan gui
+- timing statistics of the monitor (see stats() of OperatorBase): the lateness of every point (monitor_lateness),
+  missed points (monitor_deadline_misses), the time spent per point (monitor_step), the number of points
+  (monitor_samples) and the samples waiting in (recorder_queue) or dropped by (recorder_dropped) the recorder. They are
+  logged every stats_interval seconds if that is set in the monitor section of the config.
 
 Example usage can be found at the bottom of the file under if __name__=='__main___'
 """
 import os.path
 import numpy as np
 import yaml
-from time import time, sleep, localtime, strftime
+from time import time, sleep, localtime, strftime, perf_counter
 import logging
 import xarray as xr
 from datetime import datetime
 from Battery_Testing_Software.labphew.core.base.operator_base import OperatorBase
+from Battery_Testing_Software.labphew.core.tools.buffers import RingBuffer
+from Battery_Testing_Software.labphew.core.tools.timing import Pacer
+from Battery_Testing_Software.labphew.core.tools.recorder import StreamRecorder
+from Battery_Testing_Software.labphew.core.tools.writers import save_dataset
+from Battery_Testing_Software.labphew.core.tools.catalog import dataset_summary
 import Battery_Testing_Software.labphew
 
 
@@ -53,9 +62,25 @@ class Operator(OperatorBase):
 
         self._monitor_start_time = 0
         self.monitor_plot_points = 100
+        # Buffer with columns time, analog in 1 and analog in 2 (recreated when the monitor starts):
+        self.monitor_buffer = RingBuffer(self.monitor_plot_points, columns=3)
+        self.recorder = None  # if set (see start_recorder), the monitor loop streams all samples to disk
+        self.instrumentation.gauge('recorder_queue', lambda: getattr(self.recorder, 'queue_depth', 0))
+        self.instrumentation.gauge('recorder_dropped', lambda: getattr(self.recorder, 'dropped', 0))
+        # A simulated instrument may provide a clock that runs faster than real time (None means real time):
+        self.clock = getattr(instrument, 'clock', None)
         # Create direct alias for this method of the instrument:
         self.analog_in = self.instrument.read_analog
 
+    def now(self):
+        """
+        Time of the instrument: the virtual time of a simulated instrument with a clock, otherwise the real time.
+
+        :return: time (s)
+        :rtype: float
+        """
+        return time() if self.clock is None else self.clock.time()
+
     def analog_out(self, channel, value=None, verify_only=False):
         """
         Set analog_out.
@@ -138,6 +163,21 @@ class Operator(OperatorBase):
         """
         self.instrument.write_digital(level, pin, enable, idle_set, output_set)
 
+    @property
+    def analog_monitor_time(self):
+        """Timestamps of the monitor data, oldest first (a view of monitor_buffer, not a copy)"""
+        return self.monitor_buffer.view(0)
+
+    @property
+    def analog_monitor_1(self):
+        """Analog in 1 monitor data, oldest first (a view of monitor_buffer, not a copy)"""
+        return self.monitor_buffer.view(1)
+
+    @property
+    def analog_monitor_2(self):
+        """Analog in 2 monitor data, oldest first (a view of monitor_buffer, not a copy)"""
+        return self.monitor_buffer.view(2)
+
     def _set_monitor_time_step(self, time_step):
         """
         Set Monitor time step.
@@ -239,46 +279,101 @@ class Operator(OperatorBase):
         Called by GUI Monitor to start the monitor loop.
         Not intended to be called from Operator. (Which should be blocked)
         """
-        # First check if monitor is allowed to start
-        if self._busy or not self._allow_monitor:
+        # First check if monitor is allowed to start (and set flag to indicate operator is busy)
+        if not self._allow_monitor or not self._claim_busy():
             self.logger.warning('Monitor should only be run from GUI and not while Operator is busy')
             return
         try:
             # Preparations before running the monitor
-            self.analog_monitor_1 = np.zeros(self.properties['monitor']['plot_points'])
-            self.analog_monitor_2 = np.zeros(self.properties['monitor']['plot_points'])
-            # self.analog_monitor_time = np.zeros(self.properties['monitor']['plot_points'])
-            self.analog_monitor_time = np.arange(1-self.properties['monitor']['plot_points'], 1)*self.properties['monitor']['time_step']
+            plot_points = self.properties['monitor']['plot_points']
+            self.monitor_buffer = RingBuffer(plot_points, columns=3)
+            self.monitor_buffer.fill(0, np.arange(1-plot_points, 1)*self.properties['monitor']['time_step'])
         except:
             self.logger.error("'plot_points' or 'time_step' missing or invalid in config")
+            self._busy = False
             return
-        self._busy = True  # set flag to indicate operator is busy
-        self._monitor_start_time = time()
-        next_time = 0
+        # The pacer shares the stop event of the operator, so setting _stop wakes it immediately
+        self._monitor_pacer = Pacer(self.properties['monitor']['time_step'], stop_event=self.stop_event,
+                                    clock=self.clock, instrumentation=self.instrumentation, name='monitor')
+        stats_interval = self.properties['monitor'].get('stats_interval')  # (s) log the stats this often
+        last_stats = perf_counter()
+        self._monitor_start_time = self.now()
         while not self._stop:
-            timestamp = time() - self._monitor_start_time
+            step_start = perf_counter()
+            timestamp = self.now() - self._monitor_start_time
             analog_in = self.instrument.read_analog()  # read the two analog in channels
-            # To keep the length constant, roll/shift the buffers and add the new datapoints
-            self.analog_monitor_1 = np.roll(self.analog_monitor_1, -1)
-            self.analog_monitor_2 = np.roll(self.analog_monitor_2, -1)
-            self.analog_monitor_time = np.roll(self.analog_monitor_time, -1)
-            self.analog_monitor_1[-1] = analog_in[0]
-            self.analog_monitor_2[-1] = analog_in[1]
-            self.analog_monitor_time[-1] = timestamp
+            # The ring buffer overwrites the oldest datapoint, which keeps the length constant without copying
+            self.monitor_buffer.append(timestamp, analog_in[0], analog_in[1])
+            if self.recorder is not None:
+                self.recorder.append(timestamp, analog_in[0], analog_in[1])  # only queues, writing is done in a thread
             self._new_monitor_data = True
-            # in stead of sleep, calculate when the next datapoint should be acquired and wait until that time arrives
-            # this allows to keep the timing correct
-            next_time += self.properties['monitor']['time_step']
-            while time()-self._monitor_start_time < next_time:
-                if self._stop: break  # check for stop flag while waiting to move to next point
+            self.instrumentation.count('monitor_samples')
+            self.instrumentation.observe('monitor_step', perf_counter() - step_start)
+            if stats_interval and perf_counter() - last_stats >= stats_interval:
+                last_stats = perf_counter()
+                self.log_stats()
+            # The pacer sleeps until the next datapoint should be acquired (at fixed intervals from the start, which
+            # keeps the timing correct) and returns early when stop is requested
+            self._monitor_pacer.period = self.properties['monitor']['time_step']
+            self._monitor_pacer.wait()
+        self.logger.debug('Monitor timing: {ticks} points, {missed} missed, jitter {mean_jitter:.2e}s '
+                          '(max {max_jitter:.2e}s)'.format(**self._monitor_pacer.stats()))
         self._stop = False  # reset stop flag to false
         self._busy = False  # indicate the operator is not busy anymore
 
+    def start_recorder(self, filename, metadata=None):
+        """
+        Stream all monitor samples (time, analog in 1 and analog in 2) to an HDF5 file while the monitor runs.
+        The samples are written in a separate thread and the file is flushed regularly, so the data up to (almost) the
+        last moment is preserved if the program crashes. The file can be read while it is being written, see
+        labphew.core.tools.recorder.
+
+        :param filename: full path and filename (.h5)
+        :type filename: str
+        :param metadata: optional additional data to store (default: None)
+        :type metadata: dict
+        :return: True if recording started
+        :rtype: bool
+        """
+        self.stop_recorder()
+        if os.path.exists(filename):
+            self.logger.warning('overwriting existing file: {}'.format(filename))
+        attrs = {key: self.properties[key] for key in ['user', 'config_file'] if key in self.properties}
+        if type(metadata) is dict:
+            attrs.update(metadata)
+        recorder = StreamRecorder(filename, ('time', 'analog_in_1', 'analog_in_2'), attrs=attrs)
+        if recorder.start():
+            self.recorder = recorder
+            return True
+        return False
+
+    def stop_recorder(self, summary=None):
+        """
+        Stop streaming monitor samples to disk (writes the remaining samples and closes the file).
+        If catalog is set in the properties, the recording is added to that run catalog (see
+        labphew.core.tools.catalog) with the attributes of the file and the optional summary.
+
+        :param summary: optional results of the test to store in the catalog, e.g. charge and energy (default: None)
+        :type summary: dict
+        """
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.stop()
+            self.instrumentation.count('recorder_samples_dropped', recorder.dropped)
+            self.instrumentation.count('recorder_samples_failed', recorder.failed)
+            attrs = dict(recorder.attrs, start_time=recorder.start_time, samples=recorder.written)
+            if type(summary) is dict:
+                attrs.update(summary)
+            self.add_to_catalog(recorder.filename, 'recording', attrs)
+
     def do_scan(self, param=None):
         """
         An example of a method that performs a scan (based on parameters in the config file).
         This method can be run from a GUI, from command line or other script
         This scan sweeps the voltage on one of the AO channels and reads one of the AI channels.
+        If 'fast' is True in the scan properties, the entire sweep is done by the device in one go (see
+        sweep_analog() of the controller), with each voltage applied for 'step_time' seconds and the first
+        'stabilize_time' seconds of each step ignored. A fast scan can't be paused and is not plotted while running.
 
         :param param: optional dictionary of parameters that will used to update the scan parameters
         :type param: dict
@@ -316,7 +411,7 @@ class Operator(OperatorBase):
         else:
             self.logger.info("stabilize_time not found in config, using 0s")
             stabilize = 0
-        num_points = np.int(round( (stop-start)/step+1 ))  # use round to catch the occasional rounding error
+        num_points = int(round( (stop-start)/step+1 ))  # use round to catch the occasional rounding error
         if num_points <= 0:
             self.logger.error("Start, stop and step result in 0 or fewer points to sweep")
             return
@@ -328,6 +423,11 @@ class Operator(OperatorBase):
 
         self._busy = True  # indicate that operator is busy
 
+        if self.properties['scan'].get('fast', False):
+            self._fast_scan(ch_ao, ch_ai, stabilize)
+            self._busy = False  # indicate operator is not busy anymore
+            return self.scan_voltages, self.measured_voltages
+
         for i, voltage in enumerate(self.voltages_to_scan):
             self.logger.debug('applying {} to ch {}'.format(voltage, ch_ao))
             self.analog_out(ch_ao, voltage)
@@ -338,10 +438,8 @@ class Operator(OperatorBase):
 
             # The remainder of the loop adds functionality to plot data and pause and stop the scan when it's run from a gui:
             self._new_scan_data = True
-            # before the end of the loop: halt if pause is True
-            while self._pause:
-                sleep(0.05)
-                if self._stop: break
+            # before the end of the loop: halt while pause is True (returns immediately on resume or stop)
+            self._wait_while_paused()
             # if (soft) stop was requested, break out of loop
             if self._stop:
                 break
@@ -352,11 +450,45 @@ class Operator(OperatorBase):
 
         return self.scan_voltages, self.measured_voltages
 
-    def save_scan(self, filename, metadata=None, store_conf=False):
+    def _fast_scan(self, ch_ao, ch_ai, stabilize):
         """
-        Store data in xarray Dataset and save to netCDF4 file.
+        Performs the sweep of do_scan() with hardware timing (called by do_scan() if 'fast' is True).
+
+        :param ch_ao: analog out channel (1 or 2)
+        :type ch_ao: int
+        :param ch_ai: analog in channel (1 or 2)
+        :type ch_ai: int
+        :param stabilize: time to ignore after each step (s)
+        :type stabilize: float
+        """
+        step_time = self.properties['scan'].get('step_time', 0.002)
+        samples_per_step = self.properties['scan'].get('samples_per_step', 20)
+        if stabilize >= step_time:
+            self.logger.warning('stabilize_time should be smaller than step_time')
+        # Apply the same limits as analog_out()
+        limits = self.properties['ao'][ch_ao]
+        voltages = np.clip(self.voltages_to_scan, limits['lower_limit'], limits['upper_limit'])
+        self.logger.debug('sweeping {} points on ch {}'.format(len(voltages), ch_ao))
+        t0 = time()
+        measured = self.instrument.sweep_analog(voltages, step_time, ch_ao - 1, samples_per_step, stabilize)
+        self._stop = False  # a fast scan can't be stopped, reset stop flag in case it was set (also if it failed)
+        if measured is None:
+            self.logger.error('Fast scan failed')
+            return
+        self.logger.debug('sweep took {:.3f}s'.format(time() - t0))
+        self.scan_voltages = list(voltages)
+        self.measured_voltages = list(measured[ch_ai - 1])
+        self._new_scan_data = True
+
+    def save_scan(self, filename, metadata=None, store_conf=False, append=None):
+        """
+        Store data in xarray Dataset and save to a compressed netCDF4 file (or Zarr store if filename ends with .zarr).
         Optional metadata can be passed as a dict. Note that the keys should be strings and the values should be numbers or strings.
         Optionally stores the entire Operator properties dictionary to a yaml file of the same name.
+        With append, the scan is added as a new record along the run dimension of the file instead of overwriting it.
+        Compression and chunking can be set in the storage section of the scan properties, see
+        labphew.core.tools.writers. If catalog is set in the properties, the scan (its attributes and summary
+        statistics) is added to that run catalog, see labphew.core.tools.catalog.
 
         To load data:
         import xarray as xr
@@ -368,12 +500,18 @@ class Operator(OperatorBase):
         :type metadata: dict
         :param store_conf: store Operator properties in yaml file (default: False)
         :type store_conf: bool
+        :param append: append the scan to the file, None uses append of the storage properties (default: None)
+        :type append: bool or None
         """
         # First test if the required data arrays have been generated (i.e. if the scan has run)
         if not hasattr(self, "scan_voltages") or not hasattr(self, "measured_voltages"):
             self.logger.warning('no data to save yet')
             return
-        if os.path.exists(filename):
+        storage = dict(self.properties['scan'].get('storage') or {})
+        if append is None:
+            append = storage.get('append', False)
+        storage.pop('append', None)
+        if os.path.exists(filename) and not append:
             self.logger.warning('overwriting existing file: {}'.format(filename))
         self.logger.debug('Saving data')
         data = xr.Dataset(
@@ -397,8 +535,13 @@ class Operator(OperatorBase):
         if type(metadata) is dict:
             data.attrs.update(metadata)  # add the optional metadata to the Dataset attributes
         self.data = data
-        data.to_netcdf(filename)
-        self.logger.info('Data saved in {}'.format(filename))
+        try:
+            record = save_dataset(data, filename, append, **storage)
+        except Exception as error:
+            self.logger.error('Saving data in {} failed: {}'.format(filename, error))
+            return
+        self.logger.info('Data {} {}'.format('appended to' if append else 'saved in', filename))
+        self.add_to_catalog(filename, 'scan', dict(data.attrs, **dataset_summary(data)), record)
 
         if store_conf:
             try:
@@ -416,6 +559,7 @@ class Operator(OperatorBase):
         """
         # This method is included because it is recommended (this method gets called when closing the gui), but the
         # WaveForms controller does not have a disconnect, hence this method does nothing.
+        self.stop_recorder()
         self.logger.info('Disconnecting from device(s)')
 
     def load_config(self, filename=None):
@@ -437,7 +581,8 @@ class Operator(OperatorBase):
 
 
 if __name__ == "__main__":
-    import labphew   # import this to use labphew style logging (by importing it before matplotlib it also prevents matplotlib from printing many debugs)
+    import labphew
+    labphew.configure_logging()  # use labphew style logging (by configuring it before matplotlib this also prevents matplotlib from printing many debugs)
     import matplotlib.pyplot as plt
 
     # from labphew.controller.digilent.waveforms import DfwController
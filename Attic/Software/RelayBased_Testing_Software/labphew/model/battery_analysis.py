@@ -0,0 +1,405 @@
+# coding=utf-8
+"""
+Battery Analysis
+================
+
+Analysis of recorded charge/discharge tests, for one file or for a whole campaign at once.
+
+Supported files:
+- .csv exported by the battery test gui (examples/101_project): time (s), cell voltage (V), current (mA)
+- .npy exported by the battery test gui, with a json sidecar (see labphew.core.tools.columnar): the same columns,
+  memory-mapped in stead of parsed
+- .nc netCDF files (e.g. written by save_scan), with variables or coordinates named time, voltage and current (other
+  names can be mapped with the columns argument, or --columns on the command line). In a file with records (scans
+  appended by save_scan, see labphew.core.tools.writers) every record is analysed separately, without its NaN padding
+- .h5 recordings of the monitor (see labphew.core.tools.recorder): the current is calculated from the voltages on both
+  sides of the shunt resistor
+
+All calculations are vectorized: capacity and energy are cumulative trapezoidal integrals, the electromotive force and
+internal resistance are a linear fit of the voltage versus the current (U = emf + I * R_int, see the docs on first
+testing and charging). The overpotential is the difference between the measured voltage and the emf.
+
+The exported files contain the magnitude of the current, so its direction is given by the direction argument: 'charge',
+'discharge' or 'signed' (positive current charges the cell). Efficiencies need both directions, so they are calculated
+for signed files, or for a charge and a discharge result with efficiency().
+
+Many files are analysed in parallel in a process pool with analyse_files(), e.g.:
+
+    results = analyse_files(glob.glob('campaign/**/*.csv', recursive=True), direction='charge')
+    save_summary(results, 'campaign_summary.csv')
+
+Or from the command line (see labphew analyse -h):
+
+    $ labphew analyse campaign/ --direction charge --output campaign_summary.csv
+    $ labphew analyse scans/ --columns voltage=cell_voltage current=cell_current
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import os
+import csv
+import logging
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from Battery_Testing_Software.labphew.core.tools.columnar import load_npy
+
+logger = logging.getLogger(__name__)
+
+FILE_TYPES = ('.csv', '.npy', '.nc', '.h5')
+SUMMARY_KEYS = ('file', 'record', 'samples', 'duration', 'charged', 'discharged', 'energy_in', 'energy_out',
+                'coulombic_efficiency', 'energy_efficiency', 'emf', 'internal_resistance', 'mean_overpotential',
+                'max_overpotential', 'mean_voltage', 'min_voltage', 'max_voltage', 'error')
+
+
+def load_csv(filename):
+    """
+    Load a csv file exported by the battery test gui (comment lines start with #).
+
+    :param filename: path of the file
+    :type filename: str
+    :return: time (s), voltage (V) and current (mA)
+    :rtype: dict of numpy.ndarray
+    """
+    data = np.loadtxt(filename, delimiter=',', comments='#', ndmin=2)
+    return {'time': data[:, 0], 'voltage': data[:, 1], 'current': data[:, 2]}
+
+
+def load_binary(filename, columns=None):
+    """
+    Load a .npy file with a json sidecar exported by the battery test gui (see labphew.core.tools.columnar). The columns
+    are memory-mapped, so only the parts that are used are read.
+
+    :param filename: path of the file
+    :type filename: str
+    :param columns: names of the columns for time, voltage and current (default None uses time, voltage and current)
+    :type columns: dict or None
+    :return: time (s), voltage (V) and current (mA), and the attributes of the file
+    :rtype: dict
+    """
+    names = dict({'time': 'time', 'voltage': 'voltage', 'current': 'current'}, **(columns or {}))
+    data = load_npy(filename)
+    result = {key: data[name] for key, name in names.items()}
+    result['attrs'] = data['attrs']
+    return result
+
+
+def load_netcdf(filename, columns=None):
+    """
+    Load a netCDF file (requires xarray and a netCDF backend).
+    In a file with records (see labphew.core.tools.writers) the arrays have one row per record, and the attributes of
+    every record (variables along the run dimension) are returned as record_attrs, see split_records().
+
+    :param filename: path of the file
+    :type filename: str
+    :param columns: names of the variables for time, voltage and current, e.g. {'voltage': 'measured_voltage'}
+                    (default None uses time, voltage and current)
+    :type columns: dict or None
+    :return: time (s), voltage (V) and current (mA), and the attributes of the file (and of the records)
+    :rtype: dict
+    """
+    import xarray as xr
+    from Battery_Testing_Software.labphew.core.tools.writers import RUN
+    names = dict({'time': 'time', 'voltage': 'voltage', 'current': 'current'}, **(columns or {}))
+    with xr.open_dataset(filename) as dataset:
+        missing = [name for name in names.values() if name not in dataset.variables]
+        if missing:
+            raise KeyError(f"no variable {', '.join(missing)} in the file (variables: {', '.join(dataset.variables)}), "
+                           f"map them with columns")
+        data = {key: np.asarray(dataset[name].values, dtype=float) for key, name in names.items()}
+        data['attrs'] = dict(dataset.attrs)
+        if RUN in dataset.dims:
+            data['record_attrs'] = {name: variable.values for name, variable in dataset.variables.items()
+                                    if variable.dims == (RUN,)}
+    return data
+
+
+def load_recording(filename, shunt_resistance=0.24):
+    """
+    Load an HDF5 recording of the monitor (time, analog in 1 and analog in 2, requires h5py).
+
+    :param filename: path of the file
+    :type filename: str
+    :param shunt_resistance: resistance of the shunt resistor (Ohm) (default 0.24)
+    :type shunt_resistance: float
+    :return: time (s), voltage (V) and current (mA), and the attributes of the file
+    :rtype: dict
+    """
+    import h5py
+    with h5py.File(filename, 'r') as f:
+        rows = f['data'][:]
+        attrs = dict(f.attrs)
+    current = np.maximum(rows[:, 2] - rows[:, 1], 0) / shunt_resistance * 1000
+    return {'time': rows[:, 0], 'voltage': rows[:, 1], 'current': current, 'attrs': attrs}
+
+
+def load_file(filename, columns=None, shunt_resistance=0.24):
+    """
+    Load a file of any of the supported types (based on its extension).
+
+    :param filename: path of the file
+    :type filename: str
+    :param columns: names of the variables in a netCDF or npy file (see load_netcdf) (default None)
+    :type columns: dict or None
+    :param shunt_resistance: resistance of the shunt resistor for HDF5 recordings (Ohm) (default 0.24)
+    :type shunt_resistance: float
+    :return: time (s), voltage (V) and current (mA), and the attributes of the file (if any)
+    :rtype: dict
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        return load_csv(filename)
+    if extension == '.npy':
+        return load_binary(filename, columns)
+    if extension == '.nc':
+        return load_netcdf(filename, columns)
+    if extension == '.h5':
+        return load_recording(filename, shunt_resistance)
+    raise ValueError(f'Unsupported file type: {filename}')
+
+
+def split_records(data):
+    """
+    Split loaded data into the tests it contains. Data of a file with records (2-dimensional arrays with one row per
+    record, see load_netcdf) gives one test per record, without the points that are NaN (the padding of records that
+    are shorter than the first one). Other data is one test.
+
+    :param data: time, voltage, current and attrs (and record_attrs), as returned by load_file()
+    :type data: dict
+    :return: record number (None without records) and data of every test
+    :rtype: list of tuple
+    """
+    if np.ndim(data['time']) < 2 and np.ndim(data['voltage']) < 2 and np.ndim(data['current']) < 2:
+        return [(None, data)]
+    time, voltage, current = np.broadcast_arrays(np.atleast_2d(data['time']), np.atleast_2d(data['voltage']),
+                                                 np.atleast_2d(data['current']))
+    valid = np.isfinite(time) & np.isfinite(voltage) & np.isfinite(current)
+    tests = []
+    for i in range(time.shape[0]):
+        attrs = dict(data.get('attrs', {}), **{key: values[i] for key, values in data.get('record_attrs', {}).items()})
+        tests.append((i, {'time': time[i, valid[i]], 'voltage': voltage[i, valid[i]], 'current': current[i, valid[i]],
+                          'attrs': attrs}))
+    return tests
+
+
+def fit_emf(voltage, current, min_current_range=1.0):
+    """
+    Electromotive force and internal resistance from a linear fit of the voltage versus the (signed) current.
+
+    :param voltage: terminal voltages (V)
+    :type voltage: numpy.ndarray
+    :param current: currents into the cell (mA)
+    :type current: numpy.ndarray
+    :param min_current_range: minimum range of the current for a fit (mA) (default 1.0)
+    :type min_current_range: float
+    :return: emf (V) and internal resistance (Ohm), or None and None if the current didn't vary enough
+    :rtype: float or None, float or None
+    """
+    if len(current) < 2 or np.ptp(current) < min_current_range:
+        return None, None
+    slope, intercept = np.polyfit(current, voltage, 1)
+    return float(intercept), float(slope * 1000)
+
+
+def analyse(time, voltage, current, direction='signed', emf=None):
+    """
+    Analyse one charge and/or discharge test.
+
+    :param time: times of the samples (s)
+    :type time: numpy.ndarray
+    :param voltage: cell voltages (V)
+    :type voltage: numpy.ndarray
+    :param current: currents (mA)
+    :type current: numpy.ndarray
+    :param direction: 'charge', 'discharge' or 'signed' (positive current charges the cell) (default 'signed')
+    :type direction: str
+    :param emf: electromotive force of the cell (V), if None it is fitted (default None)
+    :type emf: float or None
+    :return: scalar results (see SUMMARY_KEYS, capacities in mAh, energies in mWh) and the curves: capacity (mAh)
+             and energy (mWh) versus time, and overpotential (V)
+    :rtype: dict
+    """
+    from scipy.integrate import cumulative_trapezoid  # imported here, as importing scipy takes a while
+    if direction not in ('charge', 'discharge', 'signed'):
+        raise ValueError(f'Unknown direction: {direction}')
+    time = np.asarray(time, dtype=float)
+    voltage = np.asarray(voltage, dtype=float)
+    current = np.asarray(current, dtype=float)
+    if direction == 'charge':
+        current = np.abs(current)
+    elif direction == 'discharge':
+        current = -np.abs(current)
+
+    capacity = cumulative_trapezoid(current, time, initial=0) / 3600  # (mAh)
+    energy = cumulative_trapezoid(voltage * current, time, initial=0) / 3600  # (mWh)
+    # charge in and out separately (per sample interval)
+    step_charge = np.diff(capacity)
+    step_energy = np.diff(energy)
+    charged, discharged = np.clip(step_charge, 0, None).sum(), np.clip(-step_charge, 0, None).sum()
+    energy_in, energy_out = np.clip(step_energy, 0, None).sum(), np.clip(-step_energy, 0, None).sum()
+
+    internal_resistance = None
+    if emf is None:
+        emf, internal_resistance = fit_emf(voltage, current)
+    overpotential = voltage - emf if emf is not None else None
+
+    result = {
+        'samples': len(time),
+        'duration': float(time[-1] - time[0]) if len(time) else 0.0,
+        'charged': float(charged), 'discharged': float(discharged),
+        'energy_in': float(energy_in), 'energy_out': float(energy_out),
+        'coulombic_efficiency': float(discharged / charged) if charged and discharged else None,
+        'energy_efficiency': float(energy_out / energy_in) if energy_in and energy_out else None,
+        'emf': emf, 'internal_resistance': internal_resistance,
+        'mean_overpotential': float(np.mean(np.abs(overpotential))) if overpotential is not None else None,
+        'max_overpotential': float(np.max(np.abs(overpotential))) if overpotential is not None else None,
+        'mean_voltage': float(voltage.mean()) if len(voltage) else None,
+        'min_voltage': float(voltage.min()) if len(voltage) else None,
+        'max_voltage': float(voltage.max()) if len(voltage) else None,
+        'capacity_curve': capacity, 'energy_curve': energy, 'overpotential': overpotential,
+    }
+    return result
+
+
+def efficiency(charge_result, discharge_result):
+    """
+    Coulombic and energy efficiency of a charge followed by a discharge (e.g. two exported files).
+
+    :param charge_result: result of analyse() of the charge
+    :type charge_result: dict
+    :param discharge_result: result of analyse() of the discharge
+    :type discharge_result: dict
+    :return: coulombic efficiency and energy efficiency (None if nothing was charged)
+    :rtype: float or None, float or None
+    """
+    coulombic = discharge_result['discharged'] / charge_result['charged'] if charge_result['charged'] else None
+    energy = discharge_result['energy_out'] / charge_result['energy_in'] if charge_result['energy_in'] else None
+    return coulombic, energy
+
+
+def analyse_file(filename, direction=None, emf=None, columns=None, shunt_resistance=0.24, keep_curves=False):
+    """
+    Load and analyse one file, every record separately if it has records (see split_records). Errors are not raised but
+    returned in the result, so that one bad file doesn't stop the analysis of a campaign.
+
+    :param filename: path of the file
+    :type filename: str
+    :param direction: 'charge', 'discharge' or 'signed', None to use the mode stored in the file if available and
+                      'charge' otherwise (default None)
+    :type direction: str or None
+    :param emf: electromotive force of the cell (V), if None it is fitted (default None)
+    :type emf: float or None
+    :param columns: names of the variables in a netCDF or npy file (see load_netcdf) (default None)
+    :type columns: dict or None
+    :param shunt_resistance: resistance of the shunt resistor for HDF5 recordings (Ohm) (default 0.24)
+    :type shunt_resistance: float
+    :param keep_curves: include the capacity, energy and overpotential curves in the result (default False)
+    :type keep_curves: bool
+    :return: for every test in the file (one, or one per record): file, record (if the file has records) and the
+             results of analyse(), or file, record and error
+    :rtype: list of dict
+    """
+    try:
+        tests = split_records(load_file(filename, columns, shunt_resistance))
+    except Exception as error:
+        return [{'file': filename, 'error': f'{type(error).__name__}: {error}'}]
+    results = []
+    for record, data in tests:
+        result = {'file': filename} if record is None else {'file': filename, 'record': record}
+        try:
+            test_direction = direction
+            if test_direction is None:
+                mode = str(data.get('attrs', {}).get('mode', ''))
+                test_direction = 'discharge' if 'discharge' in mode else 'charge'
+            result.update(analyse(data['time'], data['voltage'], data['current'], test_direction, emf))
+        except Exception as error:
+            result['error'] = f'{type(error).__name__}: {error}'
+        if not keep_curves:
+            for key in ('capacity_curve', 'energy_curve', 'overpotential'):
+                result.pop(key, None)
+        results.append(result)
+    return results
+
+
+def find_files(paths, extensions=FILE_TYPES):
+    """
+    Expand directories (recursively) into the supported files they contain. Files are passed as they are.
+
+    :param paths: files and/or directories
+    :type paths: list of str
+    :param extensions: file extensions to look for in directories (default FILE_TYPES)
+    :type extensions: tuple of str
+    :return: sorted list of files
+    :rtype: list of str
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, names in os.walk(path):
+                files.extend(os.path.join(folder, name) for name in names
+                             if os.path.splitext(name)[1].lower() in extensions)
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def analyse_files(filenames, workers=None, chunksize=4, **options):
+    """
+    Analyse many files in parallel in a process pool (one file per task). Every record of a file with records gives a
+    result of its own.
+
+    :param filenames: paths of the files
+    :type filenames: list of str
+    :param workers: number of processes (default None uses the number of cpus, 1 analyses in this process)
+    :type workers: int or None
+    :param chunksize: number of files sent to a process at once (default 4)
+    :type chunksize: int
+    :param options: keyword arguments for analyse_file (direction, emf, columns, shunt_resistance, keep_curves)
+    :return: results of analyse_file for every file (in the same order)
+    :rtype: list of dict
+    """
+    task = functools.partial(analyse_file, **options)
+    if workers == 1 or len(filenames) < 2:
+        per_file = [task(filename) for filename in filenames]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            per_file = list(pool.map(task, filenames, chunksize=chunksize))
+    results = [result for file_results in per_file for result in file_results]
+    failed = [result for result in results if 'error' in result]
+    for result in failed:
+        record = f" (record {result['record']})" if 'record' in result else ''
+        logger.warning(f"{result['file']}{record}: {result['error']}")
+    logger.info(f'Analysed {len(results) - len(failed)} of {len(results)} tests in {len(filenames)} files')
+    return results
+
+
+def save_summary(results, filename):
+    """
+    Save the scalar results of analyse_files() to a csv file (one row per file, or per record).
+
+    :param results: results of analyse_files()
+    :type results: list of dict
+    :param filename: path of the csv file
+    :type filename: str
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, SUMMARY_KEYS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+    logger.info(f'Summary saved to {filename}')
+
+
+if __name__ == '__main__':
+    import Battery_Testing_Software.labphew
+    Battery_Testing_Software.labphew.configure_logging()  # use labphew style logging
+    import matplotlib.pyplot as plt
+
+    # Analyse the example export and plot the voltage versus capacity
+    filename = os.path.join(Battery_Testing_Software.labphew.repository_path, 'examples', '101_project',
+                            'current_test.csv')
+    result = analyse_file(filename, direction='charge', keep_curves=True)[0]
+    print({key: value for key, value in result.items() if key in SUMMARY_KEYS})
+    data = load_csv(filename)
+    plt.plot(result['capacity_curve'], data['voltage'])
+    plt.xlabel('Capacity (mAh)')
+    plt.ylabel('U (V)')
+    plt.show()
@@ -0,0 +1,485 @@
+# coding=utf-8
+"""
+Battery Control
+===============
+
+Headless control loop for battery tests with the Analog Discovery 2 Operator.
+
+The ControlLoop runs in its own thread, next to the monitor loop of the Operator (which does the acquisition). At a
+fixed rate it takes the freshest sample from the monitor buffer and adjusts the output of the power supply (pps) to
+reach the setpoint of the selected test:
+- 'cv_charge': constant voltage charge, the cell voltage (analog in 1) is regulated
+- 'cc_charge': constant current charge, the current through the shunt resistor is regulated
+- 'cr_discharge': constant resistance discharge, the relays of the load bank are set once at the start
+
+The regulation is done by a PID controller (default) or by the original fixed-increment 'bang_bang' controller, see
+labphew.core.tools.feedback. The settings can be given per mode in the control section of a test yml file, e.g.:
+
+control:
+  cc_charge:
+    algorithm:      pid     # pid or bang_bang
+    kp:             0.0002  # [V/mA]
+    ki:             0.002   # [V/(mA s)]
+    kd:             0       # [V s/mA]
+    feed_forward:   0       # [V/mA] added to the output: feed_forward * setpoint
+    anti_windup:    True
+    output_limits:  [0, 5]  # [V]
+    max_step:       null    # [V] pid: maximum change of the output per control period (null for no maximum)
+    increment:      0.1     # [V] bang_bang: change of the output per control period
+    margin:         0       # [mA] band around the setpoint in which the loop doesn't react (use ~5 for bang_bang)
+    tolerance:      5       # [mA] band around the setpoint used to determine the settling time
+
+The settling time and overshoot of each run are logged when the loop is stopped. The timing of the loop is recorded in
+the instrumentation of the Operator (see stats() of OperatorBase): the lateness of every control period
+(control_lateness), missed periods (control_deadline_misses), the time spent per step (control_step) and the periods
+without new valid data (control_stale).
+
+Every sample of the monitor (not only the freshest) is passed to a CoulombCounter (see coulomb_counter.py), which keeps
+running totals of the charge and energy of the test. In the 'cr_discharge' mode the current through the load bank
+(cell voltage / load resistance) counts as discharge, it doesn't pass through the shunt resistor.
+
+Controller settings can be tuned offline with evaluate_control(), which runs the same controllers on many simulated
+cells at once (see labphew.controller.digilent.battery_simulator), e.g. to sweep the gains with settings_grid():
+
+    grid = settings_grid(kp=[1e-4, 2e-4, 5e-4], ki=[1e-3, 2e-3, 5e-3])  # 9 combinations, one cell each
+    n = len(grid['kp'])
+    bench = BatchTestBench(CellBatch(n, r0=np.random.uniform(0.3, 1.0, n)))
+    results = evaluate_control('cc_charge', 80, bench, grid)
+
+Because this does not depend on a gui timer, the control rate is not affected by redrawing plots. A gui only reads the
+state (see state()) to display it.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import logging
+import threading
+import itertools
+from time import perf_counter
+import numpy as np
+from Battery_Testing_Software.labphew.core.tools.timing import Pacer
+from Battery_Testing_Software.labphew.core.tools.feedback import PID, BangBang, StepResponse
+from Battery_Testing_Software.labphew.model.coulomb_counter import CoulombCounter
+
+# Load resistances (Ohm) of the relay load bank and the digital pins that need to be high to obtain them:
+LOAD_RESISTANCES = {512.0: [],
+                    225.0: [8],
+                    131.0: [8, 9],
+                    65.9: [8, 9, 10],
+                    32.9: [8, 9, 10, 11],
+                    16.9: [8, 9, 10, 11, 12],
+                    8.9: [8, 9, 10, 11, 12, 13]}
+
+
+def mode_for_test(test):
+    """
+    Control mode and setpoint for the test section of a test yml file (see examples/101_project).
+
+    :param test: test section with test_mode, charge_mode, test_selection and the targets
+    :type test: dict
+    :return: mode ('cv_charge', 'cc_charge', 'cr_discharge' or None if not supported) and setpoint
+    :rtype: str or None, float
+    """
+    if test.get('test_mode', 0) == 0:  # Charge/Discharge (0) / Impedance (1)
+        if test.get('charge_mode', True):
+            if test.get('test_selection') == 0:  # CV (0) / CC (1) / CR (2)
+                return 'cv_charge', test['target_voltage']
+            if test.get('test_selection') == 1:
+                return 'cc_charge', test['target_current']
+        elif test.get('test_selection') == 2:
+            return 'cr_discharge', test['target_resistance']
+    return None, 0
+
+
+def test_attributes(test_config):
+    """
+    Attributes that describe a test, to store with its data (e.g. in the run catalog, see labphew.core.tools.catalog).
+
+    :param test_config: contents of a test yml file
+    :type test_config: dict
+    :return: the sections and fields of the test yml file, test_config_file (path of the test yml file), mode and
+             setpoint (see mode_for_test)
+    :rtype: dict
+    """
+    attrs = {key: value for key, value in test_config.items() if key != 'config_file'}
+    if 'config_file' in test_config:
+        attrs['test_config_file'] = test_config['config_file']
+    attrs['mode'], attrs['setpoint'] = mode_for_test(test_config.get('test', {}))
+    return attrs
+
+
+def create_controller(settings, setpoint):
+    """
+    Create the controller (PID or BangBang) from the settings of a mode (see ControlLoop.defaults).
+    Numeric settings may be arrays to create a controller for many simulated cells at once.
+
+    :param settings: settings of the mode
+    :type settings: dict
+    :param setpoint: target voltage (V) or current (mA)
+    :type setpoint: float or numpy.ndarray
+    :return: the controller
+    :rtype: PID or BangBang
+    """
+    s = settings
+    if s['algorithm'] == 'bang_bang':
+        return BangBang(s['increment'], s['margin'], setpoint, tuple(s['output_limits']))
+    return PID(s['kp'], s['ki'], s['kd'], setpoint, feed_forward=s['feed_forward'],
+               output_limits=tuple(s['output_limits']), anti_windup=s['anti_windup'], max_step=s['max_step'],
+               margin=s['margin'])
+
+
+def settings_grid(**values):
+    """
+    All combinations of the given setting values, as one array per setting (to be used with evaluate_control()).
+
+    Example:
+        >>> settings_grid(kp=[1, 2], ki=[0.1, 0.2, 0.3])  # 6 combinations
+        {'kp': array([1, 1, 1, 2, 2, 2]), 'ki': array([0.1, 0.2, 0.3, 0.1, 0.2, 0.3])}
+
+    :param values: list of values per setting
+    :return: array per setting, all of the same length
+    :rtype: dict
+    """
+    combinations = list(itertools.product(*values.values()))
+    return {key: np.array([c[i] for c in combinations]) for i, key in enumerate(values)}
+
+
+def evaluate_control(mode, setpoint, bench, settings=None, duration=60.0, period=0.05):
+    """
+    Run the controller of a mode on all cells of a simulated test bench at once, and return how well it performed.
+    Every cell can have its own settings (e.g. from settings_grid()), the other settings use ControlLoop.defaults.
+    Like ControlLoop, every period the cell is measured, the controller is updated and the power supply is set, and the
+    output starts at the measured cell voltage.
+
+    :param mode: 'cv_charge' or 'cc_charge'
+    :type mode: str
+    :param setpoint: target voltage (V) or current (mA)
+    :type setpoint: float or numpy.ndarray
+    :param bench: simulated test bench with the cells (it is advanced by duration)
+    :type bench: labphew.controller.digilent.battery_simulator.BatchTestBench
+    :param settings: settings of the mode, values may be arrays with one value per cell (default None)
+    :type settings: dict or None
+    :param duration: time to simulate (s) (default 60.0)
+    :type duration: float
+    :param period: time between control steps (s) (default 0.05)
+    :type period: float
+    :return: settings used and arrays (one value per cell) settled, settling_time (s, nan if not settled),
+             settling_samples, overshoot (%), mean_abs_error and final_error
+    :rtype: dict
+    """
+    if mode not in ControlLoop.defaults:
+        raise ValueError(f'No feedback control in mode {mode}')
+    settings = dict(ControlLoop.defaults[mode], **(settings or {}))
+    n = len(bench.cells)
+    per_cell = dict(((key, value) for key, value in settings.items() if key != 'output_limits'), setpoint=setpoint)
+    for key, value in per_cell.items():
+        if np.ndim(value) and np.size(value) not in (1, n):
+            raise ValueError(f'{key} has {np.size(value)} values, it should have one value or one per cell ({n})')
+    shunt_resistance = bench.shunt_resistance
+
+    def measure():
+        analog_1, analog_2 = bench.read_analog()
+        if mode == 'cv_charge':
+            return analog_1
+        return np.round(np.maximum(analog_2 - analog_1, 0) / shunt_resistance * 1000, 2)  # see ControlLoop.current
+
+    bench.pps_voltage = bench.read_analog()[0]  # start at measured cell voltage
+    controller = create_controller(settings, setpoint)
+    controller.reset(bench.pps_voltage)
+    measured = measure()
+    response = StepResponse(setpoint, measured, np.broadcast_to(settings['tolerance'], (n,)))
+    abs_error = np.zeros(n)
+    steps = int(round(duration / period))
+    for i in range(steps):
+        bench.pps_voltage = np.broadcast_to(controller.update(measured, period), (n,))
+        bench.step(period)
+        measured = measure()
+        response.update((i + 1) * period, measured)
+        abs_error += np.abs(measured - setpoint)
+    results = {'settings': settings}
+    results.update(response.summary())
+    results['mean_abs_error'] = abs_error / max(steps, 1)
+    results['final_error'] = measured - setpoint
+    return results
+
+
+class ControlLoop:
+    """
+    Control loop that regulates the pps output of an Analog Discovery 2 Operator based on its monitor data.
+    """
+    modes = ('cv_charge', 'cc_charge', 'cr_discharge')
+
+    # Default settings for the modes with feedback (see module docstring):
+    defaults = {'cv_charge': {'algorithm': 'pid', 'kp': 0.5, 'ki': 2.0, 'kd': 0.0, 'feed_forward': 0.0,
+                              'anti_windup': True, 'output_limits': [0, 5], 'max_step': None, 'increment': 0.01,
+                              'margin': 0, 'tolerance': 0.01},  # V
+                'cc_charge': {'algorithm': 'pid', 'kp': 0.0002, 'ki': 0.002, 'kd': 0.0, 'feed_forward': 0.0,
+                              'anti_windup': True, 'output_limits': [0, 5], 'max_step': None, 'increment': 0.1,
+                              'margin': 0, 'tolerance': 5}}  # mA
+
+    def __init__(self, operator, shunt_resistance=0.24, period=None):
+        """
+        :param operator: the Operator running the monitor loop (its monitor_buffer is used)
+        :type operator: analog_discovery_2_model.Operator
+        :param shunt_resistance: resistance of the shunt resistor used to measure the current (Ohm)
+        :type shunt_resistance: float
+        :param period: time between control steps in seconds (default None uses the monitor time_step)
+        :type period: float or None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.operator = operator
+        self.shunt_resistance = shunt_resistance
+        self.period = period
+        self.load_resistance = None  # resistance of the load bank set by set_load() (Ohm)
+
+        self.mode = None
+        self.setpoint = 0
+        self.settings = {}
+        self.controller = None  # PID or BangBang
+        self.response = None  # StepResponse of the present run
+
+        # State (only written by the control thread, may be read by a gui for display):
+        self.out_voltage = 0.0
+        self.measured_voltage = 0.0
+        self.measured_current = 0.0
+        self.steps = 0  # number of control steps applied
+        self.stale = 0  # number of times no new (valid) sample was available
+        self.counter = CoulombCounter()  # running totals of charge and energy, reset when the loop starts
+
+        self._thread = None
+        self._pacer = None
+        self._last_count = 0
+
+    def current(self, analog_1, analog_2):
+        """
+        Calculate the current (in mA) from the voltages on both sides of the shunt resistor.
+        Negative currents are reported as 0.
+
+        Also accepts arrays of voltages (e.g. all samples of a gui update), in which case an array is returned.
+
+        :param analog_1: voltage on analog in 1 (V)
+        :type analog_1: float or numpy.ndarray
+        :param analog_2: voltage on analog in 2 (V)
+        :type analog_2: float or numpy.ndarray
+        :return: current (mA)
+        :rtype: float or numpy.ndarray
+        """
+        if np.ndim(analog_1) or np.ndim(analog_2):
+            shunt_voltage = np.maximum(np.asarray(analog_2) - analog_1, 0)
+            return np.round(shunt_voltage / self.shunt_resistance * 1000, 2)
+        shunt_voltage = analog_2 - analog_1
+        shunt_voltage = shunt_voltage if shunt_voltage > 0 else 0
+        return round((shunt_voltage / self.shunt_resistance) * 1000, 2)
+
+    def configure(self, mode, setpoint, settings=None):
+        """
+        Select the type of test, its setpoint and the controller settings.
+
+        :param mode: 'cv_charge', 'cc_charge' or 'cr_discharge' (or None to do nothing)
+        :type mode: str or None
+        :param setpoint: target voltage (V), current (mA) or resistance (Ohm), depending on the mode
+        :type setpoint: float
+        :param settings: control section of a test yml file (settings per mode), missing values use the defaults
+        :type settings: dict or None
+        """
+        if mode is not None and mode not in self.modes:
+            self.logger.error(f'Unknown control mode: {mode}')
+            return
+        self.mode = mode
+        self.setpoint = setpoint
+        self.settings = dict(self.defaults.get(mode, {}))
+        self.settings.update(((settings or {}).get(mode) or {}))
+        if self.settings.get('algorithm', 'pid') not in ('pid', 'bang_bang'):
+            self.logger.error(f"Unknown control algorithm: {self.settings['algorithm']}, using pid")
+            self.settings['algorithm'] = 'pid'
+
+    def _create_controller(self):
+        """Create the controller (PID or BangBang) from the settings."""
+        return create_controller(self.settings, self.setpoint)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, out_voltage=None):
+        """
+        Start the control loop thread. The monitor loop of the operator should be running (or started right after).
+
+        :param out_voltage: initial pps output voltage (default None uses the measured cell voltage)
+        :type out_voltage: float or None
+        """
+        if self.running:
+            self.logger.warning('Control loop is already running')
+            return
+        if out_voltage is None:
+            out_voltage = self.operator.instrument.read_analog()[0]  # start at measured cell voltage
+        self.out_voltage = out_voltage
+        self.measured_voltage = self.measured_current = np.nan  # until the first valid sample
+        self.steps = 0
+        self.stale = 0
+        self.counter.reset()
+        self._last_count = self.operator.monitor_buffer.count
+        self._last_time = None
+        self.controller = self.response = None
+        if self.mode in self.defaults:
+            self.controller = self._create_controller()
+            self.controller.reset(out_voltage)
+        if self.mode == 'cr_discharge':
+            self.set_load(self.setpoint)
+        period = self.period or self.operator.properties['monitor']['time_step']
+        self._pacer = Pacer(period, clock=self.operator.clock, instrumentation=self.operator.instrumentation,
+                            name='control')
+        self._thread = threading.Thread(target=self._loop, name='ControlLoop', daemon=True)
+        self._thread.start()
+        self.logger.debug(f'Control loop started ({self.mode}, setpoint {self.setpoint})')
+
+    def stop(self, timeout=1):
+        """
+        Stop the control loop thread and wait for it to finish.
+
+        :param timeout: maximum time to wait (s)
+        :type timeout: float
+        """
+        if not self.running:
+            return
+        self._pacer.interrupt()
+        self._thread.join(timeout)
+        stats = self._pacer.stats()
+        self.logger.debug(f'Control loop stopped: {self.steps} steps, {self.stale} without new valid data, '
+                          f'{stats["missed"]} missed deadlines')
+        if self.response is not None:
+            r = self.response.summary()
+            if r['settled']:
+                self.logger.info(f"{self.mode} ({self.settings['algorithm']}): setpoint {r['setpoint']} reached in "
+                                 f"{r['settling_time']:.2f}s ({r['settling_samples']} control periods), "
+                                 f"overshoot {r['overshoot']:.1f}%")
+            else:
+                self.logger.info(f"{self.mode} ({self.settings['algorithm']}): setpoint {r['setpoint']} not reached "
+                                 f"(overshoot {r['overshoot']:.1f}%)")
+
+    def state(self):
+        """
+        Current state of the control loop (for display).
+
+        :return: dictionary with mode, setpoint, out_voltage, measured_voltage, measured_current, steps, stale,
+                 settled, charge (mAh), energy (mWh) and soc
+        :rtype: dict
+        """
+        return {'mode': self.mode, 'setpoint': self.setpoint, 'out_voltage': self.out_voltage,
+                'measured_voltage': self.measured_voltage, 'measured_current': self.measured_current,
+                'steps': self.steps, 'stale': self.stale,
+                'settled': self.response is not None and self.response.settled,
+                'charge': self.counter.charge, 'energy': self.counter.energy, 'soc': self.counter.soc}
+
+    def set_load(self, resistance):
+        """
+        Set the relays of the load bank. Only supports resistances in LOAD_RESISTANCES.
+
+        :param resistance: desired load resistance (Ohm)
+        :type resistance: float
+        """
+        if resistance not in LOAD_RESISTANCES:
+            self.logger.error(f'{resistance} Ohm is not available on the load bank')
+            return
+        for pin in LOAD_RESISTANCES[resistance]:  # Turn desired pins on
+            self.operator.write_digital(1, pin)
+        self.load_resistance = resistance
+
+    def _loop(self):
+        """The control loop, runs in its own thread until stop() is called."""
+        buffer = self.operator.monitor_buffer
+        instrumentation = self.operator.instrumentation
+        while self._pacer.wait():
+            step_start = perf_counter()
+            if self.operator.monitor_buffer is not buffer:  # the monitor recreates its buffer when it starts
+                buffer = self.operator.monitor_buffer
+                self._last_count = 0
+            count = buffer.count
+            if count == self._last_count:
+                self.stale += 1  # don't react to the same sample twice
+                instrumentation.count('control_stale')
+                continue
+            # copy all samples since the previous step (samples older than the buffer are lost for the counter)
+            new = np.array(buffer.view()[:, -min(count - self._last_count, buffer.capacity):])
+            self._last_count = count
+            timestamp, analog_1, analog_2 = new[:, -1]
+            valid = np.isfinite(analog_1) and np.isfinite(analog_2)  # a read timeout of the monitor is stored as NaN
+            if valid:
+                self.measured_voltage = analog_1
+                self.measured_current = self.current(analog_1, analog_2)
+            self.count_charge(*new)  # after the measured values, so that they are set when counter.samples is
+            if not valid:
+                self.stale += 1  # don't react to an invalid sample
+                instrumentation.count('control_stale')
+                continue
+            self.step(timestamp)
+            instrumentation.observe('control_step', perf_counter() - step_start)
+
+    def count_charge(self, timestamp, analog_1, analog_2):
+        """
+        Add samples to the coulomb counter.
+        In the 'cr_discharge' mode the current into the cell is the shunt current minus the current through the load
+        bank, which is calculated from the cell voltage and the load resistance.
+
+        :param timestamp: times of the samples (s)
+        :type timestamp: numpy.ndarray
+        :param analog_1: cell voltages (V)
+        :type analog_1: numpy.ndarray
+        :param analog_2: voltages on the other side of the shunt resistor (V)
+        :type analog_2: numpy.ndarray
+        """
+        current = self.current(analog_1, analog_2)
+        if self.mode == 'cr_discharge' and self.load_resistance:
+            current = current - np.asarray(analog_1) / self.load_resistance * 1000
+        self.counter.extend(timestamp, analog_1, current)
+
+    def step(self, timestamp):
+        """
+        Apply one control step, based on the last measured voltage and current.
+
+        :param timestamp: time of the measurement (s)
+        :type timestamp: float
+        """
+        if self.controller is None:
+            return
+        measured = self.measured_voltage if self.mode == 'cv_charge' else self.measured_current
+        if self.response is None:
+            self.response = StepResponse(self.setpoint, measured, self.settings['tolerance'])
+            self.response.start(timestamp)
+        dt = self.period or self.operator.properties['monitor']['time_step']
+        if self._last_time is not None and timestamp > self._last_time:
+            dt = timestamp - self._last_time  # use the actual time between the samples
+        self._last_time = timestamp
+        self.controller.setpoint = self.setpoint
+        self.out_voltage = self.controller.update(measured, dt)
+        self.response.update(timestamp, measured)
+        self.operator.enable_pps(True)
+        self.operator.pps_out(0, self.out_voltage)
+        self.steps += 1
+
+
+if __name__ == '__main__':
+    import Battery_Testing_Software.labphew
+    Battery_Testing_Software.labphew.configure_logging()  # use labphew style logging
+    from time import sleep
+    from Battery_Testing_Software.labphew.controller.digilent.waveforms import SimulatedDfwController
+    from Battery_Testing_Software.labphew.model.analog_discovery_2_model import Operator
+
+    instrument = SimulatedDfwController()
+    operator = Operator(instrument)
+    operator.load_config()
+    operator._set_monitor_time_step(0.05)  # seconds (the default config uses ms)
+
+    # The control loop works with the data from the monitor, so start the monitor loop in a thread
+    operator._allow_monitor = True
+    monitor = threading.Thread(target=operator._monitor_loop)
+    monitor.start()
+
+    control = ControlLoop(operator)
+    control.configure('cc_charge', 80)  # 80 mA
+    control.start()
+    sleep(2)
+    print(control.state())
+    control.stop()
+
+    operator._stop = True
+    monitor.join()
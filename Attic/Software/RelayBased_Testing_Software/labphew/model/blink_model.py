@@ -12,11 +12,15 @@ Example usage can be found at the bottom of the file under if __name__=='__main_
 """
 import os.path
 import yaml
-from time import time, sleep, localtime, strftime
+from time import time, localtime, strftime
 import datetime
 import logging
 import xarray as xr
 from labphew.core.base.operator_base import OperatorBase
+from labphew.core.tools.buffers import RingBuffer
+from labphew.core.tools.timing import Pacer
+from labphew.core.tools.writers import save_dataset
+from labphew.core.tools.catalog import dataset_summary
 import labphew
 
 
@@ -49,6 +53,7 @@ class BlinkOperator(OperatorBase):
         self._allow_monitor = False  # monitor should not be run from command line, a gui can set this to True
 
         self._monitor_data = ('',False)  # placeholder for monitor data
+        self.monitor_history = RingBuffer(100, columns=2)  # timestamps and states of the most recent monitor points
 
     def _monitor_loop(self):
         """
@@ -56,24 +61,26 @@ class BlinkOperator(OperatorBase):
         Not intended to be called from Operator. (Which should be blocked)
         """
         # First check if monitor is allowed to start
-        if self._busy or not self._allow_monitor:
+        if not self._allow_monitor or not self._claim_busy():  # (also sets flag to indicate operator is busy)
             self.logger.warning('Monitor should only be run from GUI and not while Operator is busy')
             return
-        self._busy = True  # set flag to indicate operator is busy
+        self.monitor_history = RingBuffer(self.properties['monitor'].get('history_points', 100), columns=2)
+        self._monitor_pacer = Pacer(self.properties['monitor']['time_step'], stop_event=self.stop_event,
+                                    instrumentation=self.instrumentation, name='monitor')
         self._monitor_start_time = time()
-        next_time = 0
         while not self._stop:
             timestamp = time() - self._monitor_start_time
             time_str = str(datetime.timedelta(seconds=timestamp))[:-3] + ' blink!'   # (strip the last 3 digits)
             status = self.instrument.get_status()
             self._monitor_data = (time_str, status)
+            self.monitor_history.append(timestamp, status)
             self._new_monitor_data = True  # signal to a gui that new data is ready to be retrieved
+            self.instrumentation.count('monitor_samples')
 
-            # Instead of sleep(), calculate when the next datapoint should be acquired and wait until that time arrives
-            # this allows to keep the timing correct in case of slow data acquisition
-            next_time += self.properties['monitor']['time_step']
-            while time()-self._monitor_start_time < next_time:
-                if self._stop: break  # check for stop flag while waiting to move to next point
+            # Instead of sleep(), the pacer waits until the next datapoint should be acquired (at fixed intervals from
+            # the start) this allows to keep the timing correct in case of slow data acquisition
+            self._monitor_pacer.period = self.properties['monitor']['time_step']
+            self._monitor_pacer.wait()
         # Mandatory code at the end of _monitor_loop():
         self._stop = False  # reset stop flag to false
         self._busy = False  # indicate the operator is not busy anymore
@@ -146,14 +153,12 @@ class BlinkOperator(OperatorBase):
             self.point_number.append(i)
             state = int(self.instrument.get_status())  # get the state and convert True/False to 1/0
             self.measured_state.append(state)
-            sleep(time_between_points)
+            self._interruptible_sleep(time_between_points)  # returns early if stop is requested
 
             # The remainder of the loop adds functionality to plot data and pause and stop the scan when it's run from a gui:
             self._new_scan_data = True
-            # before the end of the loop: halt if pause is True
-            while self._pause:
-                sleep(0.05)
-                if self._stop: break
+            # before the end of the loop: halt while pause is True (returns immediately on resume or stop)
+            self._wait_while_paused()
             # if (soft) stop was requested, break out of loop
             if self._stop:
                 break
@@ -164,11 +169,15 @@ class BlinkOperator(OperatorBase):
 
         return self.point_number, self.measured_state
 
-    def save_scan(self, filename, metadata=None, store_conf=False):
+    def save_scan(self, filename, metadata=None, store_conf=False, append=None):
         """
-        Store data in xarray Dataset and save to netCDF4 file.
+        Store data in xarray Dataset and save to a compressed netCDF4 file (or Zarr store if filename ends with .zarr).
         Optional metadata can be passed as a dict. Note that the keys should be strings and the values should be numbers or strings.
         Optionally stores the entire Operator properties dictionary to a yaml file of the same name.
+        With append, the scan is added as a new record along the run dimension of the file instead of overwriting it.
+        Compression and chunking can be set in the storage section of the scan properties, see
+        labphew.core.tools.writers. If catalog is set in the properties, the scan (its attributes and summary
+        statistics) is added to that run catalog, see labphew.core.tools.catalog.
 
         To load data:
         import xarray as xr
@@ -180,12 +189,18 @@ class BlinkOperator(OperatorBase):
         :type metadata: dict
         :param store_conf: store Operator properties in yaml file (default: False)
         :type store_conf: bool
+        :param append: append the scan to the file, None uses append of the storage properties (default: None)
+        :type append: bool or None
         """
         # First test if the required data arrays have been generated (i.e. if the scan has run)
         if not hasattr(self, "point_number") or not hasattr(self, "measured_state"):
             self.logger.warning('no data to save yet')
             return
-        if os.path.exists(filename):
+        storage = dict(self.properties['scan'].get('storage') or {})
+        if append is None:
+            append = storage.get('append', False)
+        storage.pop('append', None)
+        if os.path.exists(filename) and not append:
             self.logger.warning('overwriting existing file: {}'.format(filename))
         self.logger.debug('Saving data')
         data = xr.Dataset(
@@ -209,8 +224,13 @@ class BlinkOperator(OperatorBase):
         if type(metadata) is dict:
             data.attrs.update(metadata)  # add the optional metadata to the Dataset attributes
         self.data = data
-        data.to_netcdf(filename)
-        self.logger.info('Data saved in {}'.format(filename))
+        try:
+            record = save_dataset(data, filename, append, **storage)
+        except Exception as error:
+            self.logger.error('Saving data in {} failed: {}'.format(filename, error))
+            return
+        self.logger.info('Data {} {}'.format('appended to' if append else 'saved in', filename))
+        self.add_to_catalog(filename, 'scan', dict(data.attrs, **dataset_summary(data)), record)
 
         if store_conf:
             try:
@@ -255,7 +275,8 @@ class BlinkOperator(OperatorBase):
 
 
 if __name__ == "__main__":
-    import labphew   # import this to use labphew style logging (by importing it before matplotlib it also prevents matplotlib from printing many debugs)
+    import labphew
+    labphew.configure_logging()  # use labphew style logging (by configuring it before matplotlib this also prevents matplotlib from printing many debugs)
     import matplotlib.pyplot as plt
 
     from labphew.controller.blink_controller import BlinkController
@@ -0,0 +1,168 @@
+# coding=utf-8
+"""
+Coulomb Counter
+===============
+
+Running totals of the charge (mAh) and energy (mWh) that went into and out of a cell, and an estimate of its state of
+charge, updated with every sample during acquisition.
+
+The current is integrated with the trapezoidal rule, so adding a sample only costs a few operations and a long test
+never needs to be re-integrated from the start. Positive currents charge the cell, negative currents discharge it.
+
+The ControlLoop (see labphew.model.battery_control) keeps a CoulombCounter up to date with all samples of the monitor,
+e.g.:
+
+    control.counter.capacity = 100  # [mAh] optional, for the state of charge estimate
+    control.counter.initial_soc = 0.2
+    control.start()
+    ...
+    print(control.counter.totals())
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import numpy as np
+
+
+class CoulombCounter:
+    """
+    Incremental trapezoidal integration of current (mA) and power (mW) over time (s).
+    """
+
+    def __init__(self, capacity=None, initial_soc=None):
+        """
+        :param capacity: nominal capacity of the cell (mAh), needed for the state of charge (default None)
+        :type capacity: float or None
+        :param initial_soc: state of charge at the first sample, as a fraction (0-1) (default None)
+        :type initial_soc: float or None
+        """
+        self.capacity = capacity
+        self.initial_soc = initial_soc
+        self.reset()
+
+    def reset(self):
+        """
+        Set all totals to 0 (e.g. at the start of a test). Capacity and initial_soc are kept.
+        """
+        self.charged = 0.0  # charge into the cell (mAh)
+        self.discharged = 0.0  # charge out of the cell (mAh)
+        self.energy_in = 0.0  # (mWh)
+        self.energy_out = 0.0  # (mWh)
+        self.duration = 0.0  # integrated time (s)
+        self.samples = 0
+        self._last = None  # time, current and power of the previous sample
+
+    def update(self, timestamp, voltage, current):
+        """
+        Add one sample.
+        A sample with a timestamp that is not later than the previous one starts a new segment (nothing is integrated).
+        Segments from or to a sample with a NaN voltage or current are not integrated.
+
+        :param timestamp: time of the sample (s)
+        :type timestamp: float
+        :param voltage: cell voltage (V)
+        :type voltage: float
+        :param current: current into the cell (mA), negative when discharging
+        :type current: float
+        """
+        timestamp, current = float(timestamp), float(current)  # (plain floats keep the totals serializable)
+        power = float(voltage) * current
+        if self._last is not None and timestamp > self._last[0]:
+            dt = (timestamp - self._last[0]) / 3600  # (h)
+            charge = (current + self._last[1]) / 2 * dt
+            energy = (power + self._last[2]) / 2 * dt
+            if charge > 0:  # (a segment with a non-finite sample, e.g. of a read timeout, is skipped like in extend)
+                self.charged += charge
+            elif charge < 0:
+                self.discharged -= charge
+            if energy > 0:
+                self.energy_in += energy
+            elif energy < 0:
+                self.energy_out -= energy
+            self.duration += dt * 3600
+        self._last = (timestamp, current, power)
+        self.samples += 1
+
+    def extend(self, timestamp, voltage, current):
+        """
+        Add multiple samples (in chronological order), equivalent to calling update() for each of them.
+
+        :param timestamp: times of the samples (s)
+        :type timestamp: numpy.ndarray
+        :param voltage: cell voltages (V)
+        :type voltage: numpy.ndarray
+        :param current: currents into the cell (mA), negative when discharging
+        :type current: numpy.ndarray
+        """
+        timestamp = np.asarray(timestamp, dtype=float)
+        current = np.asarray(current, dtype=float)
+        power = np.asarray(voltage, dtype=float) * current
+        if not len(timestamp):
+            return
+        if self._last is not None:  # integrate from the previous sample
+            t = np.append(self._last[0], timestamp)
+            i = np.append(self._last[1], current)
+            p = np.append(self._last[2], power)
+        else:
+            t, i, p = timestamp, current, power
+        dt = np.diff(t) / 3600  # (h)
+        dt[dt < 0] = 0  # a jump back in time starts a new segment
+        charge = (i[1:] + i[:-1]) / 2 * dt
+        energy = (p[1:] + p[:-1]) / 2 * dt
+        self.charged += float(charge[charge > 0].sum())
+        self.discharged -= float(charge[charge < 0].sum())
+        self.energy_in += float(energy[energy > 0].sum())
+        self.energy_out -= float(energy[energy < 0].sum())
+        self.duration += float(dt.sum()) * 3600
+        self._last = (float(timestamp[-1]), float(current[-1]), float(power[-1]))
+        self.samples += len(timestamp)
+
+    @property
+    def charge(self):
+        """Net charge into the cell (mAh)."""
+        return self.charged - self.discharged
+
+    @property
+    def energy(self):
+        """Net energy into the cell (mWh)."""
+        return self.energy_in - self.energy_out
+
+    @property
+    def soc(self):
+        """Estimated state of charge (fraction), None if capacity or initial_soc is unknown."""
+        if not self.capacity or self.initial_soc is None:
+            return None
+        return self.initial_soc + self.charge / self.capacity
+
+    @property
+    def coulombic_efficiency(self):
+        """Charge out divided by charge in, None if nothing was charged."""
+        return self.discharged / self.charged if self.charged else None
+
+    @property
+    def energy_efficiency(self):
+        """Energy out divided by energy in, None if nothing was charged."""
+        return self.energy_out / self.energy_in if self.energy_in else None
+
+    def totals(self):
+        """
+        All running totals (for display, logging or to store with the data).
+
+        :return: charged, discharged and net charge (mAh), energy in, out and net (mWh), duration (s), samples, soc
+                 and efficiencies (None if unknown)
+        :rtype: dict
+        """
+        return {'charged': self.charged, 'discharged': self.discharged, 'charge': self.charge,
+                'energy_in': self.energy_in, 'energy_out': self.energy_out, 'energy': self.energy,
+                'duration': self.duration, 'samples': self.samples, 'soc': self.soc,
+                'coulombic_efficiency': self.coulombic_efficiency, 'energy_efficiency': self.energy_efficiency}
+
+
+if __name__ == '__main__':
+    # Charge a cell at 80 mA for an hour and discharge at 75 mA for an hour, sampled every 0.1 s
+    t = np.arange(0, 3600, 0.1)
+    counter = CoulombCounter(capacity=100, initial_soc=0.1)
+    counter.extend(t, np.full(len(t), 3.8), np.full(len(t), 80.0))
+    print(counter.totals())
+    for timestamp in t + 3600:
+        counter.update(timestamp, 3.5, -75.0)
+    print(counter.totals())
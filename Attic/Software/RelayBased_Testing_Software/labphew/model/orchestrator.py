@@ -0,0 +1,399 @@
+# coding=utf-8
+"""
+Orchestrator
+============
+
+Runs battery tests on several cells at once, each cell on its own Analog Discovery 2, without a gui.
+
+Every cell gets a CellTest: an Operator with its own monitor thread (acquisition) and ControlLoop thread (regulation),
+configured from a test yml file (see examples/101_project). The dwf library releases the GIL while it waits for a
+device, so the devices are read in parallel. The Orchestrator starts the tests, checks the stop conditions of all
+cells from one scheduler loop (max test time, voltage and current limits) and collects their status.
+
+A rack is described in a yml file, e.g.:
+
+cells:
+  - name:     cell_1
+    device:   0                           # device number (see labphew.controller.digilent.waveforms.print_device_list)
+    test:     current_test_example.yml    # relative to this file
+  - name:     cell_2
+    device:   simulated                   # SimulatedDfwController with a simulated battery cell
+    test:     voltage_test_example.yml
+recording_folder: data                    # optional, stream the samples of every cell to an HDF5 file in this folder
+status_interval:  10                      # optional, log the status of all cells every 10s
+simulation_speed: 1                       # optional, speed of the clock of simulated cells (relative to real time)
+catalog:          runs.sqlite             # optional, add the recordings to this run catalog (see core.tools.catalog)
+stats_port:       9100                    # optional, serve the timing stats of all cells (Prometheus text format)
+
+The timing statistics of every cell (latency of the reads, deadline misses of the monitor and control loops, recorder
+queue, see stats() of OperatorBase) are logged when its test finishes. With stats_port they are also served while the
+tests run, labelled by cell, at http://localhost:<stats_port>/metrics (see labphew.core.tools.instrumentation).
+
+    orchestrator = Orchestrator.from_file('rack.yml')
+    orchestrator.run()  # blocks until all tests are finished (or Ctrl+C)
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import os
+import logging
+import threading
+from time import strftime
+import yaml
+from Battery_Testing_Software.labphew.model.analog_discovery_2_model import Operator
+from Battery_Testing_Software.labphew.model.battery_control import ControlLoop, mode_for_test, test_attributes
+from Battery_Testing_Software.labphew.core.tools.timing import Pacer
+from Battery_Testing_Software.labphew.core.tools.instrumentation import StatsServer, prometheus_text
+
+
+class CellTest:
+    """
+    Test of one cell: acquisition (monitor loop of an Operator) and control (ControlLoop), each in a thread.
+    """
+
+    def __init__(self, name, instrument, test_config, operator_config=None):
+        """
+        :param name: name of the cell (used for logging and filenames)
+        :type name: str
+        :param instrument: the instrument connected to the cell
+        :type instrument: DfwController or SimulatedDfwController
+        :param test_config: contents of a test yml file (with test, hardware and optional control sections)
+        :type test_config: dict
+        :param operator_config: config file for the Operator (default None uses the default config)
+        :type operator_config: str or None
+        """
+        self.logger = logging.getLogger(__name__ + '.' + name)
+        self.name = name
+        self.test_config = test_config
+        self.operator = Operator(instrument, properties={})  # every operator needs its own properties
+        self.operator.load_config(operator_config)
+        test = test_config['test']
+        self.operator._set_monitor_time_step(test['time_step'])
+        self.operator._set_monitor_plot_points(test['plot_points'])
+        self.control = ControlLoop(self.operator, test_config.get('hardware', {}).get('shunt_resistance', 0.24))
+        self.control.counter.capacity = test.get('capacity')  # optional, for the state of charge estimate
+        self.control.counter.initial_soc = test.get('initial_soc')
+        self.mode, self.setpoint = mode_for_test(test)
+        self.state = 'idle'  # idle, running, finished or error
+        self.reason = ''  # why the test finished
+        self.completed = False  # whether it finished at its end condition (max test time, or min voltage of a discharge)
+        self.start_time = None
+        self.end_time = None
+        self.stop_time = None
+        self._monitor_thread = None
+
+    def start(self, recording_folder=None):
+        """
+        Start acquisition and control.
+
+        :param recording_folder: folder to stream the samples to (default None, no recording)
+        :type recording_folder: str or None
+        """
+        if self.state == 'running':
+            self.logger.warning(f'{self.name} is already running')
+            return
+        if self.mode is None:
+            self.logger.error(f'{self.name}: test type not supported without gui')
+            self.state, self.reason = 'error', 'test type not supported'
+            return
+        if recording_folder is not None:
+            os.makedirs(recording_folder, exist_ok=True)
+            filename = os.path.join(recording_folder, self.name + strftime('_%Y%m%d-%H%M%S') + '.h5')
+            self.operator.start_recorder(filename, {'cell': self.name, 'mode': self.mode, 'setpoint': self.setpoint})
+        self.operator._allow_monitor = True
+        self._monitor_thread = threading.Thread(target=self.operator._monitor_loop, name=self.name + '_monitor',
+                                                daemon=True)
+        self._monitor_thread.start()
+        self.start_time = self.operator.now()
+        self.end_time = self.start_time + float(self.test_config['test']['max_test_time']) * 60
+        self.control.configure(self.mode, self.setpoint, self.test_config.get('control'))
+        self.control.start()
+        self.stop_time = None
+        self.state, self.reason, self.completed = 'running', '', False
+        self.logger.info(f'{self.name}: started {self.mode} (setpoint {self.setpoint})')
+
+    def check(self):
+        """
+        Check the stop conditions of a running test and stop it if one is met.
+        Reaching max_test_time, or min_test_voltage in a discharge, completes the test, the other limits abort it.
+
+        :return: True if the test is (still) running
+        :rtype: bool
+        """
+        if self.state != 'running':
+            return False
+        test = self.test_config['test']
+        if not self._monitor_thread.is_alive():
+            self.stop('monitor stopped')
+        elif self.operator.now() >= self.end_time:
+            self.stop('max test time reached', completed=True)
+        elif self.control.counter.samples:  # the limits are only checked once measurements are available
+            voltage, current = self.control.measured_voltage, self.control.measured_current
+            if self.mode != 'cr_discharge' and voltage > test['max_test_voltage']:
+                self.stop(f'max voltage exceeded ({voltage:.3f} V)')
+            elif self.mode == 'cr_discharge' and voltage < test['min_test_voltage']:
+                self.stop(f'min voltage reached ({voltage:.3f} V)', completed=True)
+            elif current > test['max_current']:
+                self.stop(f'max current exceeded ({current:.1f} mA)')
+        return self.state == 'running'
+
+    def stop(self, reason='stopped', completed=False):
+        """
+        Stop control and acquisition, and switch off the power supply.
+
+        :param reason: why the test is stopped (for logging and status)
+        :type reason: str
+        :param completed: whether the test reached its end condition (default False, e.g. aborted)
+        :type completed: bool
+        """
+        if self.state != 'running':
+            return
+        self.control.stop()
+        self.operator.enable_pps(False)
+        self.operator._stop = True
+        self._monitor_thread.join(self.operator.properties['monitor']['stop_timeout'] / 1000)  # (ms) in the config
+        if self._monitor_thread.is_alive():
+            self.logger.error(f'{self.name}: monitor did not stop')
+        self.operator._allow_monitor = False
+        self.operator.stop_recorder(dict(test_attributes(self.test_config), reason=reason,
+                                         **self.control.counter.totals()))
+        self.stop_time = self.operator.now()
+        self.state, self.reason, self.completed = 'finished', reason, completed
+        self.logger.info(f'{self.name}: finished, {reason} ({self.control.counter.charge:.2f} mAh, '
+                         f'{self.control.counter.energy:.2f} mWh)')
+        self.operator.log_stats()
+
+    def status(self):
+        """
+        :return: name, state, reason, completed (see check), mode, setpoint, elapsed time (s), measured voltage (V) and
+                 current (mA), output voltage (V), number of control steps, net charge (mAh) and energy (mWh) and soc
+                 (or None)
+        :rtype: dict
+        """
+        elapsed = 0.0
+        if self.start_time is not None:
+            elapsed = (self.operator.now() if self.stop_time is None else self.stop_time) - self.start_time
+        return {'name': self.name, 'state': self.state, 'reason': self.reason, 'completed': self.completed,
+                'mode': self.mode, 'setpoint': self.setpoint, 'elapsed': float(elapsed),
+                'voltage': float(self.control.measured_voltage),
+                'current': float(self.control.measured_current), 'out_voltage': float(self.control.out_voltage),
+                'steps': self.control.steps, 'charge': self.control.counter.charge,
+                'energy': self.control.counter.energy, 'soc': self.control.counter.soc}
+
+
+class Orchestrator:
+    """
+    Runs the tests of several cells concurrently and checks them from one scheduler loop.
+    """
+
+    def __init__(self, poll_interval=0.5, status_interval=None, recording_folder=None, simulation_speed=1.0,
+                 catalog=None, stats_port=None):
+        """
+        :param poll_interval: time between checks of the stop conditions (s) (default 0.5)
+        :type poll_interval: float
+        :param status_interval: time between status logs (s) (default None, no status logs)
+        :type status_interval: float or None
+        :param recording_folder: folder to stream the samples of all cells to (default None, no recording)
+        :type recording_folder: str or None
+        :param simulation_speed: speed of the clock of simulated cells, relative to real time (default 1.0)
+        :type simulation_speed: float
+        :param catalog: run catalog to add the recordings to, overrides the catalog of the Operator configs (default
+                        None)
+        :type catalog: str or None
+        :param stats_port: tcp port to serve the timing stats of all cells on while run() runs (default None)
+        :type stats_port: int or None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.poll_interval = poll_interval
+        self.status_interval = status_interval
+        self.recording_folder = recording_folder
+        self.simulation_speed = simulation_speed
+        self.catalog = catalog
+        self.stats_port = stats_port
+        self.tests = []
+        self._pacer = None
+
+    def add(self, test):
+        """
+        Add a cell test.
+
+        :param test: the test
+        :type test: CellTest
+        """
+        if any(t.name == test.name for t in self.tests):
+            self.logger.error(f'A cell named {test.name} was already added')
+            return
+        self.tests.append(test)
+
+    def add_device(self, name, device, test_config, operator_config=None):
+        """
+        Connect to a device and add a test for the cell connected to it.
+
+        :param name: name of the cell
+        :type name: str
+        :param device: device number, or 'simulated' for a simulated cell
+        :type device: int or str
+        :param test_config: contents of a test yml file
+        :type test_config: dict
+        :param operator_config: config file for the Operator (default None uses the default config)
+        :type operator_config: str or None
+        """
+        if device == 'simulated':
+            from Battery_Testing_Software.labphew.controller.digilent.waveforms import SimulatedDfwController
+            from Battery_Testing_Software.labphew.controller.digilent.battery_simulator import BatteryTestBench
+            instrument = SimulatedDfwController(simulator=BatteryTestBench(speed=self.simulation_speed))
+        else:
+            from Battery_Testing_Software.labphew.controller.digilent.waveforms import DfwController
+            instrument = DfwController(device)
+        self.add(CellTest(name, instrument, test_config, operator_config))
+
+    def add_test_file(self, filename, name=None, device=0, operator_config=None):
+        """
+        Load a test yml file, connect to a device and add the test.
+
+        :param filename: path of the test file
+        :type filename: str
+        :param name: name of the cell (default None uses the name of the test file)
+        :type name: str or None
+        :param device: device number, or 'simulated' for a simulated cell (default 0)
+        :type device: int or str
+        :param operator_config: config file for the Operator (default None uses the default config)
+        :type operator_config: str or None
+        """
+        with open(filename, 'r') as f:
+            test_config = yaml.safe_load(f)
+        test_config['config_file'] = filename
+        if name is None:
+            name = os.path.splitext(os.path.basename(filename))[0]
+        self.add_device(name, device, test_config, operator_config)
+
+    @classmethod
+    def from_file(cls, filename, poll_interval=0.5, simulation_speed=None):
+        """
+        Create an Orchestrator from a rack yml file (see module docstring). Connects to all devices.
+
+        :param filename: path of the rack file
+        :type filename: str
+        :param poll_interval: time between checks of the stop conditions (s) (default 0.5)
+        :type poll_interval: float
+        :param simulation_speed: overrides the simulation_speed of the rack file (default None)
+        :type simulation_speed: float or None
+        :return: the orchestrator
+        :rtype: Orchestrator
+        """
+        with open(filename, 'r') as f:
+            rack = yaml.safe_load(f)
+        folder = os.path.dirname(os.path.abspath(filename))
+        recording_folder = rack.get('recording_folder')
+        if recording_folder is not None:
+            recording_folder = os.path.join(folder, recording_folder)
+        if simulation_speed is None:
+            simulation_speed = rack.get('simulation_speed', 1.0)
+        catalog = rack.get('catalog')
+        if catalog is not None:
+            catalog = os.path.join(folder, catalog)
+        orchestrator = cls(poll_interval, rack.get('status_interval'), recording_folder, simulation_speed, catalog,
+                           rack.get('stats_port'))
+        for cell in rack['cells']:
+            orchestrator.add_test_file(os.path.join(folder, cell['test']), cell['name'], cell.get('device', 0),
+                                       cell.get('operator_config'))
+        return orchestrator
+
+    def start(self):
+        """Start the tests of all cells."""
+        for test in self.tests:
+            if self.catalog is not None:
+                test.operator.properties['catalog'] = self.catalog
+            test.start(self.recording_folder)
+
+    def check(self):
+        """
+        Check the stop conditions of all cells.
+
+        :return: number of tests still running
+        :rtype: int
+        """
+        return sum(test.check() for test in self.tests)
+
+    def stop(self, reason='stopped'):
+        """Stop all running tests (also interrupts run())."""
+        if self._pacer is not None:
+            self._pacer.interrupt()
+        for test in self.tests:
+            test.stop(reason)
+
+    def status(self):
+        """
+        :return: status of every cell (see CellTest.status) and the number of running, finished and failed tests
+        :rtype: dict
+        """
+        cells = [test.status() for test in self.tests]
+        states = [cell['state'] for cell in cells]
+        return {'cells': cells, 'running': states.count('running'), 'finished': states.count('finished'),
+                'error': states.count('error')}
+
+    def stats(self):
+        """
+        :return: timing statistics of every cell (see stats() of OperatorBase), by name
+        :rtype: dict
+        """
+        return {test.name: test.operator.stats() for test in self.tests}
+
+    def prometheus_text(self):
+        """
+        :return: the timing statistics of all cells in the Prometheus text format, labelled by cell
+        :rtype: str
+        """
+        return prometheus_text([({'cell': name}, stats) for name, stats in self.stats().items()])
+
+    def log_status(self):
+        """Log one line per cell with its state and last measurement."""
+        for cell in self.status()['cells']:
+            self.logger.info('{name}: {state} {elapsed:.0f}s {voltage:.3f}V {current:.1f}mA (out {out_voltage:.3f}V) '
+                             '{charge:.2f}mAh {energy:.2f}mWh {reason}'.format(**cell))
+
+    def run(self):
+        """
+        Start all tests and check them until all are finished (or stop() is called or Ctrl+C is pressed).
+
+        :return: final status (see status())
+        :rtype: dict
+        """
+        server = None
+        if self.stats_port is not None:
+            server = StatsServer(self.prometheus_text, self.stats_port)
+            server.start()
+        self.start()
+        self._pacer = Pacer(self.poll_interval)
+        status_ticks = max(1, round(self.status_interval / self.poll_interval)) if self.status_interval else 0
+        try:
+            while self.check() and self._pacer.wait():
+                if status_ticks and self._pacer.ticks % status_ticks == 0:
+                    self.log_status()
+        except KeyboardInterrupt:
+            self.logger.warning('Interrupted')
+        finally:
+            self.stop('interrupted')
+            if server is not None:
+                server.stop()
+        self.log_status()
+        return self.status()
+
+    def close(self):
+        """Stop all tests and disconnect from the devices."""
+        self.stop()
+        for test in self.tests:
+            test.operator.disconnect_devices()
+
+
+if __name__ == '__main__':
+    import Battery_Testing_Software.labphew
+    Battery_Testing_Software.labphew.configure_logging()  # use labphew style logging
+
+    # Run the two example tests at once on simulated cells
+    folder = os.path.join(os.path.dirname(Battery_Testing_Software.labphew.package_path), 'examples', '101_project')
+    orchestrator = Orchestrator(status_interval=5)
+    for name, test_file in [('cell_1', 'current_test_example.yml'), ('cell_2', 'voltage_test_example.yml')]:
+        with open(os.path.join(folder, test_file), 'r') as f:
+            orchestrator.add_device(name, 'simulated', yaml.safe_load(f))
+    orchestrator.run()
+    orchestrator.close()
@@ -19,14 +19,15 @@ Examples of how to use can be found at the end of the file under if __name__=='_
 """
 
 import pyqtgraph as pg   # used for additional plotting features
-from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import QIcon
 import labphew
 import logging
 import os
 from time import time
-from labphew.core.tools.gui_tools import set_spinbox_stepsize, ValueLabelItem, SaverWidget, ModifyConfig, fit_on_screen
+from labphew.core.tools.gui_tools import set_spinbox_stepsize, ValueLabelItem, SaverWidget, ModifyConfig, fit_on_screen, \
+    plot_width
+from labphew.core.tools.decimation import minmax_decimate, MinMaxDecimator
 from labphew.core.base.general_worker import WorkThread
 from labphew.core.base.view_base import MonitorWindowBase, ScanWindowBase
 os.environ['QT_MAC_WANTS_LAYER'] = '1'  # added to fix operation on mac
@@ -53,10 +54,13 @@ class MonitorWindow(MonitorWindowBase):
 
         self.set_UI()
 
-        # create thread and timer objects for monitor
-        self.monitor_timer = QTimer()
-        self.monitor_timer.timeout.connect(self.update_monitor)
+        # create thread for monitor, it pushes new data to update_monitor (at most once per gui_refresh_time)
         self.monitor_thread = WorkThread(self.operator._monitor_loop)
+        self.monitor_publisher = self.monitor_thread.publish(
+            self.operator, 'new_monitor_data', fetch=lambda: self.operator.monitor_buffer.snapshot(),
+            frame_interval=self.operator.properties['monitor']['gui_refresh_time'] / 1000)
+        self.monitor_publisher.data_ready.connect(self.update_monitor)
+        self.monitor_thread.finished.connect(self.monitor_finished)
 
     def set_UI(self):
         """ Code-based generation of the user-interface based on PyQT """
@@ -267,7 +271,6 @@ class MonitorWindow(MonitorWindowBase):
             self.logger.debug('Starting monitor')
             self.operator._allow_monitor = True  # enable operator monitor loop to run
             self.monitor_thread.start()  # start the operator monitor
-            self.monitor_timer.start(self.operator.properties['monitor']['gui_refresh_time'])  # start the update timer
             self.plot_points_spinbox.setEnabled(False)
             self.start_button.setEnabled(False)
 
@@ -289,24 +292,30 @@ class MonitorWindow(MonitorWindowBase):
             self.operator._allow_monitor = False  # disable monitor again
             self.operator._busy = False  # Reset in case the monitor was not stopped gracefully, but forcefully stopped
 
-    def update_monitor(self):
+    def update_monitor(self, data):
         """
-        Checks if new data is available and updates the graph.
-        Checks if thread is still running and if not: stops timer and reset gui elements
-        (called by timer)
+        Updates the graph with new data.
+        Only the min/max envelope is plotted (about 2 points per pixel), so the drawing time doesn't depend on the
+        number of plot points.
+        (called by the publisher of the monitor thread when there's new data, see WorkThread.publish)
+
+        :param data: snapshot of the monitor buffer (time, analog in 1, analog in 2)
+        :type data: tuple of numpy.ndarray
         """
-        if self.operator._new_monitor_data:
-            self.operator._new_monitor_data = False
-            self.curve1.setData(self.operator.analog_monitor_time, self.operator.analog_monitor_1)
-            self.curve2.setData(self.operator.analog_monitor_time, self.operator.analog_monitor_2)
-            self.label_1.setValue(self.operator.analog_monitor_1[-1])
-            self.label_2.setValue(self.operator.analog_monitor_2[-1])
+        monitor_time, analog_1, analog_2 = data  # a copy, the operator keeps writing
+        self.curve1.setData(*minmax_decimate(monitor_time, analog_1, plot_width(self.plot1)))
+        self.curve2.setData(*minmax_decimate(monitor_time, analog_2, plot_width(self.plot2)))
+        self.label_1.setValue(analog_1[-1])
+        self.label_2.setValue(analog_2[-1])
 
-        if self.monitor_thread.isFinished():
-            self.logger.debug('Monitor thread is finished')
-            self.monitor_timer.stop()
-            self.plot_points_spinbox.setEnabled(True)
-            self.start_button.setEnabled(True)
+    def monitor_finished(self):
+        """
+        Resets gui elements when the monitor thread is finished.
+        (called by the finished signal of the monitor thread)
+        """
+        self.logger.debug('Monitor thread is finished')
+        self.plot_points_spinbox.setEnabled(True)
+        self.start_button.setEnabled(True)
 
     def closeEvent(self, event):
         """ Gets called when the window is closed. Could be used to do some cleanup before closing. """
@@ -318,7 +327,7 @@ class MonitorWindow(MonitorWindowBase):
         #     event.ignore()
         #     return
         self.stop_monitor()  # stop monitor if it was running
-        self.monitor_timer.stop()  # stop monitor timer, just to be nice
+        self.monitor_publisher.close()  # stop pushing data to the gui
         # Close all child scan windows
         for scan_win in self.scan_windows.values():
             scan_win[0].close()
@@ -339,9 +348,17 @@ class ScanWindow(ScanWindowBase):
 
         self.set_UI()
 
-        # create thread and timer objects for scan
-        self.scan_timer = QTimer(timeout=self.update_scan)
+        # create thread for scan, it pushes new data to update_scan (at most once per gui_refresh_time)
+        self.scan_trace = MinMaxDecimator(plot_width(self.plot1))  # decimated scan data for display
+        self._scan_source = None  # the list of scan voltages of the operator that scan_trace was built from
         self.scan_thread = WorkThread(self.operator.do_scan)
+        self.scan_publisher = self.scan_thread.publish(
+            self.operator, 'new_scan_data',
+            fetch=lambda: (getattr(self.operator, 'scan_voltages', []),
+                           getattr(self.operator, 'measured_voltages', [])),
+            frame_interval=self.operator.properties['scan']['gui_refresh_time'] / 1000)
+        self.scan_publisher.data_ready.connect(self.update_scan)
+        self.scan_thread.finished.connect(self.scan_finished)
 
     def set_UI(self):
         """
@@ -521,7 +538,6 @@ class ScanWindow(ScanWindowBase):
             self.stop_button.setEnabled(True)
             # self.operator._stop = False  # enable operator monitor loop to run
             self.scan_thread.start()  # start the operator monitor
-            self.scan_timer.start(self.operator.properties['scan']['gui_refresh_time'])  # start the update timer
             self.scan_start_spinbox.setEnabled(False)
             self.scan_stop_spinbox.setEnabled(False)
             self.scan_step_spinbox.setEnabled(False)
@@ -561,19 +577,33 @@ class ScanWindow(ScanWindowBase):
         self.scan_thread.terminate()
         self.reset_fields()
 
-    def update_scan(self):
+    def update_scan(self, data):
         """
-        Checks if new data is available and updates the graph.
-        Checks if thread is still running and if not: stops timer and reset gui elements
-        (called by timer)
+        Updates the graph with new data.
+        Only the points added since the previous update are processed and only their min/max envelope is plotted, so
+        the drawing time doesn't depend on the length of the scan.
+        (called by the publisher of the scan thread when there's new data, see WorkThread.publish)
+
+        :param data: the scan voltages and measured voltages lists of the operator (which may still be growing)
+        :type data: tuple of lists
         """
-        if self.operator._new_scan_data:
-            self.operator._new_scan_data = False
-            self.curve1.setData(self.operator.scan_voltages, self.operator.measured_voltages)
-        if self.scan_thread.isFinished():
-            self.logger.debug('Scan thread is finished')
-            self.scan_timer.stop()
-            self.reset_fields()
+        voltages, measured = data
+        if voltages is not self._scan_source:  # the operator creates new lists for every scan
+            self._scan_source = voltages
+            self.scan_trace.clear()
+        n = min(len(voltages), len(measured))  # the operator may be appending to the lists
+        start = len(self.scan_trace)
+        self.scan_trace.resize(plot_width(self.plot1))
+        self.scan_trace.extend(voltages[start:n], measured[start:n])
+        self.curve1.setData(*self.scan_trace.data())
+
+    def scan_finished(self):
+        """
+        Resets gui elements when the scan thread is finished.
+        (called by the finished signal of the scan thread)
+        """
+        self.logger.debug('Scan thread is finished')
+        self.reset_fields()
 
     def closeEvent(self, event):
         """ Gets called when the window is closed. Could be used to do some cleanup before closing. """
@@ -585,12 +615,13 @@ class ScanWindow(ScanWindowBase):
         #     event.ignore()
         #     return
         self.stop_scan()  # stop scan
-        self.scan_timer.stop()  # stop scan timer, just to be sure
+        self.scan_publisher.close()  # stop pushing data to the gui
         event.accept()
 
 
 if __name__ == "__main__":
-    import labphew  # import this to use labphew style logging
+    import labphew
+    labphew.configure_logging()  # use labphew style logging
 
     import sys
     from PyQt5.QtWidgets import QApplication
@@ -25,7 +25,7 @@ Examples of how to use can be found at the end of the file under if __name__=='_
 import logging
 import labphew
 import os
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import *  # QMainWindow, QWidget, QPushButton, QVBoxLayout, QApplication, QSlider, QLabel, QAction
 from PyQt5.QtGui import QFont, QIcon
 import pyqtgraph as pg
@@ -55,10 +55,13 @@ class MonitorWindow(MonitorWindowBase):
 
         self.set_UI()
 
-        # create thread and timer objects for monitor
-        self.monitor_timer = QTimer()
-        self.monitor_timer.timeout.connect(self.update_monitor)
+        # create thread for monitor, it pushes new data to update_monitor (at most once per gui_refresh_time)
         self.monitor_thread = WorkThread(self.operator._monitor_loop)
+        self.monitor_publisher = self.monitor_thread.publish(
+            self.operator, 'new_monitor_data', fetch=lambda: getattr(self.operator, '_monitor_data', None),
+            frame_interval=self.operator.properties['monitor']['gui_refresh_time'] / 1000)
+        self.monitor_publisher.data_ready.connect(self.update_monitor)
+        self.monitor_thread.finished.connect(self.monitor_finished)
 
     def set_UI(self):
         """ Code-based generation of the user-interface based on PyQT """
@@ -111,7 +114,6 @@ class MonitorWindow(MonitorWindowBase):
             self.logger.debug('Starting monitor')
             self.operator._allow_monitor = True  # enable operator monitor loop to run
             self.monitor_thread.start()  # start the operator monitor
-            self.monitor_timer.start(self.operator.properties['monitor']['gui_refresh_time'])  # start the update timer
             self.button_start.setEnabled(False)
 
 
@@ -137,27 +139,32 @@ class MonitorWindow(MonitorWindowBase):
         high = self.operator.properties['blink instrument']['max_blink_period']
         self.operator.instrument.set_blink_period( value / 9 * (high-low) )
 
-    def update_monitor(self):
+    def update_monitor(self, data):
         """
-        Checks if new data is available and updates the gui.
-        Checks if thread is still running and if not: stops timer (and reset gui elements)
-        (called by timer)
+        Updates the gui with new data.
+        (called by the publisher of the monitor thread when there's new data, see WorkThread.publish)
+
+        :param data: time string and blink state (None if the monitor didn't produce data)
+        :type data: tuple or None
         """
-        if self.operator._new_monitor_data:
-            self.operator._new_monitor_data = False
-            blink_time, blink_state = self.operator._monitor_data
-            self.message.setText(blink_time)
-            if blink_state:
-                self.message.setFont(QFont("Arial", 12, QFont.Bold))
-                self.message.setStyleSheet("color: red;")
-            else:
-                self.message.setFont(QFont("Arial", 12, QFont.Thin))
-                self.message.setStyleSheet("color: white;")
+        if data is None:
+            return
+        blink_time, blink_state = data
+        self.message.setText(blink_time)
+        if blink_state:
+            self.message.setFont(QFont("Arial", 12, QFont.Bold))
+            self.message.setStyleSheet("color: red;")
+        else:
+            self.message.setFont(QFont("Arial", 12, QFont.Thin))
+            self.message.setStyleSheet("color: white;")
 
-        if self.monitor_thread.isFinished():
-            self.logger.debug('Monitor thread is finished')
-            self.monitor_timer.stop()
-            self.button_start.setEnabled(True)
+    def monitor_finished(self):
+        """
+        Resets gui elements when the monitor thread is finished.
+        (called by the finished signal of the monitor thread)
+        """
+        self.logger.debug('Monitor thread is finished')
+        self.button_start.setEnabled(True)
 
     def load_scan_guis(self, scan_windows):
         """
@@ -199,7 +206,7 @@ class MonitorWindow(MonitorWindowBase):
         #     event.ignore()
         #     return
         self.stop_monitor()  # stop monitor if it was running
-        self.monitor_timer.stop()  # stop monitor timer, just to be sure
+        self.monitor_publisher.close()  # stop pushing data to the gui
         # Close all child scan windows
         for scan_win in self.scan_windows.values():
             scan_win[0].close()
@@ -221,9 +228,15 @@ class ScanWindow(ScanWindowBase):
 
         self.set_UI()
 
-        # create thread and timer objects for scan
-        self.scan_timer = QTimer(timeout=self.update_scan)
+        # create thread for scan, it pushes new data to update_scan (at most once per gui_refresh_time, default 5ms)
         self.scan_thread = WorkThread(self.operator.do_scan)
+        self.scan_publisher = self.scan_thread.publish(
+            self.operator, 'new_scan_data',
+            fetch=lambda: (list(getattr(self.operator, 'point_number', [])),
+                           list(getattr(self.operator, 'measured_state', []))),
+            frame_interval=self.operator.properties.get('scan', {}).get('gui_refresh_time', 5) / 1000)
+        self.scan_publisher.data_ready.connect(self.update_scan)
+        self.scan_thread.finished.connect(self.scan_finished)
 
     def set_UI(self):
         """
@@ -309,11 +322,6 @@ class ScanWindow(ScanWindowBase):
 
             # self.operator._stop = False  # enable operator monitor loop to run
             self.scan_thread.start()  # start the operator monitor
-            # Start the update timer with time specified in config if available
-            try:
-                self.scan_timer.start(self.operator.properties['scan']['gui_refresh_time'])
-            except:
-                self.scan_timer.start(5)  # otherwise use default value
 
     def pause_scan(self):
         """
@@ -350,19 +358,23 @@ class ScanWindow(ScanWindowBase):
         self.scan_thread.terminate()
         self.reset_fields()
 
-    def update_scan(self):
+    def update_scan(self, data):
         """
-        Checks if new data is available and updates the graph.
-        Checks if thread is still running and if not: stops timer and reset gui elements
-        (called by timer)
+        Updates the graph with new data.
+        (called by the publisher of the scan thread when there's new data, see WorkThread.publish)
+
+        :param data: copies of the point numbers and measured states
+        :type data: tuple of lists
+        """
+        self.curve1.setData(*data)
+
+    def scan_finished(self):
         """
-        if self.operator._new_scan_data:
-            self.operator._new_scan_data = False
-            self.curve1.setData(self.operator.point_number, self.operator.measured_state)
-        if self.scan_thread.isFinished():
-            self.logger.debug('Scan thread is finished')
-            self.scan_timer.stop()
-            self.reset_fields()
+        Resets gui elements when the scan thread is finished.
+        (called by the finished signal of the scan thread)
+        """
+        self.logger.debug('Scan thread is finished')
+        self.reset_fields()
 
     def closeEvent(self, event):
         """ Gets called when the window is closed. Could be used to do some cleanup before closing. """
@@ -374,7 +386,7 @@ class ScanWindow(ScanWindowBase):
         #     event.ignore()
         #     return
         self.stop_scan()  # stop scan
-        self.scan_timer.stop()  # stop scan timer, just to be sure
+        self.scan_publisher.close()  # stop pushing data to the gui
         event.accept()
 
 